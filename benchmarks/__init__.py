@@ -0,0 +1 @@
+# Benchmarks for PLC SCADA Lab
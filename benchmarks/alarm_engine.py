@@ -0,0 +1,118 @@
+"""Alarm evaluation and journal query benchmark
+
+Configures `--alarms` alarms over a `--size` point image, split between
+high and low register alarms with deadbands and delays and bit alarms,
+and reports the cost of evaluating all of them per scan: on a quiet image
+where nothing changes state, and on scans where `--storm` of the alarms
+raise or clear at once. Then pages through the resulting journal.
+
+    python -m benchmarks.alarm_engine --alarms 10000 --size 65536
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from plc_scada_lab.backend.alarms import AlarmEngine, AlarmSet
+from plc_scada_lab.backend.image import ProcessImage
+from plc_scada_lab.backend.modbus_core import PLCSnapshot
+
+def alarm_set(alarms: int, size: int) -> AlarmSet:
+    """`alarms` alarms, a quarter each on high, low, coil and input points"""
+    n = max(1, alarms // 4)
+    stride = max(1, size // n)
+
+    def tags(area):
+        return [f"{area}:{i * stride}" for i in range(n)]
+
+    return AlarmSet({"name": f"benchmark set of {4 * n} alarms", "alarms": [
+        {"name": "high", "tag": tags("hr"), "high": 1000, "deadband": 20,
+         "on_delay": 0, "priority": 2},
+        {"name": "low", "tag": tags("ir"), "low": 100, "deadband": 5,
+         "off_delay": 0, "priority": 3},
+        {"name": "trip", "tag": tags("co"), "priority": 1},
+        {"name": "permissive", "tag": [f"!{tag}" for tag in tags("di")], "priority": 4},
+    ]})
+
+class _PLC:
+    """Just enough of a PLC to attach alarms to"""
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self.observers = []
+
+def _snapshot(image: ProcessImage, scan: int) -> PLCSnapshot:
+    return PLCSnapshot.build(image.copy(readonly=True), scan, False, False, 0.1, time.time())
+
+def main(args):
+    alarms = alarm_set(args.alarms, args.size)
+    image = ProcessImage(args.size)
+    image.input_registers[:] = 500
+    image.discrete_inputs[:] = True
+    engine = AlarmEngine(alarms)
+    state = engine.attach(1, _PLC(_snapshot(image, 0)))
+
+    # Quiet: values move, but no alarm changes state
+    rng = np.random.default_rng(args.alarms)
+    snapshots = []
+    for scan in range(1, 21):
+        image.holding_registers[:] = rng.integers(0, 900, args.size)
+        snapshots.append(_snapshot(image, scan))
+    started = time.perf_counter()
+    for i in range(args.scans):
+        snapshot = snapshots[i % len(snapshots)]
+        snapshot.scan_count = i + 1
+        state.evaluate(snapshot)
+    quiet = (time.perf_counter() - started) / args.scans
+
+    # Storm: a fraction of the high alarms raise, then clear again
+    hr = alarms.tables["holding_registers"][1]
+    storm = rng.permutation(np.arange(args.size)[hr])[:max(1, int(args.alarms * args.storm))]
+    scan = args.scans + 1
+    started = time.perf_counter()
+    for i in range(args.storms):
+        image.holding_registers[storm] = 1200 if i % 2 == 0 else 0
+        state.evaluate(_snapshot(image, scan))
+        scan += 1
+    stormy = (time.perf_counter() - started) / args.storms
+
+    # Page through the newest events of one alarm kind
+    journal = state.journal
+    started = time.perf_counter()
+    page = engine.events(1, kinds=["raise"], limit=100)
+    first_page = time.perf_counter() - started
+    # Two alarms of the storm, found among all the events
+    stormed = [journal.names[i] for i in journal.records["alarm"][:2]]
+    started = time.perf_counter()
+    filtered = engine.events(1, alarms=stormed, limit=100)
+    filtered_page = time.perf_counter() - started
+    started = time.perf_counter()
+    active = engine.active(1, limit=100)
+    active_query = time.perf_counter() - started
+
+    print(json.dumps({
+        "alarms": len(alarms),
+        "image_points": args.size,
+        "quiet_scan_us": round(quiet * 1e6, 1),
+        "ns_per_alarm": round(quiet * 1e9 / len(alarms), 1),
+        "storm_alarms": int(storm.size),
+        "storm_scan_ms": round(stormy * 1e3, 2),
+        "journal_events": journal.count,
+        "event_page_ms": round(first_page * 1e3, 2),
+        "event_page_size": len(page["events"]),
+        "filtered_page_ms": round(filtered_page * 1e3, 2),
+        "filtered_page_size": len(filtered["events"]),
+        "active_alarms": active["total"],
+        "active_query_ms": round(active_query * 1e3, 2),
+    }, indent=2))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--alarms", type=int, default=10000)
+    parser.add_argument("--size", type=int, default=65536, help="image points per table")
+    parser.add_argument("--scans", type=int, default=2000, help="quiet scans to time")
+    parser.add_argument("--storm", type=float, default=0.1,
+                        help="fraction of the alarms changing state per storm scan")
+    parser.add_argument("--storms", type=int, default=20, help="storm scans to time")
+    main(parser.parse_args())
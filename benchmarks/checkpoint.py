@@ -0,0 +1,67 @@
+"""PLC checkpoint and warm restart benchmark
+
+For each image size, reports what a checkpoint costs the scan thread (the
+state copy at the scan boundary), what the writer thread spends on
+writing, checksumming and syncing it, and how long restoring a PLC from
+its checkpoint file takes at startup.
+
+    python -m benchmarks.checkpoint --sizes 64 10000 65536
+"""
+import argparse
+import json
+import pathlib
+import tempfile
+import time
+
+from plc_scada_lab.backend.checkpoint import CheckpointFile, FleetCheckpoints, fingerprint
+from plc_scada_lab.backend.modbus_core import PLCSimulator
+
+def timed(function, repeat: int) -> float:
+    """Average seconds of `function()` over `repeat` calls"""
+    started = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - started) / repeat
+
+def measure(size: int, repeat: int, directory: pathlib.Path) -> dict:
+    plc = PLCSimulator(size)
+    for _ in range(10):
+        plc.scan_once()
+    state = plc.capture_state()
+    directory = directory / str(size)
+    path = FleetCheckpoints(directory).path(1)
+    checkpoint = CheckpointFile(path, fingerprint(plc), [len(part) for part in state])
+    capture = timed(plc.capture_state, repeat)
+    write = timed(lambda: checkpoint.write(plc.scan_count, time.time(), state, sync=False), repeat)
+    synced = timed(lambda: checkpoint.write(plc.scan_count, time.time(), state), max(1, repeat // 10))
+    checkpoint.close()
+
+    # Restore into PLCs built beforehand: only the restore itself is timed
+    plcs = [PLCSimulator(size) for _ in range(max(1, repeat // 10))]
+    restores = []
+    for fresh in plcs:
+        restored = FleetCheckpoints(directory)
+        started = time.perf_counter()
+        restored.attach(1, fresh)
+        restores.append(time.perf_counter() - started)
+        restored.files[1].close()
+    return {
+        "size": size,
+        "state_bytes": sum(len(part) for part in state),
+        "scan_thread_us": round(capture * 1e6, 1),
+        "write_us": round(write * 1e6, 1),
+        "write_synced_us": round(synced * 1e6, 1),
+        "restore_ms": round(sum(restores) / len(restores) * 1e3, 3),
+    }
+
+def main(args):
+    with tempfile.TemporaryDirectory() as directory:
+        results = [measure(size, args.repeat, pathlib.Path(directory)) for size in args.sizes]
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[64, 10000, 65536],
+                        help="image points per table")
+    parser.add_argument("--repeat", type=int, default=200)
+    main(parser.parse_args())
@@ -0,0 +1,101 @@
+"""Cold start benchmark of the web app
+
+Starts the app with `run.py` in a child process, `--repeat` times, and
+times how long it takes from spawning the process until the first
+`GET /health` and the first `GET /` are answered. Also times a bare
+`import plc_scada_lab.backend.api` in a fresh interpreter, and reports the
+app's own per-subsystem startup breakdown from `GET /api/startup` where
+the app has it. `--disable` leaves subsystems out (see `APP_DISABLE`).
+
+    python -m benchmarks.cold_start --repeat 5
+    python -m benchmarks.cold_start --disable modbus historian alarms
+"""
+import argparse
+import http.client
+import json
+import os
+import pathlib
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+POLL_INTERVAL = 0.005
+
+def get(port: int, path: str) -> tuple:
+    """(status, body) of one request, status 0 while nothing listens"""
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+    try:
+        connection.request("GET", path)
+        response = connection.getresponse()
+        return response.status, response.read()
+    except OSError:
+        return 0, b""
+    finally:
+        connection.close()
+
+def start(port: int, modbus_port: int, disable: list, timeout: float = 60.0) -> dict:
+    """Times of one cold start, in milliseconds from spawning run.py"""
+    with tempfile.TemporaryDirectory(prefix="cold-start-") as directory:
+        env = dict(os.environ, PORT=str(port), MODBUS_PORT=str(modbus_port), HISTORIAN_DIR="",
+                   ALARM_DIR=str(pathlib.Path(directory) / "alarms"), APP_DISABLE=",".join(disable))
+        started = time.perf_counter()
+        process = subprocess.Popen([sys.executable, str(ROOT / "run.py")], cwd=ROOT, env=env,
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            deadline = time.monotonic() + timeout
+            while get(port, "/health")[0] != 200:
+                if process.poll() is not None:
+                    raise RuntimeError(f"run.py exited with status {process.returncode}")
+                if time.monotonic() > deadline:
+                    raise RuntimeError("run.py did not answer /health")
+                time.sleep(POLL_INTERVAL)
+            health = time.perf_counter() - started
+            status, _ = get(port, "/")
+            index = time.perf_counter() - started
+            status, body = get(port, "/api/startup")
+            return {
+                "health_ms": round(health * 1000.0, 1),
+                "index_ms": round(index * 1000.0, 1),
+                "startup": json.loads(body) if status == 200 else None,
+            }
+        finally:
+            process.terminate()
+            try:
+                process.wait(10.0)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+def import_ms() -> float:
+    """Milliseconds a fresh interpreter takes to import the app module, startup excluded"""
+    code = ("import time; started = time.perf_counter(); import plc_scada_lab.backend.api; "
+            "print((time.perf_counter() - started) * 1000.0)")
+    env = dict(os.environ, HISTORIAN_DIR="", MODBUS_PORT="0")
+    with tempfile.TemporaryDirectory(prefix="cold-start-") as directory:
+        env["ALARM_DIR"] = directory
+        output = subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=env, check=True,
+                                capture_output=True, text=True).stdout
+    return float(output.split()[-1])
+
+def main(args):
+    imports = [import_ms() for _ in range(args.repeat)]
+    runs = [start(args.port, args.modbus_port, args.disable) for _ in range(args.repeat)]
+    print(json.dumps({
+        "disabled": args.disable,
+        "import_ms": round(statistics.median(imports), 1),
+        "first_health_ms": {"median": statistics.median(run["health_ms"] for run in runs),
+                            "min": min(run["health_ms"] for run in runs)},
+        "first_index_ms": {"median": statistics.median(run["index_ms"] for run in runs),
+                           "min": min(run["index_ms"] for run in runs)},
+        "startup": runs[-1]["startup"],
+    }, indent=2))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--disable", nargs="*", default=[], help="subsystems to leave out")
+    parser.add_argument("--port", type=int, default=18761)
+    parser.add_argument("--modbus-port", type=int, default=18762)
+    main(parser.parse_args())
@@ -0,0 +1,366 @@
+"""End-to-end load and latency benchmark of the web app
+
+Starts the app with `run.py` in a child process (or targets a running one
+with `--url`) and, for every step of `--clients` x `--points`, connects
+that many WebSocket clients watching that many holding registers. The
+clients take turns sending `set_register` and `toggle_input` actions, one
+at a time, and each action is timed until every client has seen its
+effect in a state delta:
+
+- action-to-broadcast latency, per client and action (p50/p95/p99/max)
+- fan-out, the spread between the first and the last client seeing it
+- latency of `GET /api/state` and `POST /api/action` on one keep-alive
+  connection
+- scan jitter and overruns of the PLC, from `GET /api/scan`
+- CPU use and RSS of the server process (only when started here)
+
+Results are printed as JSON. `--output` also writes them to a file and
+`--compare` checks them against such a file from an earlier commit,
+listing every latency, CPU or memory figure that got worse by more than
+`--tolerance`; the exit status is 1 if any did.
+
+    python -m benchmarks.end_to_end --clients 1 10 100 --points 8 1000 --output e2e.json
+    python -m benchmarks.end_to_end --compare e2e.json
+"""
+import argparse
+import asyncio
+import http.client
+import json
+import os
+import pathlib
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.parse
+
+import numpy as np
+import websockets
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+REGISTER = 6  # Holding register and discrete input no program or process uses
+INPUT = 5
+# Figures where more is worse, compared by --compare
+COMPARED = ("ws_latency_ms.p50", "ws_latency_ms.p99", "fanout_ms.p99",
+            "rest_state_ms.p99", "rest_action_ms.p99", "scan_jitter_p99_ms",
+            "server_cpu_percent", "server_rss_mb")
+
+def percentiles(samples) -> dict:
+    """p50/p95/p99/max of samples in seconds, as milliseconds"""
+    if not len(samples):
+        return {"p50": None, "p95": None, "p99": None, "max": None}
+    ms = np.asarray(samples) * 1000.0
+    return {
+        "p50": round(float(np.percentile(ms, 50)), 2),
+        "p95": round(float(np.percentile(ms, 95)), 2),
+        "p99": round(float(np.percentile(ms, 99)), 2),
+        "max": round(float(ms.max()), 2),
+    }
+
+def process_usage(pid: int) -> tuple:
+    """(CPU seconds, RSS bytes) of a process, from /proc (Linux)"""
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    cpu = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    return cpu, int(fields[21]) * os.sysconf("SC_PAGE_SIZE")
+
+class Server:
+    """The app started with run.py on free ports, for one benchmark run"""
+
+    def __init__(self, size: int, port: int, modbus_port: int):
+        self.directory = tempfile.TemporaryDirectory(prefix="e2e-")
+        fleet = pathlib.Path(self.directory.name) / "fleet.json"
+        fleet.write_text(json.dumps({"plcs": [{"id": 1, "size": size}]}))
+        env = dict(os.environ, PORT=str(port), MODBUS_PORT=str(modbus_port),
+                   PLC_FLEET=str(fleet), HISTORIAN_DIR="",
+                   ALARM_DIR=str(pathlib.Path(self.directory.name) / "alarms"))
+        self.process = subprocess.Popen([sys.executable, str(ROOT / "run.py")], cwd=ROOT, env=env,
+                                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self.port = port
+        self.url = f"http://127.0.0.1:{port}"
+
+    @property
+    def pid(self) -> int:
+        return self.process.pid
+
+    def wait(self, timeout: float = 60.0):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"run.py exited with status {self.process.returncode}")
+            try:
+                socket.create_connection(("127.0.0.1", self.port), 1.0).close()
+                return
+            except OSError:
+                time.sleep(0.2)
+        raise RuntimeError("run.py did not start listening")
+
+    def stop(self):
+        self.process.terminate()
+        try:
+            self.process.wait(10.0)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        self.directory.cleanup()
+
+class Rest:
+    """Timed requests over one keep-alive HTTP connection"""
+
+    def __init__(self, url: str):
+        parts = urllib.parse.urlsplit(url)
+        self.connection = http.client.HTTPConnection(parts.hostname, parts.port, timeout=30)
+
+    def request(self, method: str, path: str, body: dict = None) -> tuple:
+        """(seconds, decoded JSON) of one request"""
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        started = time.perf_counter()
+        self.connection.request(method, path, json.dumps(body) if body is not None else None,
+                                headers)
+        response = self.connection.getresponse()
+        data = response.read()
+        elapsed = time.perf_counter() - started
+        if response.status != 200:
+            raise RuntimeError(f"{method} {path} failed: {response.status} {data[:200]!r}")
+        return elapsed, json.loads(data)
+
+    def close(self):
+        self.connection.close()
+
+class Client:
+    """A WebSocket client tracking the register and input the actions change"""
+
+    def __init__(self, websocket, bench: "Bench"):
+        self.websocket = websocket
+        self.bench = bench
+        self.register = None
+        self.input = None
+        self.reader = asyncio.ensure_future(self._read())
+
+    async def _read(self):
+        register, bit = f'"{REGISTER}"', f'"{INPUT}"'
+        try:
+            async for text in self.websocket:
+                # Most deltas only carry the process values, skip parsing them
+                if register not in text and bit not in text:
+                    continue
+                message = json.loads(text)
+                if message.get("kind") != "delta":
+                    continue
+                payload = message["payload"]
+                value = payload.get("holding_registers", {}).get(str(REGISTER))
+                if value is not None:
+                    self.register = value
+                value = payload.get("discrete_inputs", {}).get(str(INPUT))
+                if value is not None:
+                    self.input = value
+                self.bench.seen(self)
+        except websockets.ConnectionClosed:
+            pass
+
+    async def close(self):
+        await self.websocket.close()
+        self.reader.cancel()
+
+class Bench:
+    """One step: clients, actions and the broadcasts they cause"""
+
+    def __init__(self):
+        self.clients = []
+        self.expected = None  # ("register" or "input", value) of the action in flight
+        self.times = {}       # client -> when it saw the expected value
+        self.done = None
+
+    def seen(self, client: Client):
+        if self.expected is None or client in self.times:
+            return
+        attribute, value = self.expected
+        if getattr(client, attribute) == value:
+            self.times[client] = time.perf_counter()
+            if len(self.times) == len(self.clients):
+                self.done.set()
+
+    async def connect(self, url: str, count: int, points: int):
+        ws_url = url.replace("http", "ws", 1) + "/ws?plc=1"
+        subscribe = json.dumps({"kind": "subscribe", "payload": {
+            "holding_registers": [[0, max(points, REGISTER + 1)]],
+            "discrete_inputs": [[0, 8]]}})
+        for batch in range(0, count, 50):
+            sockets = await asyncio.gather(*(
+                websockets.connect(ws_url, max_size=None, ping_interval=None)
+                for _ in range(min(50, count - batch))))
+            for websocket in sockets:
+                await websocket.send(subscribe)
+                self.clients.append(Client(websocket, self))
+        # Wait for every client's keyframe
+        deadline = time.monotonic() + 30.0
+        while any(c.register is None or c.input is None for c in self.clients):
+            if time.monotonic() > deadline:
+                raise RuntimeError("Clients did not receive their keyframes")
+            await asyncio.sleep(0.05)
+
+    async def act(self, i: int, timeout: float) -> tuple:
+        """Send action `i` from one client, returns (sent, [seen by each client])"""
+        sender = self.clients[i % len(self.clients)]
+        if i % 2 == 0:
+            value = (sender.register + 1) % 65536
+            self.expected = ("register", value)
+            payload = {"action_type": "set_register", "address": REGISTER, "value": value}
+        else:
+            self.expected = ("input", not sender.input)
+            payload = {"action_type": "toggle_input", "address": INPUT}
+        self.times = {}
+        self.done = asyncio.Event()
+        for client in self.clients:
+            self.seen(client)  # Already there, e.g. an earlier action timed out
+        sent = time.perf_counter()
+        await sender.websocket.send(json.dumps({"kind": "action", "payload": payload}))
+        try:
+            await asyncio.wait_for(self.done.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self.expected = None
+        return sent, list(self.times.values())
+
+    async def close(self):
+        await asyncio.gather(*(client.close() for client in self.clients))
+        self.clients = []
+
+async def step(args, url: str, pid: int, clients: int, points: int) -> dict:
+    bench = Bench()
+    await bench.connect(url, clients, points)
+    rest = Rest(url)
+    try:
+        _, scan = await asyncio.to_thread(rest.request, "GET", "/api/scan?plc=1")
+        overruns = scan["stats"].get("overruns", 0)
+        usage = process_usage(pid) if pid else None
+        started = time.perf_counter()
+
+        latencies, fanouts, missed = [], [], 0
+        for i in range(args.actions):
+            sent, seen = await bench.act(i, args.timeout)
+            missed += clients - len(seen)
+            latencies.extend(t - sent for t in seen)
+            if seen:
+                fanouts.append(max(seen) - min(seen))
+
+        state_times, action_times = [], []
+        for i in range(args.requests):
+            elapsed, _ = await asyncio.to_thread(rest.request, "GET", "/api/state?plc=1")
+            state_times.append(elapsed)
+            elapsed, _ = await asyncio.to_thread(rest.request, "POST", "/api/action", {
+                "action_type": "set_register", "address": REGISTER + 1, "value": i, "plc": 1})
+            action_times.append(elapsed)
+
+        elapsed = time.perf_counter() - started
+        _, scan = await asyncio.to_thread(rest.request, "GET", "/api/scan?plc=1")
+        result = {
+            "clients": clients,
+            "points": points,
+            "actions": args.actions,
+            "missed_broadcasts": missed,
+            "ws_latency_ms": percentiles(latencies),
+            "fanout_ms": percentiles(fanouts),
+            "rest_state_ms": percentiles(state_times),
+            "rest_action_ms": percentiles(action_times),
+            "scan_jitter_p99_ms": scan["stats"].get("jitter_p99_ms"),
+            "scan_overruns": scan["stats"].get("overruns", 0) - overruns,
+        }
+        if usage is not None:
+            cpu, rss = process_usage(pid)
+            result["server_cpu_percent"] = round(100.0 * (cpu - usage[0]) / elapsed, 1)
+            result["server_rss_mb"] = round(rss / 2**20, 1)
+        return result
+    finally:
+        rest.close()
+        await bench.close()
+
+def _get(result: dict, path: str):
+    for key in path.split("."):
+        result = result.get(key) if isinstance(result, dict) else None
+    return result
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """Figures of `results` worse than in `baseline` by more than `tolerance`"""
+    previous = {(s["clients"], s["points"]): s for s in baseline.get("steps", [])}
+    regressions = []
+    for current in results["steps"]:
+        before = previous.get((current["clients"], current["points"]))
+        if before is None:
+            continue
+        for figure in COMPARED:
+            new, old = _get(current, figure), _get(before, figure)
+            if new is None or not old:
+                continue
+            if new > old * (1.0 + tolerance):
+                regressions.append({"clients": current["clients"], "points": current["points"],
+                                    "figure": figure, "baseline": old, "current": new,
+                                    "change": f"{100.0 * (new - old) / old:+.0f}%"})
+    return regressions
+
+def commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True,
+                              capture_output=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+async def run(args) -> dict:
+    server = None
+    url, pid = args.url, None
+    if url is None:
+        server = Server(max(args.points), args.port, args.modbus_port)
+        url, pid = server.url, server.pid
+        await asyncio.to_thread(server.wait)
+        await asyncio.sleep(args.warmup)
+    try:
+        steps = []
+        for points in args.points:
+            for clients in args.clients:
+                steps.append(await step(args, url, pid, clients, points))
+    finally:
+        if server is not None:
+            server.stop()
+    return {
+        "commit": commit(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "cpus": os.cpu_count(),
+        "steps": steps,
+    }
+
+def main(args):
+    results = asyncio.run(run(args))
+    status = 0
+    if args.compare:
+        baseline = json.loads(pathlib.Path(args.compare).read_text())
+        results["baseline"] = baseline.get("commit")
+        results["regressions"] = compare(results, baseline, args.tolerance)
+        status = 1 if results["regressions"] else 0
+    text = json.dumps(results, indent=2)
+    if args.output:
+        pathlib.Path(args.output).write_text(text + "\n")
+    print(text)
+    sys.exit(status)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", help="target an already running server, e.g. http://127.0.0.1:8000")
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 10, 100],
+                        help="WebSocket clients per step")
+    parser.add_argument("--points", type=int, nargs="+", default=[8],
+                        help="holding registers each client watches, per step")
+    parser.add_argument("--actions", type=int, default=40, help="actions timed per step")
+    parser.add_argument("--requests", type=int, default=100,
+                        help="REST requests of each kind timed per step")
+    parser.add_argument("--timeout", type=float, default=5.0,
+                        help="seconds to wait for an action to reach every client")
+    parser.add_argument("--warmup", type=float, default=2.0,
+                        help="seconds between server start and the first step")
+    parser.add_argument("--port", type=int, default=18000)
+    parser.add_argument("--modbus-port", type=int, default=15040)
+    parser.add_argument("--output", help="also write the results to this file")
+    parser.add_argument("--compare", help="results file of an earlier run to check against")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="relative change counted as a regression")
+    main(parser.parse_args())
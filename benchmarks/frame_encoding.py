@@ -0,0 +1,75 @@
+"""JSON vs binary state frame benchmark
+
+Encodes keyframes and deltas of a subscription covering every table of an
+image, once as JSON text and once as binary frames (`binary_frames`), and
+reports the encode time and size of each per image size. Deltas change
+`--change` of the points of every table.
+
+    python -m benchmarks.frame_encoding --sizes 64 1000 10000
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from plc_scada_lab.backend.image import TABLES, ProcessImage
+from plc_scada_lab.backend.streaming import Delta, SubscriptionGroup, subscription_key
+
+STATUS = {"motor_running": True, "pump_running": False, "scan_time": 0.1}
+
+def _time(fn, repeat: int) -> float:
+    """Best-of-three average seconds per call"""
+    best = float("inf")
+    for _ in range(3):
+        started = time.perf_counter()
+        for _ in range(repeat):
+            fn()
+        best = min(best, (time.perf_counter() - started) / repeat)
+    return best
+
+def _delta(image: ProcessImage, change: float, rng) -> Delta:
+    tables = {}
+    for table in TABLES:
+        data = image.table(table)
+        indices = np.sort(rng.choice(image.size, max(1, int(image.size * change)), replace=False))
+        tables[table] = (indices, data[indices])
+    return Delta(tables, {}, STATUS)
+
+def measure(size: int, change: float, repeat: int) -> dict:
+    rng = np.random.default_rng(size)
+    image = ProcessImage(size)
+    for table in TABLES:
+        image.write(table, 0, rng.integers(0, 1000, size))
+    key = subscription_key({table: [[0, size]] for table in TABLES}, size)
+    delta = _delta(image, change, rng)
+    result = {"points": size, "changed_per_table": int(delta.tables[TABLES[0]][0].size)}
+    for name, binary in (("json", False), ("binary", True)):
+        group = SubscriptionGroup(key, binary)
+        keyframe = group.keyframe(image, STATUS, 1)
+        frame = group.delta_frame(delta, 2)
+        result[name] = {
+            "keyframe_bytes": len(keyframe if binary else keyframe.encode()),
+            "keyframe_encode_us": round(_time(lambda: group.keyframe(image, STATUS, 1), repeat) * 1e6, 1),
+            "delta_bytes": len(frame if binary else frame.encode()),
+            "delta_encode_us": round(_time(lambda: group.delta_frame(delta, 2), repeat) * 1e6, 1),
+        }
+    for kind in ("keyframe", "delta"):
+        result[f"{kind}_size_ratio"] = round(
+            result["json"][f"{kind}_bytes"] / result["binary"][f"{kind}_bytes"], 1)
+        result[f"{kind}_speedup"] = round(
+            result["json"][f"{kind}_encode_us"] / result["binary"][f"{kind}_encode_us"], 1)
+    return result
+
+def main(args):
+    results = [measure(size, args.change, max(1, args.repeat * 64 // size)) for size in args.sizes]
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[64, 1000, 10000])
+    parser.add_argument("--change", type=float, default=0.1,
+                        help="fraction of the points of each table changed per delta")
+    parser.add_argument("--repeat", type=int, default=2000,
+                        help="encodes per measurement at 64 points, scaled down for larger images")
+    main(parser.parse_args())
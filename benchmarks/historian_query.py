@@ -0,0 +1,81 @@
+"""Historian query benchmark
+
+Builds `--hours` of synthetic history for one 64-point PLC as on-disk
+segments (scans every 100 ms, `--changing` registers changing on every
+scan), then times downsampled queries: one tag over the whole span, many
+tags over the whole span, and one tag over the last hour at raw resolution.
+
+    python -m benchmarks.historian_query --hours 168 --changing 16 --tags 200
+"""
+import argparse
+import json
+import pathlib
+import tempfile
+import time
+
+import numpy as np
+
+from plc_scada_lab.backend.historian import Chunk, Historian, Recorder, Segment, point_id
+from plc_scada_lab.backend.image import TABLES
+
+SCAN = 0.1
+SEGMENT = 3600.0
+
+def synthetic_chunk(start: float, changing: int, size: int, rng) -> Chunk:
+    """One hour of scans: a keyframe of every point, then register changes"""
+    keyframe = np.array([point_id(table, a) for table in TABLES for a in range(size)],
+                        dtype=np.uint32)
+    scans = np.arange(start + SCAN, start + SEGMENT, SCAN)
+    registers = np.array([point_id("holding_registers", a) for a in range(changing)],
+                         dtype=np.uint32)
+    ts = np.concatenate([np.full(len(keyframe), start), np.repeat(scans, changing)])
+    point = np.concatenate([keyframe, np.tile(registers, len(scans))])
+    value = np.concatenate([np.zeros(len(keyframe), dtype=np.uint16),
+                            rng.integers(0, 1500, len(scans) * changing).astype(np.uint16)])
+    return Chunk(start, start + SEGMENT, ts, point, value)
+
+def timed(fn, repeat=5) -> float:
+    """Best of `repeat` runs, in milliseconds"""
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000.0
+
+def main(args):
+    rng = np.random.default_rng(1)
+    historian = Historian(None)
+    end = time.time()
+    start = end - args.hours * SEGMENT
+    with tempfile.TemporaryDirectory() as directory:
+        recorder = Recorder(historian, 1, 64)
+        historian.recorders[1] = recorder
+        built = time.perf_counter()
+        for hour in range(args.hours):
+            chunk = synthetic_chunk(start + hour * SEGMENT, args.changing, 64, rng)
+            recorder.segments.append(Segment.write(pathlib.Path(directory), chunk))
+        built = time.perf_counter() - built
+        events = sum(len(s.column("ts")) for s in recorder.segments)
+
+        areas = [f"{area}:{a}" for area in ("hr", "ir", "co", "di") for a in range(64)]
+        many = areas[:args.tags]
+        results = {
+            "hours": args.hours,
+            "events": events,
+            "build_s": round(built, 1),
+            "one_tag_full_span_ms": round(timed(
+                lambda: historian.query(1, ["hr:0"], start, end, points=1000)), 2),
+            f"{len(many)}_tags_full_span_ms": round(timed(
+                lambda: historian.query(1, many, start, end, points=1000), repeat=2), 1),
+            "one_tag_last_hour_raw_ms": round(timed(
+                lambda: historian.query(1, ["hr:0"], end - 3600, end, step=0.5)), 2),
+        }
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--hours", type=int, default=168)
+    parser.add_argument("--changing", type=int, default=16)
+    parser.add_argument("--tags", type=int, default=200)
+    main(parser.parse_args())
@@ -0,0 +1,92 @@
+"""Modbus TCP load generator
+
+Opens N pymodbus client connections against the simulator's Modbus server and
+keeps `--pipeline` requests in flight on each one, cycling through FC1/2/3/4
+reads and FC5/6/15/16 writes. Reports throughput in requests per second.
+
+    python -m benchmarks.modbus_load --clients 200 --pipeline 4 --duration 10
+
+Without `--host` an in-process simulator and server are started on the same
+event loop, the way the web app runs them.
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from pymodbus.client import AsyncModbusTcpClient
+
+from plc_scada_lab.backend.modbus_core import start_modbus, serve_modbus, stop_modbus
+
+async def _request(client, i):
+    """Issue one request, rotating over the supported function codes"""
+    op = i % 8
+    if op == 0:
+        return await client.read_coils(0, 8)
+    if op == 1:
+        return await client.read_discrete_inputs(0, 8)
+    if op == 2:
+        return await client.read_holding_registers(0, 8)
+    if op == 3:
+        return await client.read_input_registers(0, 8)
+    if op == 4:
+        return await client.write_coil(40, bool(i & 8))
+    if op == 5:
+        return await client.write_register(40, i & 0xFFFF)
+    if op == 6:
+        return await client.write_coils(48, [bool(i & 16)] * 8)
+    return await client.write_registers(48, [i & 0xFFFF] * 8)
+
+async def _worker(client, deadline, counts):
+    i = 0
+    while time.monotonic() < deadline:
+        result = await _request(client, i)
+        counts["errors" if result.isError() else "ok"] += 1
+        i += 1
+
+async def run(host, port, clients, pipeline, duration):
+    """Run the load test and return the result dict"""
+    connections = [AsyncModbusTcpClient(host, port=port) for _ in range(clients)]
+    await asyncio.gather(*(c.connect() for c in connections))
+    counts = {"ok": 0, "errors": 0}
+    started = time.monotonic()
+    deadline = started + duration
+    await asyncio.gather(*(
+        _worker(c, deadline, counts) for c in connections for _ in range(pipeline)
+    ))
+    elapsed = time.monotonic() - started
+    for c in connections:
+        c.close()
+    return {
+        "clients": clients,
+        "pipeline": pipeline,
+        "duration_s": round(elapsed, 3),
+        "requests": counts["ok"],
+        "errors": counts["errors"],
+        "requests_per_s": round(counts["ok"] / elapsed, 1),
+    }
+
+async def main(args):
+    server_task = None
+    if args.host is None:
+        contexts, plc = start_modbus(args.port)
+        server_task = asyncio.create_task(serve_modbus(contexts[args.port], "127.0.0.1", args.port))
+        await asyncio.sleep(0.2)
+    try:
+        result = await run(args.host or "127.0.0.1", args.port,
+                           args.clients, args.pipeline, args.duration)
+    finally:
+        if server_task is not None:
+            await stop_modbus()
+            plc.stop_simulation()
+    print(json.dumps(result))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", help="target an already running server")
+    parser.add_argument("--port", type=int, default=15020)
+    parser.add_argument("--clients", type=int, default=100)
+    parser.add_argument("--pipeline", type=int, default=4,
+                        help="requests kept in flight per connection")
+    parser.add_argument("--duration", type=float, default=5.0)
+    asyncio.run(main(parser.parse_args()))
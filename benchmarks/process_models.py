@@ -0,0 +1,71 @@
+"""Process model step cost for large plants
+
+Builds a plant of `--loops` loops split evenly over lag, valve, pump, tank
+and sensor loops, wired together like a process line (valves feed tanks,
+pumps draw on them), and reports the time of one vectorized step and the
+resulting real-time factor per plant size: process seconds simulated per
+wall-clock second at the given `--scan-time`, if the scan did nothing else.
+
+    python -m benchmarks.process_models --loops 10 1000 10000
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from plc_scada_lab.backend.image import MAX_POINTS, ProcessImage
+from plc_scada_lab.backend.process import ProcessModel
+
+KINDS = 5
+
+def plant(loops: int) -> dict:
+    """Model of `loops` loops, one block of registers per loop type"""
+    n = max(1, loops // KINDS)
+    return {"name": f"benchmark plant of {n * KINDS} loops", "loops": [
+        {"type": "lag", "count": n, "output": "hr:0", "drive": "co:0",
+         "tau": 30, "high": 900, "low": 200},
+        {"type": "valve", "count": n, "output": f"hr:{n}", "command": f"hr:{4 * n}", "rate": 10},
+        {"type": "pump", "count": n, "output": f"hr:{2 * n}", "drive": f"co:{n}",
+         "head": f"hr:{3 * n}", "q_max": 500, "h_max": 1000, "tau": 2},
+        {"type": "tank", "count": n, "output": f"hr:{3 * n}", "inflow": f"hr:{2 * n}",
+         "valve": f"hr:{n}", "area": 50, "outflow": 10, "max": 1000},
+        {"type": "sensor", "count": n, "output": "ir:0", "input": "hr:0", "gain": 0.1, "tau": 1},
+    ]}
+
+def measure(loops: int, scan_time: float, repeat: int) -> dict:
+    model = ProcessModel(plant(loops))
+    n = max(1, loops // KINDS)
+    image = ProcessImage(min(MAX_POINTS, 5 * n))
+    rng = np.random.default_rng(loops)
+    image.coils[:] = rng.random(image.size) < 0.5
+    image.holding_registers[4 * n:5 * n] = rng.integers(0, 100, n)
+    step = model.bind(image)
+    for _ in range(10):
+        step(scan_time)
+    best = float("inf")
+    for _ in range(3):
+        started = time.perf_counter()
+        for _ in range(repeat):
+            step(scan_time)
+        best = min(best, (time.perf_counter() - started) / repeat)
+    return {
+        "loops": model.loops,
+        "step_us": round(best * 1e6, 1),
+        "ns_per_loop": round(best * 1e9 / model.loops, 1),
+        "real_time_factor": round(scan_time / best, 1),
+    }
+
+def main(args):
+    results = [measure(loops, args.scan_time, max(10, args.repeat * 10 // loops))
+               for loops in args.loops]
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--loops", type=int, nargs="+", default=[10, 1000, 10000])
+    parser.add_argument("--scan-time", type=float, default=0.1,
+                        help="process seconds per step")
+    parser.add_argument("--repeat", type=int, default=20000,
+                        help="steps per measurement at 10 loops, scaled down for larger plants")
+    main(parser.parse_args())
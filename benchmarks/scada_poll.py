@@ -0,0 +1,119 @@
+"""SCADA polling engine benchmark
+
+Serves `--devices` simulated PLCs over Modbus TCP from a child process,
+then polls `--tags` tags spread over them, every second, through the
+polling engine and reports how many requests coalescing needed per cycle
+and how much of a core the polling process used to keep up. Each device
+gets its share of the tags spread over all four tables: strided holding
+registers, clustered input registers, sparse coils and scattered discrete
+inputs.
+
+    python -m benchmarks.scada_poll --devices 100 --tags 50000 --seconds 10
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import socket
+import time
+
+import numpy as np
+
+from plc_scada_lab.backend.poller import Poller
+
+def serve(port: int, devices: int, size: int):
+    """Child process: the simulated devices, unit ids 1.. on one port"""
+    import logging
+    logging.disable(logging.WARNING)
+    from plc_scada_lab.backend import modbus_core
+
+    contexts, _ = modbus_core.start_modbus(port, size=size, count=devices)
+    asyncio.run(modbus_core.serve_modbus(contexts[port], host="127.0.0.1", port=port))
+
+def device_tags(tags: int, size: int, rng) -> list:
+    """`tags` tags of one device, a quarter per table"""
+    n = max(1, tags // 4)
+    clusters = np.concatenate([np.arange(start, start + 25)
+                               for start in range(0, size, 75)])[:n]
+    return [
+        {"tag": [f"hr:{i}" for i in range(0, 2 * n, 2) if i < size]},
+        {"tag": [f"ir:{i}" for i in clusters]},
+        {"tag": [f"co:{i}" for i in range(0, 4 * n, 4) if i < size]},
+        {"tag": [f"di:{i}" for i in np.sort(rng.choice(size, min(n, size), replace=False))]},
+    ]
+
+def wait_for(port: int, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), 1.0).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Device server on port {port} did not start")
+
+async def poll(poller: Poller, warmup: float, seconds: float) -> tuple:
+    task = asyncio.ensure_future(poller.run())
+    await asyncio.sleep(warmup)
+    devices = list(poller.devices.values())
+    rounds = sum(device.stats.scans for device in devices)
+    faults = sum(device.stats.faults for device in devices)
+    started, cpu = time.perf_counter(), time.process_time()
+    await asyncio.sleep(seconds)
+    elapsed, cpu = time.perf_counter() - started, time.process_time() - cpu
+    rounds = sum(device.stats.scans for device in devices) - rounds
+    faults = sum(device.stats.faults for device in devices) - faults
+    poller.close()
+    task.cancel()
+    return elapsed, cpu, rounds, faults
+
+def main(args):
+    server = multiprocessing.get_context("spawn").Process(
+        target=serve, args=(args.port, args.devices, args.size), daemon=True)
+    server.start()
+    try:
+        wait_for(args.port)
+        rng = np.random.default_rng(0)
+        per_device = args.tags // args.devices
+        tag_class = {"interval": args.interval, "max_interval": args.max_interval}
+        for_device = [device_tags(per_device, args.size, rng) for _ in range(args.devices)]
+        poller = Poller.from_config({
+            "classes": {"normal": tag_class},
+            "devices": [{"id": 1000 + i, "host": "127.0.0.1", "port": args.port,
+                         "unit_id": i + 1, "size": args.size,
+                         "connections": args.connections, "tags": tags}
+                        for i, tags in enumerate(for_device)],
+        })
+        elapsed, cpu, rounds, faults = asyncio.run(poll(poller, args.warmup, args.seconds))
+    finally:
+        server.terminate()
+        server.join()
+    devices = list(poller.devices.values())
+    reads = sum(len(device.blocks) for device in devices)
+    lateness = [device.stats.summary().get("jitter_p99_ms", 0.0) for device in devices]
+    print(json.dumps({
+        "devices": args.devices,
+        "tags": sum(device.tags for device in devices),
+        "reads_per_cycle": reads,
+        "tags_per_read": round(sum(device.tags for device in devices) / reads, 1),
+        "points_read_per_cycle": sum(device.describe()["points_read"] for device in devices),
+        "interval_s": args.interval,
+        "rounds_per_device_per_s": round(rounds / elapsed / args.devices, 2),
+        "faults": faults,
+        "poller_cpu_percent": round(100 * cpu / elapsed, 1),
+        "lateness_p99_ms": round(max(lateness), 2),
+    }, indent=2))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--devices", type=int, default=100)
+    parser.add_argument("--tags", type=int, default=50000, help="tags over all devices")
+    parser.add_argument("--size", type=int, default=1000, help="image points per table")
+    parser.add_argument("--interval", type=float, default=1.0, help="poll interval (s)")
+    parser.add_argument("--max-interval", type=float, default=1.0,
+                        help="back off unchanged reads up to this interval (s)")
+    parser.add_argument("--connections", type=int, default=1, help="connections per device")
+    parser.add_argument("--port", type=int, default=15030)
+    parser.add_argument("--warmup", type=float, default=3.0, help="seconds before measuring")
+    parser.add_argument("--seconds", type=float, default=10.0, help="seconds to measure")
+    main(parser.parse_args())
@@ -0,0 +1,52 @@
+"""Sharded fleet scaling benchmark
+
+Runs the same fleet in fast-forward mode (scans back to back) in-process
+and then on 1, 2, 4, ... worker processes, and reports aggregate scans per
+second for each. With enough cores throughput should grow close to
+linearly with the number of shards.
+
+    python -m benchmarks.shard_scaling --plcs 500 --shards 0 1 2 4 --duration 5
+"""
+import argparse
+import json
+import time
+
+from plc_scada_lab.backend.fleet import PLCFleet
+from plc_scada_lab.backend.shards import ShardedFleet
+
+def total_scans(fleet) -> int:
+    return sum(plc.snapshot.scan_count for plc in fleet.plcs.values())
+
+def measure(plcs: int, shards: int, duration: float) -> float:
+    """Aggregate scans per second of a fast-forwarding fleet"""
+    fleet = ShardedFleet(shards=shards) if shards else PLCFleet()
+    fleet.add_uniform(plcs)
+    for plc in fleet.plcs.values():
+        plc.configure_scan(fast_forward=True)
+    fleet.start()
+    try:
+        time.sleep(1.0)  # Warm up
+        before, started = total_scans(fleet), time.monotonic()
+        time.sleep(duration)
+        return (total_scans(fleet) - before) / (time.monotonic() - started)
+    finally:
+        fleet.stop()
+
+def main(args):
+    results = {}
+    for shards in args.shards:
+        results[shards] = round(measure(args.plcs, shards, args.duration), 1)
+    baseline = results.get(1) or results.get(0)
+    print(json.dumps({
+        "plcs": args.plcs,
+        "scans_per_s": results,
+        "speedup_vs_one_shard": {k: round(v / baseline, 2) for k, v in results.items()},
+    }, indent=2))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--plcs", type=int, default=500)
+    parser.add_argument("--shards", type=int, nargs="+", default=[0, 1, 2, 4],
+                        help="worker process counts to compare, 0 = in-process")
+    parser.add_argument("--duration", type=float, default=5.0)
+    main(parser.parse_args())
@@ -0,0 +1,665 @@
+"""Alarm engine: declarative alarms evaluated in bulk against PLC images
+
+Alarms are declared as data (JSON) and evaluated together every scan with
+a handful of NumPy operations, however many are configured. Each PLC keeps
+the state of every alarm (active, acknowledged, shelved) and records every
+raise, clear, acknowledgment and shelving to its alarm journal.
+
+Alarm set format::
+
+    {
+      "name": "...",
+      "alarms": [
+        {"name": "over_temperature", "tag": "hr:0", "high": 1200, "deadband": 20,
+         "on_delay": 2, "off_delay": 0, "priority": 2, "message": "..."},
+        {"name": "motor_fault", "tag": "di:2", "priority": 1},
+        {"name": "tank_level", "count": 100, "tag": "hr:100", "low": 50},
+        ...
+      ]
+    }
+
+Register alarms are active above `high` or below `low` and clear once the
+value is back by more than `deadband`. Bit alarms (``co``/``di`` tags) are
+active while the bit is on, or off for a tag negated with a leading ``!``.
+An alarm only raises once its condition held for `on_delay` seconds and
+only clears after `off_delay` seconds without it. `priority` runs from 1
+(most urgent) to 4. An entry with a `count` declares that many alarms
+named ``name[i]`` on consecutive points, or on a list of `count` tags;
+parameters are a number or a list with one number per alarm.
+
+An alarm is listed as active while its condition holds or it has not been
+acknowledged since it last raised. Shelved alarms keep being evaluated and
+journaled but are left out of the active list until their shelving
+expires. Changed alarms are pushed to clients with their full state,
+`shelved` included, at most every `POLL_INTERVAL`.
+"""
+import asyncio
+import json
+import logging
+import math
+import pathlib
+import re
+import threading
+import time
+
+import numpy as np
+
+from plc_scada_lab.backend.ladder import IMAGE_AREAS, REGISTER_AREAS
+
+logger = logging.getLogger(__name__)
+
+ALARMS = pathlib.Path(__file__).parent.parent / "alarms"
+DEFAULT_ALARMS = ALARMS / "default.json"
+
+PRIORITIES = (1, 2, 3, 4)
+DEFAULT_PRIORITY = 3
+MAX_EVENTS = 1 << 20        # Journal events kept in memory per PLC
+MAX_SHELVE = 8 * 3600.0     # Longest shelving, one shift
+MAX_PUSH = 500              # Changed alarms per push before clients are told to resync
+POLL_INTERVAL = 0.1         # Push period, and sampling period for PLCs without scan observers
+FLUSH_INTERVAL = 0.5        # Longest time events wait to be written to the journal files
+
+RAISE = 1
+CLEAR = 2
+ACK = 3
+SHELVE = 4
+UNSHELVE = 5
+KINDS = {RAISE: "raise", CLEAR: "clear", ACK: "ack", SHELVE: "shelve", UNSHELVE: "unshelve"}
+KIND_IDS = {name: kind for kind, name in KINDS.items()}
+
+# One journal record; the file is a plain array of them
+EVENT = np.dtype([("ts", "<f8"), ("alarm", "<u4"), ("kind", "u1"),
+                  ("priority", "u1"), ("value", "<f8")])
+
+_TAG = re.compile(r"^(!?)(co|di|hr|ir):(\d+)$")
+
+class AlarmError(ValueError):
+    """Raised for malformed alarm sets"""
+
+def _compact(indices: np.ndarray):
+    """A slice for consecutive indices, which NumPy reads without a gather"""
+    if indices.size and np.array_equal(indices, np.arange(indices[0], indices[0] + indices.size)):
+        return slice(int(indices[0]), int(indices[0]) + indices.size)
+    return indices
+
+class AlarmSet:
+    """An alarm set, parsed once and evaluated against any number of PLCs"""
+
+    def __init__(self, config: dict):
+        self.definition = config
+        self.name = config.get("name", "unnamed")
+        names, tags, messages, tables, addresses = [], [], [], [], []
+        columns = {key: [] for key in ("sign", "limit", "deadband", "on_delay",
+                                       "off_delay", "priority")}
+        for i, spec in enumerate(config.get("alarms", [])):
+            try:
+                entry = self._parse(spec)
+            except AlarmError as e:
+                raise AlarmError(f"Alarm {i}: {e}") from None
+            for key, values in entry.pop("columns").items():
+                columns[key].append(values)
+            names += entry["names"]
+            tags += entry["tags"]
+            messages += entry["messages"]
+            tables += entry["tables"]
+            addresses += entry["addresses"]
+        if len(set(names)) != len(names):
+            duplicate = next(name for name in names if names.count(name) > 1)
+            raise AlarmError(f"Duplicate alarm name {duplicate!r}")
+        self.names = names
+        self.tags = tags
+        self.messages = messages
+        self.index = {name: i for i, name in enumerate(names)}
+        for key, parts in columns.items():
+            setattr(self, key, np.concatenate(parts) if parts else np.zeros(0))
+        self.priority = self.priority.astype(np.uint8)
+        # Signed so that every alarm is active above its limit
+        self.limit = self.limit * self.sign
+        tables = np.array(tables, dtype=object)
+        addresses = np.array(addresses, dtype=np.intp)
+        self.size = int(addresses.max()) + 1 if addresses.size else 0
+        self.tables = {}  # table -> (alarm positions, image addresses)
+        for table in dict.fromkeys(tables):
+            positions = np.flatnonzero(tables == table)
+            self.tables[table] = (_compact(positions), _compact(addresses[positions]))
+
+    @staticmethod
+    def _parse(spec: dict) -> dict:
+        if not isinstance(spec, dict) or not isinstance(spec.get("name"), str):
+            raise AlarmError("alarm without a name")
+        tag = spec.get("tag")
+        count = spec.get("count", len(tag) if isinstance(tag, list) else 1)
+        if not isinstance(count, int) or count < 1:
+            raise AlarmError(f"Invalid alarm count: {count!r}")
+        if isinstance(tag, str):
+            operands = [tag]
+        elif isinstance(tag, list) and len(tag) == count:
+            operands = tag
+        else:
+            raise AlarmError(f"'tag' needs an operand or a list of {count} operands")
+        parsed = []
+        for operand in operands:
+            match = _TAG.match(operand.strip()) if isinstance(operand, str) else None
+            if match is None:
+                raise AlarmError(f"Invalid tag {operand!r}")
+            bang, area, address = match.groups()
+            parsed.append((bool(bang), area, int(address)))
+        if isinstance(tag, str):
+            bang, area, address = parsed[0]
+            parsed = [(bang, area, address + i) for i in range(count)]
+        kinds = {area in REGISTER_AREAS for _, area, _ in parsed}
+        if len(kinds) > 1:
+            raise AlarmError("Tags of one entry must all be bits or all be registers")
+
+        def param(key, default):
+            value = spec.get(key, default)
+            try:
+                value = np.broadcast_to(np.asarray(value, dtype=np.float64), (count,))
+            except (TypeError, ValueError):
+                raise AlarmError(f"{key!r} needs a number or a list of {count} numbers") from None
+            if not np.isfinite(value).all() or (value < 0).any():
+                raise AlarmError(f"Invalid {key!r}: {spec.get(key)!r}")
+            return value
+
+        if kinds.pop():
+            if any(bang for bang, _, _ in parsed):
+                raise AlarmError("Only bit tags can be negated")
+            if ("high" in spec) == ("low" in spec):
+                raise AlarmError("Register alarms need either 'high' or 'low'")
+            key = "high" if "high" in spec else "low"
+            sign = np.full(count, 1.0 if key == "high" else -1.0)
+            limit = param(key, None)
+            deadband = param("deadband", 0)
+        else:
+            if "high" in spec or "low" in spec or "deadband" in spec:
+                raise AlarmError("Bit alarms take no 'high', 'low' or 'deadband'")
+            # On above 0.5, or off below it for negated tags
+            sign = np.array([-1.0 if bang else 1.0 for bang, _, _ in parsed])
+            limit = np.full(count, 0.5)
+            deadband = np.zeros(count)
+        priority = param("priority", DEFAULT_PRIORITY)
+        if not np.isin(priority, PRIORITIES).all():
+            raise AlarmError(f"'priority' must be one of {PRIORITIES}")
+        message = spec.get("message", spec["name"])
+        name = spec["name"]
+        return {
+            "names": [name] if count == 1 else [f"{name}[{i}]" for i in range(count)],
+            "tags": [f"{'!' if bang else ''}{area}:{address}" for bang, area, address in parsed],
+            "messages": [message] * count,
+            "tables": [IMAGE_AREAS[area] for _, area, _ in parsed],
+            "addresses": [address for _, _, address in parsed],
+            "columns": {
+                "sign": sign,
+                "limit": limit,
+                "deadband": deadband,
+                "on_delay": param("on_delay", 0),
+                "off_delay": param("off_delay", 0),
+                "priority": priority,
+            },
+        }
+
+    @classmethod
+    def load(cls, path=DEFAULT_ALARMS) -> "AlarmSet":
+        """Load an alarm set from a JSON file"""
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+def _value(value: float):
+    return None if math.isnan(value) else int(value) if value.is_integer() else value
+
+class AlarmJournal:
+    """Append-only, indexed log of the alarm events of one PLC
+
+    Events are appended in time order to a growing structured array (the
+    `EVENT` records), so time ranges are found by binary search and pages
+    are read backwards from a cursor without touching the rest. With a
+    directory, records are also appended to ``events.bin`` and alarm names
+    to ``names.json`` there, and both are reloaded on restart; the newest
+    `max_events` stay in memory. `append` runs on the scan thread and only
+    queues the records for the file; `flush` writes them, from a writer
+    thread (see `AlarmEngine`), so an alarm storm costs the scan no I/O.
+    """
+
+    def __init__(self, directory=None, max_events: int = MAX_EVENTS, wake: threading.Event = None):
+        self.directory = pathlib.Path(directory) if directory else None
+        self.max_events = max_events
+        self.names = []     # Journal alarm id -> name
+        self._ids = {}
+        self.records = np.empty(1024, dtype=EVENT)
+        self.count = 0
+        self.offset = 0     # Sequence number of records[0]
+        self._last_ts = 0.0
+        self._lock = threading.Lock()
+        self._file = None
+        self._pending = []  # Record bytes not written to the file yet
+        self._write_lock = threading.Lock()
+        self._wake = wake   # Set when records are pending
+        if self.directory is not None:
+            self._load()
+
+    def _load(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        names = self.directory / "names.json"
+        if names.exists():
+            self.names = json.loads(names.read_text())
+            self._ids = {name: i for i, name in enumerate(self.names)}
+        path = self.directory / "events.bin"
+        if path.exists():
+            size = path.stat().st_size
+            if size % EVENT.itemsize:
+                logger.warning(f"Alarm journal {path} ends in a truncated record")
+                with open(path, "r+b") as f:
+                    f.truncate(size - size % EVENT.itemsize)
+            records = np.fromfile(path, dtype=EVENT)
+            kept = records[-self.max_events:]
+            self.offset = len(records) - len(kept)
+            self._reserve(len(kept))
+            self.records[:len(kept)] = kept
+            self.count = len(kept)
+            if self.count:
+                self._last_ts = float(kept["ts"][-1])
+        self._file = open(path, "ab")
+
+    def ids(self, names: list) -> np.ndarray:
+        """Journal ids of alarm names, registering new ones"""
+        with self._lock:
+            new = [name for name in dict.fromkeys(names) if name not in self._ids]
+            for name in new:
+                self._ids[name] = len(self.names)
+                self.names.append(name)
+            if new and self.directory is not None:
+                staging = self.directory / "names.json.tmp"
+                staging.write_text(json.dumps(self.names))
+                staging.replace(self.directory / "names.json")
+            return np.array([self._ids[name] for name in names], dtype=np.uint32)
+
+    def _reserve(self, n: int):
+        """Room for `n` more records, dropping the oldest beyond `max_events`"""
+        needed = self.count + n
+        if needed <= len(self.records):
+            return
+        kept = self.records[:self.count]
+        if needed > self.max_events:
+            drop = min(self.count, needed - self.max_events // 2)
+            kept = kept[drop:]
+            self.offset += drop
+        # A new array: queries may still be reading the old one
+        records = np.empty(max(2 * (len(kept) + n), 1024), dtype=EVENT)
+        records[:len(kept)] = kept
+        self.records = records
+        self.count = len(kept)
+
+    def append(self, ts: float, alarms, kind, priorities, values):
+        """Record events of several alarms at one time"""
+        alarms = np.atleast_1d(alarms)
+        n = alarms.size
+        with self._lock:
+            # Keep time order, so that time ranges can be searched
+            ts = self._last_ts = max(ts, self._last_ts)
+            self._reserve(n)
+            rows = self.records[self.count:self.count + n]
+            rows["ts"] = ts
+            rows["alarm"] = alarms
+            rows["kind"] = kind
+            rows["priority"] = priorities
+            rows["value"] = values
+            self.count += n
+            if self._file is not None:
+                self._pending.append(rows.tobytes())
+        if self._wake is not None:
+            self._wake.set()
+
+    def flush(self):
+        """Write the queued records to the file"""
+        with self._write_lock:
+            with self._lock:
+                pending, self._pending = self._pending, []
+            if pending and self._file is not None:
+                self._file.write(b"".join(pending))
+                self._file.flush()
+
+    def query(self, alarms: list = None, kinds: list = None, priority: int = None,
+              start: float = None, end: float = None, before: int = None,
+              limit: int = 100) -> dict:
+        """Newest events first, `limit` per page
+
+        Filters by alarm names, event kinds, priority (this one and more
+        urgent) and time range. `before` is the cursor returned as `next`
+        by the previous page.
+        """
+        with self._lock:
+            records = self.records[:self.count]
+            offset = self.offset
+            names = list(self.names)
+            ids = None if alarms is None else np.array(
+                [self._ids[name] for name in alarms if name in self._ids], dtype=np.uint32)
+        kind_ids = None
+        if kinds is not None:
+            unknown = [kind for kind in kinds if kind not in KIND_IDS]
+            if unknown:
+                raise ValueError(f"Unknown event kinds {unknown}, expected {list(KIND_IDS)}")
+            kind_ids = [KIND_IDS[kind] for kind in kinds]
+        ts = records["ts"]
+        lo = 0 if start is None else int(np.searchsorted(ts, start, "left"))
+        hi = len(records) if end is None else int(np.searchsorted(ts, end, "left"))
+        if before is not None:
+            hi = min(hi, before - offset)
+        rows = []
+        window = max(4 * limit, 256)
+        while hi > lo and len(rows) < limit:
+            # Scan backwards in growing windows until the page is full
+            first = max(lo, hi - window)
+            chunk = records[first:hi]
+            mask = np.ones(len(chunk), dtype=np.bool_)
+            if ids is not None:
+                mask &= np.isin(chunk["alarm"], ids)
+            if kind_ids is not None:
+                mask &= np.isin(chunk["kind"], kind_ids)
+            if priority is not None:
+                mask &= chunk["priority"] <= priority
+            rows.extend((first + np.flatnonzero(mask)[::-1][:limit - len(rows)]).tolist())
+            hi = first
+            window *= 2
+        events = [{
+            "seq": offset + row,
+            "ts": float(records["ts"][row]),
+            "alarm": names[records["alarm"][row]],
+            "kind": KINDS.get(int(records["kind"][row]), "unknown"),
+            "priority": int(records["priority"][row]),
+            "value": _value(float(records["value"][row])),
+        } for row in rows]
+        more = len(rows) == limit and rows[-1] > lo
+        return {"events": events, "next": offset + rows[-1] if more else None}
+
+    def close(self):
+        self.flush()
+        with self._write_lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+class PLCAlarms:
+    """State of every alarm of one PLC, evaluated from its scan snapshots
+
+    `evaluate` is called with each published snapshot (on the scan thread
+    for in-process PLCs). A scan in which no alarm changes state costs a
+    few array operations over the alarm set and no Python loop.
+    """
+
+    def __init__(self, plc_id: int, alarms: AlarmSet, journal: AlarmJournal):
+        n = len(alarms)
+        self.plc_id = plc_id
+        self.alarms = alarms
+        self.journal = journal
+        self.ids = journal.ids(alarms.names)
+        self.values = np.zeros(n)                   # Tag values at the last evaluation
+        self.condition = np.zeros(n, dtype=np.bool_)  # Limit exceeded, with deadband
+        self.active = np.zeros(n, dtype=np.bool_)     # Condition held past its delay
+        self.acked = np.ones(n, dtype=np.bool_)
+        self.raised = np.full(n, np.nan)            # Time of the last raise
+        self.pending = np.full(n, np.nan)           # Since when condition != active
+        self.shelved_until = np.zeros(n)
+        self.changed = np.zeros(n, dtype=np.bool_)  # Not pushed to clients yet
+        self._signed = np.empty(n)
+        self._threshold = np.empty(n)
+        self._pending_any = False
+        self._last_scan = None
+        self._lock = threading.Lock()
+
+    def evaluate(self, snapshot):
+        """Evaluate every alarm against one scan snapshot"""
+        if snapshot is None or snapshot.scan_count == self._last_scan:
+            return
+        self._last_scan = snapshot.scan_count
+        alarms = self.alarms
+        values = self.values
+        image = snapshot.image
+        for table, (positions, addresses) in alarms.tables.items():
+            values[positions] = image.table(table)[addresses]
+        np.multiply(values, alarms.sign, out=self._signed)
+        # Limits drop by the deadband while the condition holds
+        np.multiply(self.condition, alarms.deadband, out=self._threshold)
+        np.subtract(alarms.limit, self._threshold, out=self._threshold)
+        np.greater(self._signed, self._threshold, out=self.condition)
+        differs = self.condition != self.active
+        if not differs.any():
+            if self._pending_any:
+                self.pending.fill(np.nan)
+                self._pending_any = False
+            return
+        self._advance(differs, snapshot.timestamp)
+
+    def _advance(self, differs: np.ndarray, now: float):
+        """Start or finish the on/off delays of alarms whose condition changed"""
+        alarms = self.alarms
+        pending = self.pending
+        if self._pending_any:
+            pending[~differs] = np.nan
+        index = np.flatnonzero(differs)
+        since = pending[index]
+        since[np.isnan(since)] = now
+        pending[index] = since
+        raising = self.condition[index]
+        delay = np.where(raising, alarms.on_delay[index], alarms.off_delay[index])
+        due = now - since >= delay
+        self._pending_any = not due.all()
+        if not due.any():
+            return
+        flip = index[due]
+        raising = raising[due]
+        pending[flip] = np.nan
+        with self._lock:
+            self.active[flip] = raising
+            up = flip[raising]
+            self.acked[up] = False
+            self.raised[up] = now
+            self.changed[flip] = True
+        self.journal.append(now, self.ids[flip], np.where(raising, RAISE, CLEAR),
+                            alarms.priority[flip], self.values[flip])
+
+    def _index(self, names) -> np.ndarray:
+        """Alarm positions of names; ValueError for unknown ones"""
+        unknown = [name for name in names if name not in self.alarms.index]
+        if unknown:
+            raise ValueError(f"Unknown alarms {unknown[:10]}")
+        return np.array([self.alarms.index[name] for name in names], dtype=np.intp)
+
+    def ack(self, names: list = None) -> int:
+        """Acknowledge alarms, every unacknowledged one if `names` is None"""
+        now = time.time()
+        with self._lock:
+            if names is None:
+                index = np.flatnonzero(~self.acked)
+            else:
+                index = self._index(names)
+                index = index[~self.acked[index]]
+            self.acked[index] = True
+            self.changed[index] = True
+        if index.size:
+            self.journal.append(now, self.ids[index], ACK, self.alarms.priority[index],
+                                self.values[index])
+        return int(index.size)
+
+    def shelve(self, name: str, seconds: float):
+        """Shelve an alarm for `seconds` (at most MAX_SHELVE), 0 unshelves it"""
+        if not 0 <= seconds <= MAX_SHELVE:
+            raise ValueError(f"Shelving must last 0 to {MAX_SHELVE:.0f} seconds")
+        index = self._index([name])
+        now = time.time()
+        with self._lock:
+            self.shelved_until[index] = now + seconds if seconds else 0.0
+            self.changed[index] = True
+        self.journal.append(now, self.ids[index], SHELVE if seconds else UNSHELVE,
+                            self.alarms.priority[index], seconds)
+
+    def describe(self, i: int, now: float = None) -> dict:
+        alarms = self.alarms
+        now = time.time() if now is None else now
+        shelved = bool(self.shelved_until[i] > now)
+        return {
+            "name": alarms.names[i],
+            "tag": alarms.tags[i],
+            "priority": int(alarms.priority[i]),
+            "message": alarms.messages[i],
+            "active": bool(self.active[i]),
+            "acked": bool(self.acked[i]),
+            "shelved": shelved,
+            "shelved_until": float(self.shelved_until[i]) if shelved else None,
+            "raised": _value(float(self.raised[i])),
+            "value": _value(float(self.values[i])),
+        }
+
+    def _listed(self, now: float) -> np.ndarray:
+        """Mask of alarms in the active list: active or unacknowledged, not shelved"""
+        return (self.active | ~self.acked) & (self.shelved_until <= now)
+
+    def query(self, priority: int = None, shelved: bool = False, limit: int = 100) -> dict:
+        """Active list, most urgent first and newest first within a priority
+
+        With `shelved` the shelved alarms are listed instead.
+        """
+        now = time.time()
+        with self._lock:
+            if shelved:
+                mask = self.shelved_until > now
+            else:
+                mask = self._listed(now)
+            if priority is not None:
+                mask &= self.alarms.priority <= priority
+            index = np.flatnonzero(mask)
+            order = np.lexsort((-np.nan_to_num(self.raised[index], nan=0.0),
+                                self.alarms.priority[index]))
+            index = index[order]
+            return {
+                "plc": self.plc_id,
+                "total": int(index.size),
+                "alarms": [self.describe(i, now) for i in index[:limit]],
+            }
+
+    def counts(self) -> dict:
+        """Alarms in the active list per priority"""
+        listed = self._listed(time.time())
+        counts = np.bincount(self.alarms.priority[listed], minlength=max(PRIORITIES) + 1)
+        return {priority: int(counts[priority]) for priority in PRIORITIES}
+
+    def drain(self):
+        """Push message for alarms changed since the last call, or None"""
+        with self._lock:
+            index = np.flatnonzero(self.changed)
+            if not index.size:
+                return None
+            self.changed[index] = False
+            now = time.time()
+            payload = {"plc": self.plc_id, "total": int(self._listed(now).sum())}
+            if index.size > MAX_PUSH:
+                # Too many to list; clients fetch the active list instead
+                payload["resync"] = True
+            else:
+                payload["alarms"] = [self.describe(i, now) for i in index]
+        return {"kind": "alarms", "payload": payload}
+
+class AlarmEngine:
+    """Alarm evaluation, journaling and queries for the PLCs of a fleet
+
+    Every attached PLC evaluates the same alarm set. Journals are kept
+    under `directory` (one subdirectory per PLC), written by one writer
+    thread for the fleet, or in memory only without one.
+    """
+
+    def __init__(self, alarms: AlarmSet = None, directory=None, max_events: int = MAX_EVENTS):
+        self.alarms = alarms or AlarmSet.load()
+        self.directory = pathlib.Path(directory) if directory else None
+        self.max_events = max_events
+        self.plcs = {}  # plc id -> PLCAlarms
+        self._polled = []
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._writer = None
+        if self.directory is not None:
+            self._writer = threading.Thread(target=self._write_loop, name="alarm-journal",
+                                            daemon=True)
+            self._writer.start()
+
+    def attach(self, plc_id: int, plc) -> PLCAlarms:
+        """Start evaluating the alarms of a PLC
+
+        In-process PLCs are evaluated from their scan observer, every scan;
+        others (e.g. sharded PLCs) are sampled by `run` every POLL_INTERVAL.
+        """
+        size = plc.snapshot.image.size
+        if self.alarms.size > size:
+            raise AlarmError(f"Alarm set {self.alarms.name!r} addresses points "
+                             f"outside the image of PLC {plc_id} ({size} points)")
+        directory = self.directory / f"plc-{plc_id}" if self.directory is not None else None
+        journal = AlarmJournal(directory, self.max_events, self._wake if directory else None)
+        state = PLCAlarms(plc_id, self.alarms, journal)
+        self.plcs[plc_id] = state
+        state.evaluate(plc.snapshot)
+        observers = getattr(plc, "observers", None)
+        if observers is not None:
+            observers.append(state.evaluate)
+        else:
+            self._polled.append((state, plc))
+        return state
+
+    def active(self, plc_id: int, priority: int = None, shelved: bool = False,
+               limit: int = 100) -> dict:
+        return self.plcs[plc_id].query(priority, shelved, limit)
+
+    def events(self, plc_id: int, alarms: list = None, kinds: list = None,
+               priority: int = None, start: float = None, end: float = None,
+               before: int = None, limit: int = 100) -> dict:
+        result = self.plcs[plc_id].journal.query(alarms, kinds, priority, start, end, before, limit)
+        return {"plc": plc_id, **result}
+
+    def ack(self, plc_id: int, names: list = None) -> int:
+        return self.plcs[plc_id].ack(names)
+
+    def shelve(self, plc_id: int, name: str, seconds: float):
+        self.plcs[plc_id].shelve(name, seconds)
+
+    async def run(self, send):
+        """Sample PLCs without scan observers and push alarm changes
+
+        `send(plc_id, message)` is called with a message of the changed
+        alarms of a PLC, at most every POLL_INTERVAL.
+        """
+        while True:
+            for state, plc in self._polled:
+                try:
+                    state.evaluate(plc.snapshot)
+                except Exception as e:
+                    logger.error(f"Error evaluating alarms of PLC {state.plc_id}: {e}")
+            for plc_id, state in list(self.plcs.items()):
+                try:
+                    message = state.drain()
+                    if message is not None:
+                        send(plc_id, message)
+                except Exception as e:
+                    logger.error(f"Error pushing alarms of PLC {plc_id}: {e}")
+            await asyncio.sleep(POLL_INTERVAL)
+
+    def _write_loop(self):
+        while not self._stopped.is_set():
+            self._wake.wait()
+            self._wake.clear()
+            for state in list(self.plcs.values()):
+                try:
+                    state.journal.flush()
+                except Exception as e:
+                    logger.error(f"Error writing alarm journal of PLC {state.plc_id}: {e}")
+            # Batch the events of the following scans into one write
+            self._stopped.wait(FLUSH_INTERVAL)
+
+    def close(self):
+        """Stop the writer thread, then write and close every journal"""
+        self._stopped.set()
+        self._wake.set()
+        if self._writer is not None:
+            self._writer.join(timeout=10.0)
+            self._writer = None
+        for state in self.plcs.values():
+            state.journal.close()
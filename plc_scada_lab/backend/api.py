@@ -1,97 +1,467 @@
+"""Web app of the PLC SCADA Lab
+
+`create_app(config)` builds an app without starting anything: the PLC
+simulator, Modbus servers, state streaming, historian, alarms, lessons and
+frontend assets are imported and started by the app's lifespan, each of
+them optional (see `AppConfig`), and stopped with it. So importing this
+module is cheap and free of side effects, and every uvicorn worker builds
+its own app:
+
+    APP_DISABLE=simulator uvicorn plc_scada_lab.backend.api:create_app --factory --workers 4
+
+The simulator holds a lock per Modbus port, so of several workers only one
+runs the PLCs and the historian, alarm journal and checkpoint files that
+belong to them; the others serve without a simulator. A plant shared by all
+clients therefore needs a single worker.
+
+`GET /api/startup` reports what starting each subsystem cost.
+"""
+import time
+
+IMPORT_STARTED = time.perf_counter()
+
+import os
 import json
-import pathlib
 import logging
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse
+import functools
+import tempfile
+import contextlib
+import importlib
+from fastapi import APIRouter, FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Query, Request
+from fastapi.responses import HTMLResponse, PlainTextResponse
 from pydantic import BaseModel
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 import asyncio
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+from plc_scada_lab.backend import metrics
+
 logger = logging.getLogger(__name__)
 
-# Import our modules
-try:
-    from plc_scada_lab.backend.modbus_core import (
-        start_modbus, get_plc_state, set_discrete_input, set_holding_register
-    )
-    from plc_scada_lab.backend.lessons import list_lessons, load_md
-    MODULES_AVAILABLE = True
-except ImportError as e:
-    logger.warning(f"Module import failed: {e}")
-    MODULES_AVAILABLE = False
-
-# FastAPI app setup
-app = FastAPI(title="PLC SCADA Lab", version="1.0.0")
-
-# Mount static files - serve frontend files at /static
-FRONTEND_DIR = pathlib.Path(__file__).parent.parent / "frontend"
-if FRONTEND_DIR.exists():
-    app.mount("/static", StaticFiles(directory=str(FRONTEND_DIR)), name="static")
-    logger.info(f"Mounted static files from {FRONTEND_DIR}")
-else:
-    logger.warning(f"Frontend directory not found: {FRONTEND_DIR}")
+# Subsystems `APP_DISABLE` may leave out, in start order
+SUBSYSTEMS = ("assets", "lessons", "simulator", "modbus", "poller", "streaming", "historian",
+              "alarms", "journal")
+
+# One process per host runs the simulator of a Modbus port
+SIMULATOR_LOCK = os.path.join(tempfile.gettempdir(), "plc-scada-lab-{port}.lock")
+
+def lock_simulator(port: int) -> int:
+    """Descriptor holding the simulator lock of a Modbus port, RuntimeError if another process holds it"""
+    import fcntl
+    fd = os.open(SIMULATOR_LOCK.format(port=port), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        raise RuntimeError(f"another process, e.g. another worker, runs the simulator of Modbus port {port}")
+    return fd
+
+class AppConfig(BaseModel):
+    """Subsystems and settings of an app, `from_env()` reads them from the environment"""
+    assets: bool = True       # Frontend files served from memory
+    lessons: bool = True      # Lesson store and search, loaded in the background
+    simulator: bool = True    # PLC fleet and its scan threads
+    modbus: bool = True       # Modbus TCP servers of the fleet
+    poller: bool = True       # Polling of `scada_devices`, if any
+    streaming: bool = True    # Change-driven state streaming to WebSocket clients
+    historian: bool = True
+    alarms: bool = True
+    journal: bool = True      # Journals in `journal_dir`, if any
+    modbus_port: int = 1502
+    fleet: Optional[str] = None  # Fleet config file, else `plc_count` identical PLCs
+    plc_count: int = 1
+    plc_shards: int = 0
+    checkpoint_dir: Optional[str] = None
+    checkpoint_interval: Optional[float] = None
+    journal_dir: Optional[str] = None
+    scada_devices: Optional[str] = None
+    historian_dir: str = "historian"  # "" keeps the history in memory only
+    alarm_set: str = "default.json"   # In alarms/
+    alarm_dir: str = "alarm-journal"  # "" keeps the alarm journal in memory only
+
+    @classmethod
+    def from_env(cls, **overrides) -> "AppConfig":
+        """Settings from the environment, `APP_DISABLE` lists subsystems to leave out"""
+        # PLC_FLEET names a fleet config file, PLC_COUNT starts N identical PLCs
+        # and PLC_SHARDS > 0 scans them in that many worker processes.
+        # PLC_CHECKPOINT_DIR keeps PLC state across restarts, checkpointed
+        # every PLC_CHECKPOINT_INTERVAL seconds
+        interval = os.getenv("PLC_CHECKPOINT_INTERVAL")
+        settings = {
+            "modbus_port": int(os.getenv("MODBUS_PORT", "1502")),
+            "fleet": os.getenv("PLC_FLEET") or None,
+            "plc_count": int(os.getenv("PLC_COUNT", "1")),
+            "plc_shards": int(os.getenv("PLC_SHARDS", "0")),
+            "checkpoint_dir": os.getenv("PLC_CHECKPOINT_DIR") or None,
+            "checkpoint_interval": float(interval) if interval else None,
+            "journal_dir": os.getenv("PLC_JOURNAL_DIR") or None,
+            "scada_devices": os.getenv("SCADA_DEVICES") or None,
+            "historian_dir": os.getenv("HISTORIAN_DIR", "historian"),
+            "alarm_set": os.getenv("PLC_ALARMS", "default.json"),
+            "alarm_dir": os.getenv("ALARM_DIR", "alarm-journal"),
+        }
+        for name in os.getenv("APP_DISABLE", "").split(","):
+            name = name.strip()
+            if not name:
+                continue
+            if name not in SUBSYSTEMS:
+                raise ValueError(f"Unknown subsystem {name!r} in APP_DISABLE, expected one of {SUBSYSTEMS}")
+            settings[name] = False
+        settings.update(overrides)
+        return cls(**settings)
 
 # Data models
 class ActionRequest(BaseModel):
     action_type: str
     address: int
     value: Any = None
+    plc: Optional[int] = None
+
+class BatchRequest(BaseModel):
+    actions: List[Dict[str, Any]]
+    plc: Optional[int] = None
+
+class AckRequest(BaseModel):
+    alarms: Optional[List[str]] = None  # None acknowledges every alarm
+    plc: Optional[int] = None
+
+class ShelveRequest(BaseModel):
+    alarm: str
+    seconds: float  # 0 unshelves
+    plc: Optional[int] = None
+
+class ScanConfigRequest(BaseModel):
+    scan_time: Optional[float] = None
+    fast_forward: Optional[bool] = None
+    time_scale: Optional[float] = None
+    plc: Optional[int] = None
+
+class _Step:
+    """Import time spent while starting one subsystem"""
 
-class ConnectionManager:
-    """Manage WebSocket connections"""
-    
     def __init__(self):
-        self.active_connections: List[WebSocket] = []
-        
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections.append(websocket)
-        logger.info(f"Client connected. Total connections: {len(self.active_connections)}")
-        
-    def disconnect(self, websocket: WebSocket):
-        if websocket in self.active_connections:
-            self.active_connections.remove(websocket)
-        logger.info(f"Client disconnected. Total connections: {len(self.active_connections)}")
-        
-    async def broadcast(self, message: dict):
-        """Broadcast message to all connected clients"""
-        if self.active_connections:
-            message_str = json.dumps(message)
-            disconnected = []
-            
-            for connection in self.active_connections:
-                try:
-                    await connection.send_text(message_str)
-                except:
-                    disconnected.append(connection)
-                    
-            # Remove disconnected clients
-            for connection in disconnected:
-                self.disconnect(connection)
-
-# Global connection manager
-manager = ConnectionManager()
-
-# Initialize PLC system with error handling
-context, plc = None, None
-if MODULES_AVAILABLE:
-    try:
-        context, plc = start_modbus()
-        logger.info("PLC SCADA system initialized successfully")
-    except Exception as e:
-        logger.error(f"Failed to initialize PLC system: {e}")
-        context, plc = None, None
-
-@app.get("/", response_class=HTMLResponse)
-async def get_index():
-    """Serve the main application page"""
-    index_path = FRONTEND_DIR / "index.html"
-    if index_path.exists():
-        content = index_path.read_text()
-        return HTMLResponse(content=content, status_code=200)
+        self.import_seconds = 0.0
+
+    def load(self, module: str):
+        """Import a module, timed as import rather than init cost"""
+        started = time.perf_counter()
+        try:
+            return importlib.import_module(module)
+        finally:
+            self.import_seconds += time.perf_counter() - started
+
+class Lab:
+    """The subsystems of one app, started and stopped by its lifespan
+
+    A subsystem that is disabled, fails to start or needs the missing
+    simulator is left out, and the endpoints using it fall back to mock
+    data or 503 as before. `startup` records the import and init time of
+    every subsystem, in milliseconds.
+    """
+
+    def __init__(self, config: AppConfig):
+        self.config = config
+        self.manager = None        # ConnectionManager of the WebSocket clients
+        self.assets = None         # AssetStore
+        self.lessons = None        # LessonStore, once loaded
+        self._lessons_task = None
+        self.core = None           # The modbus_core module, while the simulator runs
+        self._simulator_lock = None
+        self.fleet = None
+        self.context, self.plc = None, None
+        self.poller = None
+        self.streamers = None
+        self.historian = None
+        self.alarm_engine = None
+        self.tasks = []
+        self.gauges = []
+        self.startup = {"subsystems": {}}
+
+    @contextlib.contextmanager
+    def _starting(self, name: str):
+        """Time starting a subsystem, logging a failure instead of raising it"""
+        step = _Step()
+        started = time.perf_counter()
+        status = "started"
+        try:
+            yield step
+        except Exception as e:
+            logger.error(f"Failed to start {name}: {e}")
+            status = "failed"
+        elapsed = time.perf_counter() - started
+        self.startup["subsystems"][name] = {
+            "status": status,
+            "import_ms": round(step.import_seconds * 1000.0, 1),
+            "init_ms": round((elapsed - step.import_seconds) * 1000.0, 1),
+        }
+
+    def _enabled(self, name: str, needs_simulator: bool = True) -> bool:
+        if not getattr(self.config, name, True):
+            status = "disabled"
+        elif needs_simulator and self.plc is None:
+            status = "no simulator"
+        else:
+            return True
+        self.startup["subsystems"][name] = {"status": status}
+        return False
+
+    def _task(self, coroutine):
+        self.tasks.append(asyncio.create_task(coroutine))
+
+    async def start(self):
+        """Start every enabled subsystem, lessons go on loading in the background"""
+        started = time.perf_counter()
+        config = self.config
+        with self._starting("connections") as step:
+            self.manager = step.load("plc_scada_lab.backend.streaming").ConnectionManager()
+
+        if self._enabled("assets", needs_simulator=False):
+            with self._starting("assets") as step:
+                self.assets = step.load("plc_scada_lab.backend.assets").AssetStore()
+                if self.assets.directory.exists():
+                    logger.info(f"Serving {len(self.assets.assets)} frontend files from {self.assets.directory}")
+                else:
+                    logger.warning(f"Frontend directory not found: {self.assets.directory}")
+                self._task(self.assets.watch())
+
+        if self._enabled("lessons", needs_simulator=False):
+            self.startup["subsystems"]["lessons"] = {"status": "loading"}
+            self._lessons_task = asyncio.create_task(self._load_lessons())
+            self.tasks.append(self._lessons_task)
+
+        if self._enabled("simulator", needs_simulator=False):
+            with self._starting("simulator") as step:
+                core = step.load("plc_scada_lab.backend.modbus_core")
+                if core.fleet is not None:
+                    raise RuntimeError("the PLC fleet of this process belongs to another app")
+                # Workers share the Modbus port and the historian, alarm and
+                # checkpoint directories, so only one of them may run the PLCs
+                self._simulator_lock = lock_simulator(config.modbus_port)
+                self.context, self.plc = core.start_modbus(config.modbus_port, config=config.fleet,
+                                                           count=config.plc_count,
+                                                           shards=config.plc_shards,
+                                                           checkpoint_dir=config.checkpoint_dir,
+                                                           checkpoint_interval=config.checkpoint_interval)
+                self.core, self.fleet = core, core.fleet
+                if self.plc is None:
+                    raise RuntimeError("no PLC started")
+                logger.info("PLC SCADA system initialized successfully")
+
+        if self._enabled("modbus"):
+            with self._starting("modbus"):
+                for port, port_context in (self.context or {}).items():
+                    self._task(self._serve_modbus(port, port_context))
+
+        # External Modbus TCP devices to poll join the fleet before the
+        # streamers, historian and alarms attach to it
+        if config.scada_devices and self._enabled("poller"):
+            with self._starting("poller") as step:
+                poller = step.load("plc_scada_lab.backend.poller").Poller.from_config(config.scada_devices)
+                poller.attach(self.fleet)
+                self.poller = poller
+                self._task(poller.run())
+                logger.info(f"Polling {len(poller.devices)} SCADA devices")
+
+        if self._enabled("streaming"):
+            with self._starting("streaming") as step:
+                streaming = step.load("plc_scada_lab.backend.streaming")
+                self.streamers = streaming.FleetStreamer(self.fleet, self.manager.send_state)
+                self._task(self.streamers.run())
+
+        if self._enabled("historian"):
+            with self._starting("historian") as step:
+                historian = step.load("plc_scada_lab.backend.historian").Historian(config.historian_dir)
+                for plc_id, fleet_plc in self.fleet.plcs.items():
+                    historian.attach(plc_id, fleet_plc)
+                self.historian = historian
+                self._task(historian.run())
+
+        if self._enabled("alarms"):
+            with self._starting("alarms") as step:
+                alarms = step.load("plc_scada_lab.backend.alarms")
+                alarm_engine = alarms.AlarmEngine(alarms.AlarmSet.load(alarms.ALARMS / config.alarm_set),
+                                                  config.alarm_dir)
+                for plc_id, fleet_plc in self.fleet.plcs.items():
+                    try:
+                        alarm_engine.attach(plc_id, fleet_plc)
+                    except alarms.AlarmError as e:
+                        logger.error(f"No alarms for PLC {plc_id}: {e}")
+                self.alarm_engine = alarm_engine
+                self._task(alarm_engine.run(self.send_alarms))
+
+        # PLC_JOURNAL_DIR records every PLC's inputs for replay (see backend/journal.py)
+        if config.journal_dir and self._enabled("journal"):
+            with self._starting("journal"):
+                self.fleet.start_journals(config.journal_dir)
+
+        with self._starting("metrics"):
+            self._task(metrics.monitor_event_loop())
+            self._register_gauges()
+
+        now = time.perf_counter()
+        self.startup["startup_ms"] = round((now - started) * 1000.0, 1)
+        self.startup["since_import_ms"] = round((now - IMPORT_STARTED) * 1000.0, 1)
+        costs = ", ".join(f"{name} {times.get('import_ms', 0) + times.get('init_ms', 0):.0f}ms"
+                          for name, times in self.startup["subsystems"].items() if "init_ms" in times)
+        logger.info(f"PLC SCADA Lab API started in {self.startup['startup_ms']:.0f}ms ({costs})")
+
+    async def _load_lessons(self):
+        """Build the lesson store off the event loop, while the app already serves"""
+        def load():
+            with self._starting("lessons") as step:
+                return step.load("plc_scada_lab.backend.lessons").LessonStore()
+
+        store = await asyncio.to_thread(load)
+        if store is not None:
+            self.lessons = store
+            self._task(store.watch())
+        return store
+
+    async def lesson_store(self):
+        """The lesson store, waiting for it to load; None without lessons"""
+        if self._lessons_task is None:
+            return None
+        return await asyncio.shield(self._lessons_task)
+
+    async def _serve_modbus(self, port: int, context):
+        try:
+            await self.core.serve_modbus(context, port=port)
+        except OSError as e:
+            # Typically another worker of the same app serving the port
+            logger.error(f"Modbus TCP server on port {port} not started: {e}")
+
+    def _register_gauges(self):
+        """Scrape-time metrics of the connections and PLCs of this app"""
+        manager = self.manager
+        gauges = [
+            lambda: metrics.Gauge("plc_ws_connections", "Connected WebSocket clients",
+                                  lambda: len(manager.active_connections)),
+            lambda: metrics.Gauge("plc_ws_queue_depth", "Frames waiting in each client's send queue",
+                                  manager.queue_depths, ("client",)),
+        ]
+        if self.fleet is not None:
+            fleet = self.fleet
+            gauges.append(lambda: metrics.scan_gauges(lambda: fleet.plcs))
+        if self.alarm_engine is not None:
+            alarm_engine = self.alarm_engine
+            gauges.append(lambda: metrics.Gauge(
+                "plc_alarms_active", "Alarms in the active list, by priority",
+                lambda: [((plc_id, priority), count)
+                         for plc_id, state in sorted(alarm_engine.plcs.items())
+                         for priority, count in state.counts().items()],
+                ("plc", "priority")))
+        for gauge in gauges:
+            try:
+                registered = gauge()
+            except ValueError as e:
+                logger.warning(f"Metrics of another app of this process kept: {e}")
+                continue
+            self.gauges.extend(registered if isinstance(registered, list) else [registered])
+
+    async def stop(self):
+        """Stop every subsystem that was started"""
+        if self.core is not None:
+            try:
+                await self.core.stop_modbus()
+            except Exception as e:
+                logger.error(f"Error stopping Modbus server: {e}")
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        if self.core is not None:
+            self.core.stop_plcs()
+        if self.historian is not None:
+            try:
+                self.historian.close()
+            except Exception as e:
+                logger.error(f"Error closing historian: {e}")
+        if self.alarm_engine is not None:
+            self.alarm_engine.close()
+        if self.poller is not None:
+            self.poller.close()
+        if self._simulator_lock is not None:
+            os.close(self._simulator_lock)
+            self._simulator_lock = None
+        for gauge in self.gauges:
+            metrics.REGISTRY.unregister(gauge.name)
+        self.gauges = []
+        logger.info("PLC SCADA Lab API stopped")
+
+    @contextlib.asynccontextmanager
+    async def lifespan(self, app: FastAPI):
+        await self.start()
+        try:
+            yield
+        finally:
+            await self.stop()
+
+    def send_alarms(self, plc_id: int, message: dict):
+        """Queue an alarm push for every client watching a PLC"""
+        streamer = self.streamers.streamers.get(plc_id) if self.streamers is not None else None
+        if streamer is None or not streamer.client_groups:
+            return
+        message_str = json.dumps(message)
+        for websocket in list(streamer.client_groups):
+            self.manager.send(websocket, message_str)
+
+    def send_active_alarms(self, websocket, plc_id: int):
+        """Send a client the active list of the PLC it watches"""
+        if self.alarm_engine is not None and plc_id in self.alarm_engine.plcs:
+            self.manager.send_json(websocket, {
+                "kind": "alarms",
+                "payload": {**self.alarm_engine.active(plc_id), "snapshot": True}
+            })
+
+def create_app(config: AppConfig = None) -> FastAPI:
+    """A new app, its subsystems start and stop with it (see `Lab`)
+
+    Without a config, settings come from the environment (`AppConfig.from_env`).
+    """
+    started = time.perf_counter()
+    lab = Lab(config or AppConfig.from_env())
+    app = FastAPI(title="PLC SCADA Lab", version="1.0.0", lifespan=lab.lifespan)
+    app.state.lab = lab
+    app.include_router(router)
+    lab.startup["import_ms"] = IMPORT_MS
+    lab.startup["create_ms"] = round((time.perf_counter() - started) * 1000.0, 1)
+    return app
+
+def __getattr__(name: str):
+    # `api:app` is built from the environment on first use, not on import
+    if name == "app":
+        global app
+        app = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+router = APIRouter()
+
+def unknown_plc(plc_id):
+    return HTTPException(status_code=404, detail=f"PLC {plc_id} not found")
+
+WS_MESSAGE_KINDS = ("action", "batch", "subscribe", "resync", "ack", "lesson", "search")
+
+def timed(kind: str):
+    """Record the latency of an HTTP endpoint as plc_request_seconds"""
+    def decorate(handler):
+        histogram = metrics.REQUEST_SECONDS.labels("http", kind)
+        @functools.wraps(handler)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await handler(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started)
+        return wrapper
+    return decorate
+
+@router.get("/", response_class=HTMLResponse)
+async def get_index(request: Request):
+    """Serve the main application page, referencing fingerprinted assets"""
+    store = request.app.state.lab.assets
+    index_body = store.index_body if store is not None else None
+    if index_body is not None:
+        return index_body.response(request)
     else:
         # Return a basic HTML page if frontend not found
         return HTMLResponse(content="""
@@ -113,45 +483,86 @@ async def get_index():
         </html>
         """, status_code=200)
 
-@app.get("/api/lessons")
-async def get_lessons():
+@router.get("/static/{name:path}")
+async def get_asset(name: str, request: Request):
+    """Serve a frontend file; fingerprinted names are cached for good"""
+    store = request.app.state.lab.assets
+    body = store.get(name) if store is not None else None
+    if body is None:
+        raise HTTPException(status_code=404, detail="Not found")
+    return body.response(request)
+
+@router.get("/api/lessons")
+async def get_lessons(request: Request):
     """Get list of available lessons"""
-    if MODULES_AVAILABLE:
+    store = await request.app.state.lab.lesson_store()
+    if store is not None:
         try:
-            return {"lessons": list_lessons()}
+            return store.index_body.response(request)
         except Exception as e:
             logger.error(f"Error loading lessons: {e}")
-    
+
     # Return mock lessons if modules not available
     return {"lessons": ["01_intro", "02_modbus", "03_ladder_logic"]}
 
-@app.get("/api/lesson/{lesson_name}")
-async def get_lesson(lesson_name: str):
-    """Get specific lesson content"""
-    if MODULES_AVAILABLE:
+@router.get("/api/lesson/{lesson_name}")
+async def get_lesson(lesson_name: str, request: Request):
+    """Get specific lesson content, Markdown source and rendered HTML"""
+    store = await request.app.state.lab.lesson_store()
+    if store is not None:
         try:
-            content = load_md(lesson_name)
-            return {"name": lesson_name, "content": content}
+            return store.get(lesson_name).json_body.response(request)
         except FileNotFoundError:
             raise HTTPException(status_code=404, detail="Lesson not found")
         except Exception as e:
             logger.error(f"Error loading lesson {lesson_name}: {e}")
-    
+
     # Return mock content if modules not available
     return {
         "name": lesson_name,
         "content": f"# {lesson_name}\n\nLesson content would be loaded here."
     }
 
-@app.get("/api/state")
-async def get_state():
+@router.get("/api/lesson/{lesson_name}/html")
+async def get_lesson_html(lesson_name: str, request: Request):
+    """Get the rendered HTML of a lesson"""
+    store = await request.app.state.lab.lesson_store()
+    if store is None:
+        raise HTTPException(status_code=503, detail="Lessons not available")
+    try:
+        return store.get(lesson_name).html_body.response(request)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Lesson not found")
+
+@router.get("/api/search")
+async def search(request: Request, q: str = Query(..., max_length=200),
+                 limit: int = Query(10, ge=1, le=100)):
+    """Search the lessons, returns ranked section hits with highlighted snippets"""
+    store = await request.app.state.lab.lesson_store()
+    if store is None:
+        raise HTTPException(status_code=503, detail="Lessons not available")
+    return store.search(q, limit)
+
+@router.get("/api/plcs")
+async def get_plcs(request: Request):
+    """List the PLCs of the fleet with their Modbus addresses"""
+    lab = request.app.state.lab
+    if lab.plc is not None:
+        return {"plcs": lab.core.list_plcs()}
+    return {"plcs": []}
+
+@router.get("/api/state")
+async def get_state(request: Request, plc_id: Optional[int] = Query(None, alias="plc")):
     """Get current PLC state"""
-    if plc is not None and MODULES_AVAILABLE:
+    lab = request.app.state.lab
+    if lab.plc is not None:
         try:
-            return get_plc_state()
+            return lab.core.get_plc_state(plc_id)
+        except KeyError:
+            raise unknown_plc(plc_id)
         except Exception as e:
             logger.error(f"Error getting PLC state: {e}")
-    
+
     # Return mock state if PLC system not available
     return {
         'coils': [False] * 8,
@@ -163,12 +574,92 @@ async def get_state():
         'scan_time': 0.1
     }
 
-@app.post("/api/action")
-async def perform_action(action: ActionRequest):
+@router.get("/api/history")
+async def get_history(request: Request, tag: List[str] = Query(...),
+                      plc_id: Optional[int] = Query(None, alias="plc"),
+                      start: Optional[float] = None, end: Optional[float] = None,
+                      step: Optional[float] = None, points: int = 500):
+    """Min/max/avg history of tags (e.g. `tag=hr:0,co:2`) downsampled into buckets"""
+    lab = request.app.state.lab
+    if lab.historian is None:
+        raise HTTPException(status_code=503, detail="History not available")
+    tags = [name for value in tag for name in value.split(",") if name]
+    try:
+        plc_id = lab.fleet.resolve(plc_id)
+        # Off the event loop: long windows take a few milliseconds of numpy
+        return await asyncio.to_thread(lab.historian.query, plc_id, tags, start, end, step, points)
+    except KeyError:
+        raise unknown_plc(plc_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def _alarms(lab: Lab, plc_id):
+    """Resolved PLC id with alarms, or the HTTP error to raise"""
+    if lab.alarm_engine is None:
+        raise HTTPException(status_code=503, detail="Alarms not available")
+    try:
+        plc_id = lab.fleet.resolve(plc_id)
+    except KeyError:
+        raise unknown_plc(plc_id)
+    if plc_id not in lab.alarm_engine.plcs:
+        raise HTTPException(status_code=404, detail=f"PLC {plc_id} has no alarms")
+    return plc_id
+
+@router.get("/api/alarms")
+async def get_alarms(request: Request, plc_id: Optional[int] = Query(None, alias="plc"),
+                     priority: Optional[int] = Query(None, ge=1, le=4),
+                     shelved: bool = False, limit: int = Query(100, ge=1, le=10000)):
+    """Active alarms, most urgent and newest first; `shelved` lists the shelved ones"""
+    lab = request.app.state.lab
+    plc_id = _alarms(lab, plc_id)
+    return lab.alarm_engine.active(plc_id, priority, shelved, limit)
+
+@router.get("/api/alarms/events")
+async def get_alarm_events(request: Request, plc_id: Optional[int] = Query(None, alias="plc"),
+                           alarm: List[str] = Query(None), kind: List[str] = Query(None),
+                           priority: Optional[int] = Query(None, ge=1, le=4),
+                           start: Optional[float] = None, end: Optional[float] = None,
+                           before: Optional[int] = None, limit: int = Query(100, ge=1, le=1000)):
+    """Alarm journal, newest first; pass `next` back as `before` for the next page"""
+    lab = request.app.state.lab
+    plc_id = _alarms(lab, plc_id)
+    alarms = [name for value in alarm for name in value.split(",") if name] if alarm else None
+    kinds = [name for value in kind for name in value.split(",") if name] if kind else None
+    try:
+        return await asyncio.to_thread(lab.alarm_engine.events, plc_id, alarms, kinds, priority,
+                                       start, end, before, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.post("/api/alarms/ack")
+async def ack_alarms(request: Request, ack: AckRequest):
+    """Acknowledge alarms, all of them without a list of names"""
+    lab = request.app.state.lab
+    plc_id = _alarms(lab, ack.plc)
+    try:
+        return {"success": True, "acked": lab.alarm_engine.ack(plc_id, ack.alarms)}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.post("/api/alarms/shelve")
+async def shelve_alarm(request: Request, shelve: ShelveRequest):
+    """Shelve an alarm for some seconds, or unshelve it with 0"""
+    lab = request.app.state.lab
+    plc_id = _alarms(lab, shelve.plc)
+    try:
+        lab.alarm_engine.shelve(plc_id, shelve.alarm, shelve.seconds)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"success": True}
+
+@router.post("/api/action")
+@timed("action")
+async def perform_action(request: Request, action: ActionRequest):
     """Perform PLC action"""
-    if plc is None or not MODULES_AVAILABLE:
+    lab = request.app.state.lab
+    if lab.plc is None:
         # Mock response if PLC system not available
-        await manager.broadcast({
+        lab.manager.broadcast({
             "kind": "state",
             "payload": {
                 'coils': [False] * 8,
@@ -181,54 +672,125 @@ async def perform_action(action: ActionRequest):
             }
         })
         return {"success": True, "message": "Action performed (simulation mode)"}
-        
+
     success = False
-    
+
     try:
         if action.action_type == "set_input":
-            success = set_discrete_input(action.address, bool(action.value))
+            success = lab.core.set_discrete_input(action.address, bool(action.value), action.plc)
         elif action.action_type == "set_register":
-            success = set_holding_register(action.address, int(action.value))
+            success = lab.core.set_holding_register(action.address, int(action.value), action.plc)
         else:
             raise HTTPException(status_code=400, detail="Invalid action type")
-            
+
         if success:
-            # Broadcast state update to all clients
-            await manager.broadcast({
-                "kind": "state",
-                "payload": get_plc_state()
-            })
+            # Applied at the next scan and streamed to clients from there
             return {"success": True, "message": "Action performed successfully"}
         else:
             raise HTTPException(status_code=400, detail="Action failed")
+    except HTTPException:
+        raise
+    except KeyError:
+        raise unknown_plc(action.plc)
     except Exception as e:
         logger.error(f"Error performing action: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
-@app.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket):
-    """WebSocket endpoint for real-time communication"""
+@router.post("/api/batch")
+@timed("batch")
+async def perform_batch(request: Request, batch: BatchRequest):
+    """Apply an ordered list of actions atomically at the next scan"""
+    lab = request.app.state.lab
+    if lab.plc is None:
+        # One mock state update for the whole batch
+        lab.manager.broadcast({
+            "kind": "state",
+            "payload": {
+                'coils': [False] * 8,
+                'discrete_inputs': [False] * 8,
+                'holding_registers': [800, 0, 0, 0, 800, 0, 0, 0],
+                'input_registers': [800, 0, 0, 0, 0, 0, 0, 0],
+                'motor_running': False,
+                'pump_running': False,
+                'scan_time': 0.1
+            }
+        })
+        return {"success": True, "count": len(batch.actions), "message": "Batch performed (simulation mode)"}
+
+    try:
+        count = lab.core.batch_actions(batch.actions, batch.plc)
+        return {"success": True, "count": count}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except KeyError:
+        raise unknown_plc(batch.plc)
+    except Exception as e:
+        logger.error(f"Error performing batch: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+@router.get("/api/scan")
+async def get_scan(request: Request, plc_id: Optional[int] = Query(None, alias="plc")):
+    """Get scan scheduler settings and scan-time statistics"""
+    lab = request.app.state.lab
+    if lab.plc is not None:
+        try:
+            return lab.core.get_scan_stats(plc_id)
+        except KeyError:
+            raise unknown_plc(plc_id)
+        except Exception as e:
+            logger.error(f"Error getting scan statistics: {e}")
+
+    return {"scan_time": 0.1, "fast_forward": False, "time_scale": 1.0,
+            "stats": {"scans": 0, "overruns": 0, "faults": 0}}
+
+@router.post("/api/scan")
+async def set_scan(request: Request, config: ScanConfigRequest):
+    """Change the scan period, fast-forward mode and/or time scale"""
+    lab = request.app.state.lab
+    if lab.plc is None:
+        return {"success": True, "message": "Scan configured (simulation mode)"}
+    try:
+        lab.core.configure_scan(config.scan_time, config.fast_forward, config.plc, config.time_scale)
+    except KeyError:
+        raise unknown_plc(config.plc)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"success": True, **lab.core.get_scan_stats(config.plc)}
+
+@router.websocket("/ws")
+async def websocket_endpoint(websocket: WebSocket, plc_id: Optional[int] = Query(None, alias="plc")):
+    """WebSocket endpoint for real-time communication
+
+    `?plc=<id>` selects the PLC the client watches and controls; a
+    subscribe message carrying a "plc" key switches to another one.
+    Clients offering the `plc-scada.binary.v1` subprotocol receive state
+    frames in binary (see `binary_frames`), everything else as JSON.
+    """
+    lab = websocket.app.state.lab
+    manager, streamers, alarm_engine = lab.manager, lab.streamers, lab.alarm_engine
+    if lab.plc is not None:
+        try:
+            plc_id = lab.fleet.resolve(plc_id)
+        except KeyError:
+            await websocket.close(code=1008, reason=f"PLC {plc_id} not found")
+            return
     await manager.connect(websocket)
-    
+
     try:
-        # Send initial data
-        if MODULES_AVAILABLE:
-            try:
-                lessons = list_lessons()
-            except:
-                lessons = ["01_intro", "02_modbus", "03_ladder_logic"]
+        # Send initial data, the lesson index is serialized once for all clients
+        lesson_store = await lab.lesson_store()
+        if lesson_store is not None:
+            manager.send(websocket, lesson_store.index_message)
         else:
-            lessons = ["01_intro", "02_modbus", "03_ladder_logic"]
-            
-        await websocket.send_text(json.dumps({
-            "kind": "lessons",
-            "payload": lessons
-        }))
-        
+            manager.send_json(websocket, {
+                "kind": "lessons",
+                "payload": ["01_intro", "02_modbus", "03_ladder_logic"]
+            })
+
         # Send initial state
-        if plc is not None and MODULES_AVAILABLE:
+        if lab.plc is not None:
             try:
-                initial_state = get_plc_state()
+                initial_state = lab.core.get_plc_state(plc_id)
             except:
                 initial_state = {
                     'coils': [False] * 8,
@@ -249,141 +811,208 @@ async def websocket_endpoint(websocket: WebSocket):
                 'pump_running': False,
                 'scan_time': 0.1
             }
-        
-        await websocket.send_text(json.dumps({
+
+        manager.send_json(websocket, {
             "kind": "state",
             "payload": initial_state
-        }))
-        
+        })
+
+        # Stream changes to the default subscription from here on
+        streamer = None
+        if streamers is not None:
+            streamer = streamers.streamer(plc_id)
+            manager.attach(websocket, streamer)
+            streamer.subscribe(websocket, binary=manager.is_binary(websocket))
+            streamer.send_keyframe(websocket)
+            lab.send_active_alarms(websocket, plc_id)
+
         # Handle incoming messages
         while True:
             try:
                 data = await websocket.receive_text()
                 message = json.loads(data)
-                
+                started = time.perf_counter()
+
                 if message["kind"] == "action":
                     payload = message["payload"]
                     success = False
-                    
-                    if plc is not None and MODULES_AVAILABLE:
+
+                    if lab.plc is not None:
                         try:
                             if payload.get("action_type") == "toggle_input":
                                 address = int(payload["address"])
-                                current_state = get_plc_state()
-                                new_value = not current_state["discrete_inputs"][address]
-                                success = set_discrete_input(address, new_value)
-                                
+                                success = lab.core.toggle_discrete_input(address, plc_id)
+
                             elif payload.get("action_type") == "set_register":
                                 address = int(payload["address"])
                                 value = int(payload["value"])
-                                success = set_holding_register(address, value)
-                                
+                                success = lab.core.set_holding_register(address, value, plc_id)
+
                             elif payload.get("flip") is not None:  # Legacy support
                                 address = int(payload["flip"])
-                                current_state = get_plc_state()
-                                new_value = not current_state["discrete_inputs"][address]
-                                success = set_discrete_input(address, new_value)
+                                success = lab.core.toggle_discrete_input(address, plc_id)
                         except Exception as e:
                             logger.error(f"Error processing action: {e}")
                     else:
                         # Mock success in simulation mode
                         success = True
-                    
-                    if success:
-                        # Broadcast updated state to all clients
-                        if plc is not None and MODULES_AVAILABLE:
-                            try:
-                                state_payload = get_plc_state()
-                            except:
-                                state_payload = initial_state
-                        else:
-                            # Mock state update
-                            state_payload = initial_state
-                        
-                        await manager.broadcast({
+
+                    # Real changes are applied at the next scan and streamed
+                    # to clients from there
+                    if success and streamers is None:
+                        # Mock state update
+                        manager.broadcast({
                             "kind": "state",
-                            "payload": state_payload
+                            "payload": initial_state
+                        })
+
+                elif message["kind"] == "batch":
+                    # payload is {"actions": [...]} or the list of actions itself
+                    payload = message["payload"]
+                    actions = payload.get("actions", []) if isinstance(payload, dict) else payload
+                    try:
+                        if lab.plc is not None:
+                            count = lab.core.batch_actions(actions, plc_id)
+                        else:
+                            count = len(actions)
+                            manager.broadcast({
+                                "kind": "state",
+                                "payload": initial_state
+                            })
+                        manager.send_json(websocket, {
+                            "kind": "batch",
+                            "payload": {"success": True, "count": count}
+                        })
+                    except (ValueError, TypeError) as e:
+                        manager.send_json(websocket, {
+                            "kind": "error",
+                            "payload": f"Batch rejected: {e}"
                         })
-                        
+
+                elif message["kind"] == "subscribe":
+                    if streamers is not None:
+                        payload = dict(message["payload"])
+                        target_id = payload.pop("plc", plc_id)
+                        try:
+                            target = streamers.streamer(target_id)
+                            target.subscribe(websocket, payload or None, manager.is_binary(websocket))
+                        except KeyError:
+                            manager.send_json(websocket, {
+                                "kind": "error",
+                                "payload": f"PLC {target_id} not found"
+                            })
+                            continue
+                        except (ValueError, TypeError, AttributeError) as e:
+                            manager.send_json(websocket, {
+                                "kind": "error",
+                                "payload": f"Invalid subscription: {e}"
+                            })
+                            continue
+                        if target is not streamer:
+                            manager.attach(websocket, target)
+                            streamer, plc_id = target, lab.fleet.resolve(target_id)
+                            lab.send_active_alarms(websocket, plc_id)
+                        streamer.send_keyframe(websocket)
+
+                elif message["kind"] == "ack":
+                    # payload is a list of alarm names, or null for all of them
+                    if alarm_engine is not None and plc_id in alarm_engine.plcs:
+                        try:
+                            alarm_engine.ack(plc_id, message.get("payload"))
+                        except (ValueError, TypeError) as e:
+                            manager.send_json(websocket, {
+                                "kind": "error",
+                                "payload": f"Acknowledge failed: {e}"
+                            })
+
+                elif message["kind"] == "resync":
+                    if streamer is not None:
+                        streamer.send_keyframe(websocket)
+
                 elif message["kind"] == "lesson":
                     lesson_name = message["payload"]
                     try:
-                        if MODULES_AVAILABLE:
-                            content = load_md(lesson_name)
+                        if lesson_store is not None:
+                            manager.send(websocket, lesson_store.get(lesson_name).message)
                         else:
-                            content = f"# {lesson_name}\n\nLesson content would be loaded here."
-                        await websocket.send_text(json.dumps({
-                            "kind": "lesson",
-                            "payload": content
-                        }))
+                            manager.send_json(websocket, {
+                                "kind": "lesson",
+                                "payload": {
+                                    "name": lesson_name,
+                                    "content": f"# {lesson_name}\n\nLesson content would be loaded here."
+                                }
+                            })
                     except FileNotFoundError:
-                        await websocket.send_text(json.dumps({
+                        manager.send_json(websocket, {
                             "kind": "error",
                             "payload": f"Lesson '{lesson_name}' not found"
-                        }))
+                        })
                     except Exception as e:
                         logger.error(f"Error loading lesson: {e}")
-                        await websocket.send_text(json.dumps({
+                        manager.send_json(websocket, {
                             "kind": "error",
                             "payload": f"Error loading lesson: {str(e)}"
-                        }))
-                        
+                        })
+
+                elif message["kind"] == "search":
+                    # payload is the query, or {"q": ..., "limit": ...}
+                    query = message.get("payload") or ""
+                    limit = 10
+                    if isinstance(query, dict):
+                        limit = max(1, min(int(query.get("limit", limit)), 100))
+                        query = query.get("q") or ""
+                    if lesson_store is not None:
+                        result = lesson_store.search(str(query)[:200], limit)
+                    else:
+                        result = {"query": query, "total": 0, "hits": []}
+                    manager.send_json(websocket, {
+                        "kind": "search",
+                        "payload": result
+                    })
+
+                kind = message["kind"] if message["kind"] in WS_MESSAGE_KINDS else "other"
+                metrics.REQUEST_SECONDS.labels("ws", kind).observe(time.perf_counter() - started)
+
             except json.JSONDecodeError:
-                await websocket.send_text(json.dumps({
+                manager.send_json(websocket, {
                     "kind": "error",
                     "payload": "Invalid JSON message"
-                }))
+                })
+            except WebSocketDisconnect:
+                raise
             except Exception as e:
                 logger.error(f"WebSocket message error: {e}")
-                
+
     except WebSocketDisconnect:
         manager.disconnect(websocket)
     except Exception as e:
         logger.error(f"WebSocket error: {e}")
         manager.disconnect(websocket)
 
-# Background task to broadcast state updates (only if PLC available)
-async def state_broadcaster():
-    """Periodically broadcast state updates"""
-    while True:
-        try:
-            if plc is not None and manager.active_connections and MODULES_AVAILABLE:
-                try:
-                    await manager.broadcast({
-                        "kind": "state",
-                        "payload": get_plc_state()
-                    })
-                except Exception as e:
-                    logger.error(f"Error broadcasting state: {e}")
-            await asyncio.sleep(1)  # Broadcast every second
-        except Exception as e:
-            logger.error(f"State broadcaster error: {e}")
-            await asyncio.sleep(5)
-
-@app.on_event("startup")
-async def startup_event():
-    """Start background tasks"""
-    if plc is not None and MODULES_AVAILABLE:
-        asyncio.create_task(state_broadcaster())
-    logger.info("PLC SCADA Lab API started")
-
-@app.on_event("shutdown")
-async def shutdown_event():
-    """Cleanup on shutdown"""
-    if plc is not None:
-        try:
-            plc.stop_simulation()
-        except:
-            pass
-    logger.info("PLC SCADA Lab API stopped")
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Instrumentation in the Prometheus text format"""
+    return PlainTextResponse(metrics.REGISTRY.render(),
+                             media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@router.get("/api/startup")
+async def get_startup(request: Request):
+    """Import and init time of the app and each of its subsystems, in milliseconds"""
+    return request.app.state.lab.startup
 
 # Health check endpoint
-@app.get("/health")
-async def health_check():
+@router.get("/health")
+async def health_check(request: Request):
     """Health check endpoint"""
+    lab = request.app.state.lab
+    subsystems = lab.startup["subsystems"]
     return {
         "status": "healthy",
-        "modules_available": MODULES_AVAILABLE,
-        "plc_available": plc is not None,
-        "frontend_available": FRONTEND_DIR.exists()
-    }
\ No newline at end of file
+        "modules_available": not any(times["status"] == "failed" for times in subsystems.values()),
+        "plc_available": lab.plc is not None,
+        "modbus_available": lab.core is not None and bool(lab.core.modbus_servers),
+        "frontend_available": lab.assets is not None and lab.assets.directory.exists(),
+        "subsystems": {name: times["status"] for name, times in subsystems.items()},
+    }
+
+IMPORT_MS = round((time.perf_counter() - IMPORT_STARTED) * 1000.0, 1)
@@ -0,0 +1,125 @@
+"""Frontend assets, fingerprinted and pre-compressed in memory
+
+Every file of `frontend/` is read once per version and served from memory
+under a name carrying a hash of its content (`app.3f9c2a71d0.js`), with
+its ETag and gzip/brotli variants prepared up front. Since such a name
+never changes meaning, browsers may cache it forever. `index.html` is
+rewritten to reference the fingerprinted names and is itself revalidated
+on every load, which costs a 304 while nothing changed.
+"""
+import asyncio
+import hashlib
+import logging
+import mimetypes
+import pathlib
+import re
+
+from plc_scada_lab.backend.http_cache import CachedBody
+
+logger = logging.getLogger(__name__)
+
+FRONTEND = pathlib.Path(__file__).parent.parent / "frontend"
+WATCH_INTERVAL = 1.0  # Seconds between checks of the frontend directory
+INDEX = "index.html"
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+# src="static/app.js", href="/static/styles.css?v=2" and the like
+_REFERENCE = re.compile(r"""(?P<attribute>(?:src|href)\s*=\s*["'])/?static/(?P<path>[^"'?#]+)[^"']*""")
+
+def fingerprinted(path: str, body: bytes) -> str:
+    """`path` with a hash of `body` before its suffix"""
+    digest = hashlib.blake2b(body, digest_size=5).hexdigest()
+    stem, dot, suffix = path.rpartition(".")
+    return f"{stem}.{digest}.{suffix}" if dot and "/" not in suffix else f"{path}.{digest}"
+
+class Asset:
+    """One frontend file, read and compressed once per version of it"""
+
+    def __init__(self, name: str, path: pathlib.Path, version: tuple):
+        self.name = name
+        self.version = version  # (mtime_ns, size) when read
+        body = path.read_bytes()
+        self.fingerprinted = fingerprinted(name, body)
+        media_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        self.body = CachedBody(body, media_type, IMMUTABLE)
+        # Under its plain name it may change any time
+        self.plain_body = CachedBody(body, media_type)
+
+class AssetStore:
+    """All files of the frontend directory, served from memory
+
+    `refresh()` only stats the files and re-reads the ones whose mtime or
+    size changed, rebuilding the rewritten index page when any did.
+    """
+
+    def __init__(self, directory: pathlib.Path = FRONTEND, interval: float = WATCH_INTERVAL):
+        self.directory = pathlib.Path(directory)
+        self.interval = interval
+        self.assets = {}   # name relative to the directory -> Asset
+        self.bodies = {}   # fingerprinted or plain name -> CachedBody
+        self.index_body = None
+        self.refresh()
+
+    def refresh(self) -> list:
+        """Pick up added, changed and removed files, returns their names"""
+        versions = {}
+        if self.directory.is_dir():
+            for path in self.directory.rglob("*"):
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                if path.is_file():
+                    name = path.relative_to(self.directory).as_posix()
+                    versions[name] = (stat.st_mtime_ns, stat.st_size)
+        changed = [name for name in self.assets if name not in versions]
+        for name in changed:
+            del self.assets[name]
+        for name, version in versions.items():
+            asset = self.assets.get(name)
+            if asset is not None and asset.version == version:
+                continue
+            try:
+                self.assets[name] = Asset(name, self.directory / name, version)
+            except OSError as e:
+                logger.error(f"Error loading asset {name}: {e}")
+                continue
+            changed.append(name)
+        if changed:
+            if self.bodies:
+                logger.info(f"Frontend assets reloaded: {', '.join(sorted(changed))}")
+            self._rebuild()
+        return changed
+
+    def _rebuild(self):
+        bodies = {}
+        for name, asset in self.assets.items():
+            bodies[name] = asset.plain_body
+            bodies[asset.fingerprinted] = asset.body
+        self.bodies = bodies
+        index = self.assets.get(INDEX)
+        if index is None:
+            self.index_body = None
+            return
+
+        def reference(match):
+            asset = self.assets.get(match["path"])
+            if asset is None:
+                return match[0]
+            return f"{match['attribute']}/static/{asset.fingerprinted}"
+
+        html = _REFERENCE.sub(reference, index.plain_body.body.decode("utf-8"))
+        self.index_body = CachedBody(html.encode("utf-8"), "text/html")
+
+    def get(self, name: str) -> CachedBody:
+        """Body of an asset by fingerprinted or plain name, None if unknown"""
+        return self.bodies.get(name)
+
+    async def watch(self):
+        """Refresh the store whenever the frontend directory changes"""
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await asyncio.to_thread(self.refresh)
+            except Exception as e:
+                logger.error(f"Asset watch error: {e}")
@@ -0,0 +1,103 @@
+"""Binary WebSocket frames for state streaming
+
+Clients that offer the `SUBPROTOCOL` WebSocket subprotocol receive state
+deltas and keyframes as binary frames; every other message stays JSON text.
+All integers are little-endian.
+
+Header (26 bytes)::
+
+    u8  version      1
+    u8  kind         1 = delta, 2 = keyframe
+    u8  flags        bit 0 motor running, bit 1 pump running
+    u8  reserved
+    u32 seq          subscription sequence number, as in JSON frames
+    u64 scan         scan count of the snapshot
+    f64 scan_time    seconds
+    u16 blocks       number of blocks that follow
+
+Block (10-byte header + data)::
+
+    u8  table        index into image.TABLES (coils, discrete_inputs,
+                     holding_registers, input_registers)
+    u8  layout       0 = range, 1 = sparse
+    u32 start        first address of a range, 0 for sparse blocks
+    u32 count        number of points
+    [u16 * count]    addresses, sparse blocks only
+    values           bit tables: ceil(count / 8) bytes, LSB first;
+                     register tables: u16 * count
+
+Keyframes carry one range block per subscribed range, deltas one sparse
+block per table with changes.
+"""
+import struct
+
+import numpy as np
+
+from plc_scada_lab.backend.image import BIT_TABLES, TABLES
+
+SUBPROTOCOL = "plc-scada.binary.v1"
+VERSION = 1
+DELTA = 1
+KEYFRAME = 2
+RANGE = 0
+SPARSE = 1
+MOTOR_RUNNING = 0x01
+PUMP_RUNNING = 0x02
+
+HEADER = struct.Struct("<BBBxIQdH")
+BLOCK = struct.Struct("<BBII")
+TABLE_IDS = {table: i for i, table in enumerate(TABLES)}
+
+def _values(table: str, values: np.ndarray) -> bytes:
+    if table in BIT_TABLES:
+        return np.packbits(values, bitorder="little").tobytes()
+    return values.astype("<u2", copy=False).tobytes()
+
+def range_block(table: str, start: int, values: np.ndarray) -> bytes:
+    """Block holding the values of `count` consecutive points"""
+    return BLOCK.pack(TABLE_IDS[table], RANGE, start, values.size) + _values(table, values)
+
+def sparse_block(table: str, addresses: np.ndarray, values: np.ndarray) -> bytes:
+    """Block holding the values of scattered points"""
+    return (BLOCK.pack(TABLE_IDS[table], SPARSE, 0, addresses.size)
+            + addresses.astype("<u2").tobytes() + _values(table, values))
+
+def encode_frame(kind: int, seq: int, status: dict, scan: int, blocks: list) -> bytes:
+    flags = ((MOTOR_RUNNING if status["motor_running"] else 0)
+             | (PUMP_RUNNING if status["pump_running"] else 0))
+    header = HEADER.pack(VERSION, kind, flags, seq, scan, status["scan_time"], len(blocks))
+    return header + b"".join(blocks)
+
+def decode_frame(data: bytes) -> dict:
+    """Frame as a JSON-style delta payload (address strings to values)"""
+    version, kind, flags, seq, scan, scan_time, count = HEADER.unpack_from(data)
+    if version != VERSION:
+        raise ValueError(f"Unsupported frame version {version}")
+    payload = {
+        "seq": seq,
+        "keyframe": kind == KEYFRAME,
+        "scan": scan,
+        "motor_running": bool(flags & MOTOR_RUNNING),
+        "pump_running": bool(flags & PUMP_RUNNING),
+        "scan_time": scan_time,
+    }
+    offset = HEADER.size
+    for _ in range(count):
+        table_id, layout, start, size = BLOCK.unpack_from(data, offset)
+        offset += BLOCK.size
+        table = TABLES[table_id]
+        if layout == SPARSE:
+            addresses = np.frombuffer(data, "<u2", size, offset)
+            offset += 2 * size
+        else:
+            addresses = np.arange(start, start + size)
+        if table in BIT_TABLES:
+            nbytes = (size + 7) // 8
+            bits = np.frombuffer(data, np.uint8, nbytes, offset)
+            values = np.unpackbits(bits, count=size, bitorder="little").astype(bool)
+        else:
+            nbytes = 2 * size
+            values = np.frombuffer(data, "<u2", size, offset)
+        offset += nbytes
+        payload.setdefault(table, {}).update(zip(map(str, addresses.tolist()), values.tolist()))
+    return payload
@@ -0,0 +1,257 @@
+"""Checkpoints of PLC state in memory-mapped files, for warm restarts
+
+Every `interval` seconds each PLC's complete state (image buffer, ladder
+memory and process model state, see `PLCSimulator.capture_state`) is
+copied at a scan boundary, on the scan thread, and handed to one writer
+thread for the whole fleet. The scan only pays for that copy: writing the
+file, checksumming and syncing it to disk happen on the writer thread.
+On startup each PLC is restored from its latest consistent checkpoint
+before its first scan, carrying over latches, timers, counters and the
+plant state along with the image and scan count.
+
+A checkpoint file holds two slots, written alternately, so the previous
+checkpoint stays intact while the next one is written. A slot header is
+written after its data and carries a CRC of it; a slot torn by a crash
+fails the check and the other one is used.
+
+File layout (little-endian)::
+
+    b"PLCK", u16 version, u16 parts, 16-byte layout fingerprint,
+    u32 length per state part
+    two slots, each: u64 sequence (0: never written), u64 scan count,
+    f64 wall time, u32 CRC-32 of the data, then the state parts
+
+The fingerprint covers the image size, the program and the process model,
+so a checkpoint is only restored into the PLC it was taken from.
+"""
+import hashlib
+import json
+import logging
+import mmap
+import os
+import pathlib
+import struct
+import threading
+import time
+import zlib
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"PLCK"
+VERSION = 1
+CHECKPOINT_INTERVAL = 1.0  # Seconds between checkpoints of one PLC
+
+HEADER = struct.Struct("<4sHH16s")
+LENGTH = struct.Struct("<I")
+SLOT = struct.Struct("<QQdI")
+
+def fingerprint(plc) -> bytes:
+    """Identifies the state layout and meaning of a PLC"""
+    layout = json.dumps([plc.image.size, plc.program.definition, plc.process.definition],
+                        sort_keys=True)
+    return hashlib.blake2b(layout.encode(), digest_size=16).digest()
+
+class CheckpointFile:
+    """The two-slot, memory-mapped checkpoint file of one PLC
+
+    Opening a file whose layout does not match `lengths` and `key`
+    recreates it empty.
+    """
+
+    def __init__(self, path, key: bytes, lengths: list):
+        self.path = pathlib.Path(path)
+        self.key = key
+        self.lengths = list(lengths)
+        self.data_size = sum(self.lengths)
+        self.slot_size = SLOT.size + self.data_size
+        header = HEADER.pack(MAGIC, VERSION, len(self.lengths), key) + b"".join(
+            LENGTH.pack(length) for length in self.lengths)
+        self.offset = len(header)
+        size = self.offset + 2 * self.slot_size
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            existing = os.pread(fd, len(header), 0)
+            if existing != header or os.fstat(fd).st_size != size:
+                if existing[:4] == MAGIC:
+                    logger.warning(f"Checkpoint {self.path} is of another PLC layout, discarded")
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, size)
+                os.pwrite(fd, header, 0)
+            self._mmap = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        self.sequence = 0
+        self._next_slot = 0
+        latest = self._latest()
+        if latest is not None:
+            self.sequence = latest[1]
+            self._next_slot = 1 - latest[0]
+
+    def _slot(self, slot: int) -> int:
+        return self.offset + slot * self.slot_size
+
+    def _valid(self, slot: int) -> tuple:
+        """(sequence, scan count, wall time) of a consistent slot, or None"""
+        offset = self._slot(slot)
+        sequence, scan, stamp, crc = SLOT.unpack_from(self._mmap, offset)
+        if not sequence:
+            return None
+        start = offset + SLOT.size
+        if zlib.crc32(memoryview(self._mmap)[start:start + self.data_size]) != crc:
+            return None
+        return sequence, scan, stamp
+
+    def _latest(self) -> tuple:
+        """(slot, sequence, scan count, wall time) of the newest consistent slot"""
+        best = None
+        for slot in (0, 1):
+            valid = self._valid(slot)
+            if valid is not None and (best is None or valid[0] > best[1]):
+                best = (slot, *valid)
+        return best
+
+    def write(self, scan: int, stamp: float, parts: list, sync: bool = True):
+        """Write a state into the older slot, then make it the newest"""
+        offset = self._slot(self._next_slot)
+        view = memoryview(self._mmap)
+        SLOT.pack_into(self._mmap, offset, 0, 0, 0.0, 0)  # Invalid while written
+        position = offset + SLOT.size
+        crc = 0
+        for part in parts:
+            view[position:position + len(part)] = part
+            crc = zlib.crc32(part, crc)
+            position += len(part)
+        self.sequence += 1
+        SLOT.pack_into(self._mmap, offset, self.sequence, scan, stamp, crc)
+        if sync:
+            self._mmap.flush()
+        self._next_slot = 1 - self._next_slot
+
+    def read(self) -> tuple:
+        """(scan count, wall time, state parts) of the newest consistent slot, or None"""
+        latest = self._latest()
+        if latest is None:
+            return None
+        slot, _, scan, stamp = latest
+        position = self._slot(slot) + SLOT.size
+        parts = []
+        for length in self.lengths:
+            parts.append(bytes(self._mmap[position:position + length]))
+            position += length
+        return scan, stamp, parts
+
+    def close(self):
+        self._mmap.close()
+
+class FleetCheckpoints:
+    """Checkpoints of every PLC of a fleet into files in one directory
+
+    `attach` every PLC before it starts scanning; it is restored from its
+    file, if any, and checkpointed from then on. `close` after the scans
+    stopped writes a final checkpoint of every PLC.
+    """
+
+    def __init__(self, directory, interval: float = None):
+        self.directory = pathlib.Path(directory)
+        self.interval = CHECKPOINT_INTERVAL if interval is None else max(0.01, float(interval))
+        self.files = {}        # plc id -> CheckpointFile
+        self.plcs = {}         # plc id -> PLCSimulator
+        self._pending = {}     # plc id -> (scan, wall time, parts) waiting for the writer
+        self._wake = threading.Event()
+        self._thread = None
+        self._running = False
+
+    def path(self, plc_id: int) -> pathlib.Path:
+        return self.directory / f"plc-{plc_id}.checkpoint"
+
+    def attach(self, plc_id: int, plc) -> bool:
+        """Restore a PLC that is not scanning yet and checkpoint it from now on
+
+        Returns whether state was restored.
+        """
+        lengths = [len(part) for part in plc.capture_state()]
+        checkpoint = CheckpointFile(self.path(plc_id), fingerprint(plc), lengths)
+        self.files[plc_id] = checkpoint
+        self.plcs[plc_id] = plc
+        restored = False
+        started = time.perf_counter()
+        saved = checkpoint.read()
+        if saved is not None:
+            scan, stamp, parts = saved
+            try:
+                plc.restore_state(scan, parts)
+                restored = True
+                logger.info(f"PLC {plc_id} restored at scan {scan} from "
+                            f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(stamp))} "
+                            f"in {(time.perf_counter() - started) * 1000:.1f}ms")
+            except ValueError as e:
+                logger.error(f"Cannot restore PLC {plc_id} from {checkpoint.path}: {e}")
+        plc.observers.append(self._observer(plc_id, plc))
+        return restored
+
+    def attach_fleet(self, fleet) -> int:
+        """Attach every PLC of a fleet, returns how many were restored"""
+        if not all(hasattr(plc, "capture_state") for plc in fleet.plcs.values()):
+            logger.warning("Checkpoints need PLCs scanned in this process, not enabled")
+            return 0
+        return sum(self.attach(plc_id, plc) for plc_id, plc in sorted(fleet.plcs.items()))
+
+    def _observer(self, plc_id: int, plc):
+        interval = self.interval
+        due = time.monotonic() + interval
+        pending = self._pending
+        wake = self._wake
+
+        def checkpoint(snapshot):
+            # Runs on the scan thread between two scans: copy the state, no I/O
+            nonlocal due
+            now = time.monotonic()
+            if now < due:
+                return
+            due = now + interval
+            pending[plc_id] = (snapshot.scan_count, snapshot.timestamp, plc.capture_state())
+            wake.set()
+
+        return checkpoint
+
+    def start(self):
+        """Start the writer thread"""
+        if self._thread is not None:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="plc-checkpoints", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while self._running:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self._flush()
+
+    def _flush(self):
+        pending = self._pending
+        for plc_id in list(pending):
+            scan, stamp, parts = pending.pop(plc_id)
+            try:
+                self.files[plc_id].write(scan, stamp, parts)
+            except Exception as e:
+                logger.error(f"Error checkpointing PLC {plc_id}: {e}")
+
+    def close(self):
+        """Write a final checkpoint of every PLC, once their scans stopped"""
+        self._running = False
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10.0)
+            self._thread = None
+        self._flush()
+        for plc_id, plc in self.plcs.items():
+            if not plc.running:
+                try:
+                    self.files[plc_id].write(plc.scan_count, time.time(), plc.capture_state())
+                except Exception as e:
+                    logger.error(f"Error checkpointing PLC {plc_id}: {e}")
+            self.files[plc_id].close()
+        self.files = {}
+        self.plcs = {}
@@ -0,0 +1,216 @@
+import json
+import logging
+import pathlib
+import time
+
+from pymodbus.datastore import ModbusServerContext
+
+from plc_scada_lab.backend.ladder import DEFAULT_PROGRAM, PROGRAMS, LadderProgram
+from plc_scada_lab.backend.modbus_core import MODBUS_PORT, PLCSimulator, PLCSlaveContext
+from plc_scada_lab.backend.process import DEFAULT_PROCESS, PROCESSES, ProcessModel
+from plc_scada_lab.backend.scheduler import ScanScheduler
+
+logger = logging.getLogger(__name__)
+
+MAX_UNIT_ID = 247  # Highest Modbus unit identifier
+
+class PLCFleet:
+    """A plant of independent PLCs driven by one shared scan scheduler
+
+    Every PLC has its own image, program memory and scan rate, and is
+    reachable over Modbus TCP by unit ID on its port. PLCs sharing a port
+    are served by one TCP server.
+
+    Config format::
+
+        {"plcs": [
+            {"id": 1, "unit_id": 1, "port": 1502, "size": 64,
+             "program": "default.json", "process": "default.json",
+             "scan_time": 0.1, "time_scale": 1.0},
+            ...
+        ]}
+
+    Every key but `id` is optional. Programs are looked up relative to the
+    `programs/` directory and compiled once per file, process models
+    relative to `processes/` and parsed once per file.
+    """
+
+    def __init__(self, base_port: int = MODBUS_PORT):
+        self.base_port = base_port
+        self.plcs = {}         # plc id -> PLCSimulator
+        self.addresses = {}    # plc id -> (port, unit id)
+        self.scheduler = ScanScheduler("plc-fleet")
+        self._programs = {}
+        self._processes = {}
+
+    @classmethod
+    def from_config(cls, config, base_port: int = MODBUS_PORT) -> "PLCFleet":
+        """Build a fleet from a config dict or the path of a JSON config file"""
+        fleet = cls(base_port)
+        fleet.configure(config)
+        return fleet
+
+    @classmethod
+    def uniform(cls, count: int, base_port: int = MODBUS_PORT, **options) -> "PLCFleet":
+        """Fleet of `count` identical PLCs numbered from 1"""
+        fleet = cls(base_port)
+        fleet.add_uniform(count, **options)
+        return fleet
+
+    def configure(self, config):
+        """Add the PLCs of a config dict or JSON config file"""
+        if not isinstance(config, dict):
+            with open(config, encoding="utf-8") as f:
+                config = json.load(f)
+        for entry in config.get("plcs", []):
+            entry = dict(entry)
+            self.add(entry.pop("id"), **entry)
+
+    def add_uniform(self, count: int, **options):
+        """Add `count` identical PLCs numbered from 1"""
+        for plc_id in range(1, count + 1):
+            self.add(plc_id, **options)
+
+    def _program(self, program) -> LadderProgram:
+        """Compiled program for a file name, compiled once per fleet"""
+        if isinstance(program, LadderProgram):
+            return program
+        program = program or DEFAULT_PROGRAM.name
+        if program not in self._programs:
+            self._programs[program] = LadderProgram.load(PROGRAMS / program)
+        return self._programs[program]
+
+    def _process(self, process) -> ProcessModel:
+        """Process model for a file name, parsed once per fleet"""
+        if isinstance(process, ProcessModel):
+            return process
+        process = process or DEFAULT_PROCESS.name
+        if process not in self._processes:
+            self._processes[process] = ProcessModel.load(PROCESSES / process)
+        return self._processes[process]
+
+    def _address(self, plc_id: int, unit_id: int = None, port: int = None) -> tuple:
+        """Validated (port, unit id), by default packing 247 PLCs per port"""
+        if plc_id in self.plcs:
+            raise ValueError(f"Duplicate PLC id {plc_id}")
+        if unit_id is None:
+            unit_id = (plc_id - 1) % MAX_UNIT_ID + 1
+        if port is None:
+            port = self.base_port + (plc_id - 1) // MAX_UNIT_ID
+        if not 1 <= unit_id <= MAX_UNIT_ID:
+            raise ValueError(f"Unit id {unit_id} outside 1..{MAX_UNIT_ID}")
+        if (port, unit_id) in self.addresses.values():
+            raise ValueError(f"Unit id {unit_id} already used on port {port}")
+        return port, unit_id
+
+    def add(self, plc_id: int, unit_id: int = None, port: int = None, size: int = 64,
+            program=None, scan_time: float = 0.1, process=None,
+            time_scale: float = 1.0) -> PLCSimulator:
+        """Create a PLC; unit ID and port default to packing 247 PLCs per port"""
+        plc_id = int(plc_id)
+        port, unit_id = self._address(plc_id, unit_id, port)
+        plc = PLCSimulator(size, self._program(program), self._process(process))
+        plc.configure_scan(scan_time, time_scale=time_scale)
+        self.plcs[plc_id] = plc
+        self.addresses[plc_id] = (port, unit_id)
+        if self.scheduler.running:
+            plc.start_simulation(self.scheduler)
+        return plc
+
+    def add_device(self, plc_id: int, device):
+        """Add a polled external device (see `poller.PolledDevice`)
+
+        It takes part in state, streaming, history and alarms like a PLC,
+        but has no Modbus address of its own here.
+        """
+        plc_id = int(plc_id)
+        if plc_id in self.plcs:
+            raise ValueError(f"Duplicate PLC id {plc_id}")
+        self.plcs[plc_id] = device
+        if self.scheduler.running:
+            device.start_simulation(self.scheduler)
+        return device
+
+    @property
+    def default_id(self) -> int:
+        """The lowest PLC id, used when a request names no PLC"""
+        return min(self.plcs) if self.plcs else None
+
+    @property
+    def default(self) -> PLCSimulator:
+        return self.plcs.get(self.default_id)
+
+    def resolve(self, plc_id: int = None) -> int:
+        """Normalize a requested PLC id, raises KeyError for unknown ids"""
+        if plc_id is None:
+            return self.default_id
+        plc_id = int(plc_id)
+        if plc_id not in self.plcs:
+            raise KeyError(f"Unknown PLC: {plc_id}")
+        return plc_id
+
+    def get(self, plc_id: int = None) -> PLCSimulator:
+        """Look up a PLC, the default one if `plc_id` is None"""
+        return self.plcs[self.resolve(plc_id)]
+
+    def start(self):
+        """Start every PLC on the shared scheduler thread"""
+        self.scheduler.start()
+        for plc in self.plcs.values():
+            plc.start_simulation(self.scheduler)
+        logger.info(f"PLC fleet of {len(self.plcs)} started")
+
+    def stop(self):
+        for plc in self.plcs.values():
+            plc.stop_simulation()
+        self.scheduler.stop()
+        self.scheduler.join(timeout=5.0)
+        for plc in self.plcs.values():
+            plc.stop_journal()
+
+    def start_journals(self, directory, checkpoint_interval: int = None) -> dict:
+        """Journal every PLC into a new file in `directory`, returns id -> path"""
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        paths = {}
+        for plc_id, plc in sorted(self.plcs.items()):
+            paths[plc_id] = pathlib.Path(directory) / f"plc-{plc_id}-{stamp}.journal"
+            plc.start_journal(paths[plc_id], checkpoint_interval)
+        return paths
+
+    def server_contexts(self) -> dict:
+        """Modbus server context per TCP port, addressing PLCs by unit ID
+
+        A PLC alone on its port answers every unit ID, like a plain device.
+        """
+        slaves = {}
+        for plc_id, (port, unit_id) in self.addresses.items():
+            slaves.setdefault(port, {})[unit_id] = PLCSlaveContext(self.plcs[plc_id])
+        contexts = {}
+        for port, units in slaves.items():
+            if len(units) == 1:
+                contexts[port] = ModbusServerContext(slaves=next(iter(units.values())), single=True)
+            else:
+                contexts[port] = ModbusServerContext(slaves=units, single=False)
+        return contexts
+
+    def describe(self) -> list:
+        """Summary of every PLC for the API"""
+        result = []
+        for plc_id, plc in sorted(self.plcs.items()):
+            port, unit_id = self.addresses.get(plc_id, (None, None))
+            entry = {
+                "id": plc_id,
+                "unit_id": unit_id,
+                "port": port,
+                "program": plc.program.name if plc.program is not None else None,
+                "process": plc.process.name if plc.process is not None else None,
+                "size": plc.snapshot.image.size,
+                "scan_time": plc.scan_time,
+                "fast_forward": plc.fast_forward,
+                "time_scale": plc.time_scale,
+                "scans": plc.scan_count,
+            }
+            if hasattr(plc, "endpoint"):
+                entry["device"] = plc.describe()
+            result.append(entry)
+        return result
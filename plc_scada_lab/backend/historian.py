@@ -0,0 +1,509 @@
+import asyncio
+import collections
+import json
+import logging
+import pathlib
+import queue
+import shutil
+import threading
+import time
+
+import numpy as np
+
+from plc_scada_lab.backend.image import TABLES
+from plc_scada_lab.backend.ladder import IMAGE_AREAS
+
+logger = logging.getLogger(__name__)
+
+RING_EVENTS = 1 << 18       # In-memory events per PLC before spilling a segment
+RING_KEYFRAMES = 8          # ... but at least room for this many full images
+SEGMENT_SECONDS = 3600.0    # Spill at least this often
+RETENTION = 8 * 86400.0     # Segments older than this are deleted
+ROLLUPS = (1.0, 60.0)       # Pre-aggregated resolutions stored with each segment (s)
+MAX_BUCKETS = 10000
+POLL_INTERVAL = 0.1         # Sampling period for PLCs without scan observers
+
+def point_id(table: str, address: int) -> int:
+    """Point number used in storage: table index in the high 16 bits"""
+    return TABLES.index(table) << 16 | address
+
+def parse_tag(tag: str, size: int) -> int:
+    """Point number of a tag such as `hr:0` or `co:3`, ValueError if invalid"""
+    area, _, address = tag.partition(":")
+    if area not in IMAGE_AREAS or not address.isdigit():
+        raise ValueError(f"Invalid tag '{tag}', expected e.g. hr:0 or co:3")
+    if int(address) >= size:
+        raise ValueError(f"Tag '{tag}' outside image of {size} points")
+    return point_id(IMAGE_AREAS[area], int(address))
+
+def aggregate(ts, values, until: float, edges):
+    """Per-bucket min, max, integral and covered seconds of a held series
+
+    Each value holds from its timestamp until the next one, the last one
+    until `until`. Buckets are `[edges[i], edges[i + 1])`; buckets without
+    data get NaN min/max and zero coverage. Fully vectorized.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    lo = np.clip(edges[:-1], ts[0], until)
+    hi = np.clip(edges[1:], ts[0], until)
+    covered = hi - lo
+
+    # Integral of the step function through cumulative area at each change
+    cumulative = np.concatenate(([0.0], np.cumsum(values * np.diff(np.append(ts, until)))))
+    k_lo = np.searchsorted(ts, lo, "right") - 1
+    k_hi = np.searchsorted(ts, hi, "right") - 1
+    integral = (cumulative[k_hi] + values[k_hi] * (hi - ts[k_hi])) - \
+               (cumulative[k_lo] + values[k_lo] * (lo - ts[k_lo]))
+
+    # Extremes: the value held into the bucket, and every change inside it
+    mins = values[k_lo].copy()
+    maxs = mins.copy()
+    first = k_lo + 1
+    last = np.searchsorted(ts, hi, "left")
+    inner = last > first
+    if inner.any():
+        # Interleaved [first, last) pairs; only the even reductions are used
+        index = np.empty(2 * int(inner.sum()), dtype=np.intp)
+        index[0::2] = first[inner]
+        index[1::2] = last[inner]
+        padded = np.append(values, 0.0)
+        mins[inner] = np.minimum(mins[inner], np.minimum.reduceat(padded, index)[0::2])
+        maxs[inner] = np.maximum(maxs[inner], np.maximum.reduceat(padded, index)[0::2])
+
+    empty = covered <= 0
+    mins[empty] = np.nan
+    maxs[empty] = np.nan
+    integral[empty] = 0.0
+    return mins, maxs, integral, np.maximum(covered, 0.0)
+
+class Chunk:
+    """A closed run of recorded events, in recording order"""
+
+    def __init__(self, start: float, end: float, ts, point, value):
+        self.start = start
+        self.end = end
+        self.ts = ts
+        self.point = point
+        self.value = value
+
+    def series(self, point: int):
+        """Timestamps and values of one point"""
+        mask = self.point == point
+        return self.ts[mask], self.value[mask]
+
+class Segment:
+    """Events of one PLC over a time span, on disk sorted by (point, time)
+
+    Columns are `.npy` files opened memory-mapped, so a query touches only
+    the pages of the points and time range it reads. Each segment also
+    stores per-point rollups (min, max, integral, covered seconds per
+    bucket) for every resolution in ROLLUPS.
+    """
+
+    def __init__(self, path: pathlib.Path):
+        self.path = path
+        meta = json.loads((path / "meta.json").read_text())
+        self.start = meta["start"]
+        self.end = meta["end"]
+        self.rollups = tuple(meta["rollups"])
+        self._columns = {}
+
+    def column(self, name: str) -> np.ndarray:
+        array = self._columns.get(name)
+        if array is None:
+            # Plain ndarray view of the mapping: same pages, no memmap overhead
+            array = np.asarray(np.load(self.path / f"{name}.npy", mmap_mode="r"))
+            self._columns[name] = array
+        return array
+
+    def _slice(self, point: int, prefix: str = ""):
+        points = self.column("points")
+        i = int(np.searchsorted(points, point))
+        if i == len(points) or points[i] != point:
+            return None
+        offsets = self.column(prefix + "offsets")
+        return slice(int(offsets[i]), int(offsets[i + 1]))
+
+    def series(self, point: int, start: float, end: float):
+        """Events of one point from the value held at `start` up to `end`"""
+        rows = self._slice(point)
+        if rows is None:
+            return None, None
+        ts = self.column("ts")[rows]
+        lo = max(int(np.searchsorted(ts, start, "right")) - 1, 0)
+        hi = int(np.searchsorted(ts, end, "left"))
+        return np.asarray(ts[lo:hi]), np.asarray(self.column("value")[rows][lo:hi])
+
+    def rollup(self, points, resolution: float):
+        """Rollup rows of several points: (point index, bucket start, min,
+        max, integral, covered), grouped by point in request order"""
+        prefix = f"r{resolution:g}_"
+        stored = self.column("points")
+        position = np.minimum(np.searchsorted(stored, points), len(stored) - 1)
+        present = np.flatnonzero(stored[position] == points)
+        if not len(present):
+            return None
+        offsets = self.column(prefix + "offsets")
+        starts = np.asarray(offsets[position[present]])
+        lengths = np.asarray(offsets[position[present] + 1]) - starts
+        # Row numbers of every point's slice, concatenated without a loop
+        index = np.arange(int(lengths.sum())) + np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+        return (np.repeat(present, lengths),) + tuple(
+            self.column(prefix + name)[index] for name in ("t", "min", "max", "integral", "covered"))
+
+    @classmethod
+    def write(cls, directory: pathlib.Path, chunk: Chunk) -> "Segment":
+        """Sort a chunk by (point, time), compute rollups and save it atomically"""
+        order = np.lexsort((chunk.ts, chunk.point))
+        ts, point, value = chunk.ts[order], chunk.point[order], chunk.value[order]
+        points, starts = np.unique(point, return_index=True)
+        offsets = np.append(starts, len(point))
+        columns = {"points": points, "offsets": offsets, "ts": ts, "value": value}
+
+        for resolution in ROLLUPS:
+            prefix = f"r{resolution:g}_"
+            edges = np.arange(np.floor(chunk.start / resolution) * resolution,
+                              chunk.end + resolution, resolution)
+            parts = {name: [] for name in ("t", "min", "max", "integral", "covered")}
+            counts = [0]
+            for i in range(len(points)):
+                rows = slice(offsets[i], offsets[i + 1])
+                mins, maxs, integral, covered = aggregate(ts[rows], value[rows], chunk.end, edges)
+                keep = covered > 0
+                for name, data in (("t", edges[:-1]), ("min", mins), ("max", maxs),
+                                   ("integral", integral), ("covered", covered)):
+                    parts[name].append(data[keep])
+                counts.append(int(keep.sum()))
+            columns[prefix + "offsets"] = np.cumsum(counts)
+            for name, data in parts.items():
+                columns[prefix + name] = np.concatenate(data) if data else np.empty(0)
+
+        path = directory / f"seg-{int(chunk.start * 1000)}-{int(chunk.end * 1000)}"
+        staging = path.with_suffix(".tmp")
+        staging.mkdir(parents=True, exist_ok=True)
+        for name, data in columns.items():
+            np.save(staging / f"{name}.npy", data)
+        (staging / "meta.json").write_text(json.dumps(
+            {"start": chunk.start, "end": chunk.end, "rollups": list(ROLLUPS)}))
+        staging.rename(path)
+        return cls(path)
+
+class Recorder:
+    """Records every value change of one PLC into columnar ring buffers
+
+    `record` is called with each published scan snapshot (on the scan
+    thread for in-process PLCs), compares the image with the previous one
+    and appends `(ts, point, value)` for every changed point. The first
+    events of every chunk are a keyframe of all points, so each chunk and
+    segment can be read without its predecessors.
+    """
+
+    def __init__(self, historian: "Historian", plc_id: int, size: int):
+        self.historian = historian
+        self.plc_id = plc_id
+        self.size = size
+        self.points = np.concatenate([
+            (index << 16) + np.arange(size, dtype=np.uint32) for index in range(len(TABLES))
+        ]).astype(np.uint32)
+        self.segments = []
+        self.pending = collections.deque()  # Chunks waiting for the writer thread
+        self._lock = threading.Lock()
+        self._last = None
+        self._last_ts = None
+        self._last_scan = None
+        self._new_ring(None)
+
+    def _new_ring(self, start: float):
+        # A keyframe alone is one event per point, so large images need a larger ring
+        capacity = max(self.historian.ring_events, RING_KEYFRAMES * len(self.points))
+        self.ts = np.empty(capacity, dtype=np.float64)
+        self.point = np.empty(capacity, dtype=np.uint32)
+        self.value = np.empty(capacity, dtype=np.uint16)
+        self.count = 0
+        self.start = start
+
+    def _append(self, ts: float, points, values):
+        n = self.count
+        k = len(points)
+        self.ts[n:n + k] = ts
+        self.point[n:n + k] = points
+        self.value[n:n + k] = values
+        self.count = n + k
+
+    def record(self, snapshot):
+        """Record the changes of one scan snapshot"""
+        if snapshot is None or snapshot.scan_count == self._last_scan:
+            return
+        image = snapshot.image
+        values = np.concatenate([image.table(table) for table in TABLES]).astype(np.uint16)
+        ts = snapshot.timestamp
+        with self._lock:
+            if self._last is None:
+                self.start = ts
+                self._append(ts, self.points, values)
+            else:
+                changed = np.flatnonzero(values != self._last)
+                if self.count + len(changed) > len(self.ts) or \
+                        ts - self.start >= self.historian.segment_seconds:
+                    self._close_chunk(ts)
+                    self._append(ts, self.points, values)  # Keyframe of the new chunk
+                elif len(changed):
+                    self._append(ts, self.points[changed], values[changed])
+            self._last = values
+            self._last_ts = ts
+            self._last_scan = snapshot.scan_count
+
+    def _close_chunk(self, end: float):
+        n = self.count
+        chunk = Chunk(self.start, end, self.ts[:n], self.point[:n], self.value[:n])
+        self._new_ring(end)
+        if self.historian.directory is not None:
+            self.pending.append(chunk)
+            self.historian.spill(self, chunk)
+
+    def flush(self):
+        """Close the current chunk so it gets written to disk"""
+        with self._lock:
+            if self._last is not None and self.count:
+                self._close_chunk(self._last_ts)
+                self._append(self._last_ts, self.points, self._last)
+
+    def _sources(self, start: float, end: float):
+        """Chunks and segments overlapping a time range, oldest first"""
+        with self._lock:
+            # Recorded events are never overwritten (appends go past `count`,
+            # a full ring is replaced), so views suffice and nothing is copied
+            # while `record` waits on the scan thread
+            n = self.count
+            live = Chunk(self.start, self._last_ts, self.ts[:n], self.point[:n],
+                         self.value[:n]) if n else None
+            pending = list(self.pending)
+            segments = list(self.segments)
+        if live is not None:
+            # Events up to `start` still give the values held into the range
+            hi = int(np.searchsorted(live.ts, end, "left"))
+            live.ts, live.point, live.value = live.ts[:hi], live.point[:hi], live.value[:hi]
+        sources = [s for s in segments if s.end > start and s.start < end]
+        sources += [c for c in pending if c.end > start and c.start < end]
+        if live is not None and live.end >= start and live.start < end:
+            sources.append(live)
+        return sources
+
+    def query(self, points: list, start: float, end: float, step: float) -> dict:
+        """Downsampled min/max/avg of points, as (points x buckets) arrays
+
+        Segments are answered from their largest rollup not coarser than
+        `step`, all points at once; raw events (short steps and data not yet
+        on disk) are aggregated per point.
+        """
+        resolution = max((r for r in ROLLUPS if r <= step), default=None)
+        if resolution is not None:
+            # Align buckets to the rollup grid so stored buckets never straddle
+            start = np.floor(start / resolution) * resolution
+            step = max(round(step / resolution), 1) * resolution
+        count = int(np.ceil((end - start) / step))
+        if count > MAX_BUCKETS:
+            raise ValueError(f"Query would return more than {MAX_BUCKETS} buckets")
+        edges = start + np.arange(count + 1) * step
+        points = np.asarray(points, dtype=np.uint32)
+
+        shape = (len(points), count)
+        mins = np.full(shape, np.nan)
+        maxs = np.full(shape, np.nan)
+        integral = np.zeros(shape)
+        covered = np.zeros(shape)
+        for source in self._sources(start, edges[-1]):
+            if isinstance(source, Segment) and resolution in source.rollups:
+                self._add_rollup(source.rollup(points, resolution), start, step,
+                                 mins, maxs, integral, covered)
+                continue
+            for row, point in enumerate(points):
+                if isinstance(source, Segment):
+                    ts, values = source.series(point, start, edges[-1])
+                else:
+                    ts, values = source.series(point)
+                if ts is None or not len(ts):
+                    continue
+                part = aggregate(ts, values, source.end, edges)
+                np.fmin(mins[row], part[0], out=mins[row])
+                np.fmax(maxs[row], part[1], out=maxs[row])
+                integral[row] += part[2]
+                covered[row] += part[3]
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            avg = np.where(covered > 0, integral / covered, np.nan)
+        return {
+            "start": float(start),
+            "step": float(step),
+            "resolution": resolution or "raw",
+            "t": edges[:-1],
+            "min": mins,
+            "max": maxs,
+            "avg": avg,
+        }
+
+    @staticmethod
+    def _add_rollup(rollup, start, step, mins, maxs, integral, covered):
+        """Fold rollup rows of several points into the (point, bucket) arrays"""
+        if rollup is None:
+            return
+        rows, t, row_min, row_max, row_integral, row_covered = rollup
+        count = mins.shape[1]
+        bucket = np.floor((t - start) / step).astype(np.int64)
+        valid = (bucket >= 0) & (bucket < count)
+        if not valid.any():
+            return
+        # Rows are ordered by point, then time, so keys never decrease
+        key = rows[valid] * count + bucket[valid]
+        runs = np.flatnonzero(np.diff(key, prepend=-1))
+        cells = key[runs]
+        flat = (mins.reshape(-1), maxs.reshape(-1), integral.reshape(-1), covered.reshape(-1))
+        flat[0][cells] = np.fmin(flat[0][cells], np.fmin.reduceat(row_min[valid], runs))
+        flat[1][cells] = np.fmax(flat[1][cells], np.fmax.reduceat(row_max[valid], runs))
+        flat[2][cells] += np.add.reduceat(row_integral[valid], runs)
+        flat[3][cells] += np.add.reduceat(row_covered[valid], runs)
+
+def _nullable(values: np.ndarray) -> list:
+    """JSON-ready list with NaN as None"""
+    result = np.round(values, 3).astype(object)
+    result[np.isnan(values)] = None
+    return result.tolist()
+
+class Historian:
+    """Embedded time-series historian for the image tables of a PLC fleet
+
+    Every value change is kept in an in-memory ring per PLC. Full or aged
+    rings are handed to a writer thread that stores them as memory-mapped
+    segment files under `directory` (one subdirectory per PLC), which are
+    reloaded on restart and deleted after `retention` seconds. Without a
+    directory only the in-memory ring is kept.
+    """
+
+    def __init__(self, directory=None, ring_events: int = RING_EVENTS,
+                 segment_seconds: float = SEGMENT_SECONDS, retention: float = RETENTION):
+        self.directory = pathlib.Path(directory) if directory else None
+        self.ring_events = ring_events
+        self.segment_seconds = segment_seconds
+        self.retention = retention
+        self.recorders = {}  # plc id -> Recorder
+        self._polled = []
+        self._writes = queue.Queue()
+        self._writer = None
+        if self.directory is not None:
+            self._writer = threading.Thread(target=self._write_loop, name="historian-writer",
+                                            daemon=True)
+            self._writer.start()
+
+    def attach(self, plc_id: int, plc) -> Recorder:
+        """Start recording a PLC
+
+        In-process PLCs are recorded from their scan observer, every scan;
+        others (e.g. sharded PLCs) are sampled by `run` every POLL_INTERVAL.
+        """
+        recorder = Recorder(self, plc_id, plc.snapshot.image.size)
+        if self.directory is not None:
+            recorder.segments = self._load_segments(plc_id)
+        self.recorders[plc_id] = recorder
+        observers = getattr(plc, "observers", None)
+        if observers is not None:
+            observers.append(recorder.record)
+        else:
+            self._polled.append((recorder, plc))
+        return recorder
+
+    def _plc_directory(self, plc_id: int) -> pathlib.Path:
+        return self.directory / f"plc-{plc_id}"
+
+    def _load_segments(self, plc_id: int) -> list:
+        directory = self._plc_directory(plc_id)
+        if not directory.exists():
+            return []
+        segments = []
+        for path in sorted(directory.glob("seg-*")):
+            if path.suffix == ".tmp":
+                shutil.rmtree(path, ignore_errors=True)  # Interrupted write
+                continue
+            try:
+                segments.append(Segment(path))
+            except Exception as e:
+                logger.error(f"Skipping unreadable history segment {path}: {e}")
+        return sorted(segments, key=lambda s: s.start)
+
+    def spill(self, recorder: Recorder, chunk: Chunk):
+        self._writes.put((recorder, chunk))
+
+    def _write_loop(self):
+        while True:
+            item = self._writes.get()
+            if item is None:
+                break
+            recorder, chunk = item
+            segment = None
+            try:
+                segment = Segment.write(self._plc_directory(recorder.plc_id), chunk)
+            except Exception as e:
+                logger.error(f"Failed to write history segment: {e}")
+            # Swap chunk for segment at once so queries never see both
+            with recorder._lock:
+                if segment is not None:
+                    recorder.segments.append(segment)
+                recorder.pending.popleft()
+            self._expire(recorder)
+
+    def _expire(self, recorder: Recorder):
+        cutoff = time.time() - self.retention
+        expired = []
+        with recorder._lock:
+            while recorder.segments and recorder.segments[0].end < cutoff:
+                expired.append(recorder.segments.pop(0))
+        for segment in expired:
+            shutil.rmtree(segment.path, ignore_errors=True)
+
+    def query(self, plc_id: int, tags: list, start: float = None, end: float = None,
+              step: float = None, points: int = 500) -> dict:
+        """Downsampled series for tags of one PLC
+
+        `start`/`end` are Unix timestamps (default: the last hour), `step`
+        the bucket width in seconds (default: `points` buckets).
+        """
+        recorder = self.recorders[plc_id]
+        end = time.time() if end is None else float(end)
+        start = end - 3600.0 if start is None else float(start)
+        if end <= start:
+            raise ValueError("end must be after start")
+        step = (end - start) / max(int(points), 1) if step is None else float(step)
+        if step <= 0:
+            raise ValueError("step must be positive")
+        result = recorder.query([parse_tag(tag, recorder.size) for tag in tags], start, end, step)
+        return {
+            "plc": plc_id,
+            "start": result["start"],
+            "end": end,
+            "step": result["step"],
+            "resolution": result["resolution"],
+            "t": result["t"].tolist(),
+            "series": {tag: {"min": _nullable(result["min"][i]),
+                             "max": _nullable(result["max"][i]),
+                             "avg": _nullable(result["avg"][i])}
+                       for i, tag in enumerate(tags)},
+        }
+
+    async def run(self):
+        """Sample PLCs that have no scan observers"""
+        while True:
+            for recorder, plc in self._polled:
+                try:
+                    recorder.record(plc.snapshot)
+                except Exception as e:
+                    logger.error(f"Error recording PLC {recorder.plc_id}: {e}")
+            await asyncio.sleep(POLL_INTERVAL)
+
+    def close(self):
+        """Write everything recorded so far to disk and stop the writer"""
+        if self._writer is None:
+            return
+        for recorder in self.recorders.values():
+            recorder.flush()
+        self._writes.put(None)
+        self._writer.join(timeout=30.0)
+        self._writer = None
@@ -0,0 +1,93 @@
+import gzip
+import hashlib
+
+from starlette.responses import Response
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MIN_COMPRESS_SIZE = 512  # Smaller bodies are sent as they are
+PREFERRED_ENCODINGS = ("br", "gzip")
+ETAG_SUFFIXES = {"br": "-br", "gzip": "-gz"}  # Strong ETags differ per content coding
+
+def make_etag(body: bytes) -> str:
+    """Strong ETag derived from the content"""
+    return '"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+
+def compress(body: bytes) -> dict:
+    """Pre-compressed variants of a body by content coding
+
+    Brotli is used when the optional `brotli` package is installed; variants
+    that do not come out smaller than the body are left out.
+    """
+    encoded = {}
+    if len(body) < MIN_COMPRESS_SIZE:
+        return encoded
+    if brotli is not None:
+        encoded["br"] = brotli.compress(body, quality=11)
+    encoded["gzip"] = gzip.compress(body, compresslevel=9, mtime=0)
+    return {coding: data for coding, data in encoded.items() if len(data) < len(body)}
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """Whether an If-None-Match header names `etag` (weak comparison)"""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+def accepted_encodings(accept_encoding: str) -> set:
+    """Content codings an Accept-Encoding header allows (q > 0)"""
+    accepted = set()
+    for item in (accept_encoding or "").split(","):
+        coding, _, params = item.strip().partition(";")
+        params = params.strip().replace(" ", "")
+        if coding and params not in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            accepted.add(coding.strip().lower())
+    return accepted
+
+class CachedBody:
+    """A response body prepared once: its ETag and pre-compressed variants
+
+    `response()` answers conditional requests with 304 and picks the best
+    encoding the client accepts, so serving it costs no disk access, hashing
+    or compression. Every content coding gets its own ETag (the identity
+    one plus a -gz/-br suffix), as a strong validator must differ between
+    them.
+    """
+
+    def __init__(self, body: bytes, media_type: str, cache_control: str = "no-cache"):
+        self.body = body
+        self.media_type = media_type
+        self.cache_control = cache_control
+        self.etag = make_etag(body)
+        self.encoded = compress(body)
+        self.etags = {None: self.etag}  # content coding -> ETag
+        for coding in self.encoded:
+            self.etags[coding] = self.etag[:-1] + ETAG_SUFFIXES[coding] + '"'
+
+    def encoding_for(self, accept_encoding: str) -> str:
+        """Best available content coding for an Accept-Encoding header, or None"""
+        accepted = accepted_encodings(accept_encoding)
+        for coding in PREFERRED_ENCODINGS:
+            if coding in self.encoded and (coding in accepted or "*" in accepted):
+                return coding
+        return None
+
+    def response(self, request) -> Response:
+        coding = self.encoding_for(request.headers.get("accept-encoding"))
+        headers = {
+            "ETag": self.etags[coding],
+            "Cache-Control": self.cache_control,
+            "Vary": "Accept-Encoding",
+        }
+        if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+            return Response(status_code=304, headers=headers)
+        if coding is None:
+            return Response(self.body, media_type=self.media_type, headers=headers)
+        headers["Content-Encoding"] = coding
+        return Response(self.encoded[coding], media_type=self.media_type, headers=headers)
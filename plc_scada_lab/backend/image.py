@@ -0,0 +1,95 @@
+import numpy as np
+
+# Table names, in buffer order. These are also the names used by the API.
+TABLES = ("coils", "discrete_inputs", "holding_registers", "input_registers")
+BIT_TABLES = ("coils", "discrete_inputs")
+REGISTER_TABLES = ("holding_registers", "input_registers")
+
+# Full Modbus address space per table
+MAX_POINTS = 65536
+
+class ProcessImage:
+    """PLC image tables backed by a single contiguous buffer
+
+    Coils and discrete inputs are `bool` arrays (one byte per point, so the
+    scan can address a bit without shifting and masking), registers are
+    little-endian `uint16` arrays. All four tables are NumPy views into one
+    buffer, so the whole image can be copied, shared or persisted with a
+    single memcpy. Use `packed()` for the bit-packed wire form.
+    """
+
+    def __init__(self, size: int = 64, buffer=None):
+        if not 0 < size <= MAX_POINTS:
+            raise ValueError(f"Image size must be between 1 and {MAX_POINTS}")
+        self.size = size
+        self.nbytes = self.buffer_size(size)
+        if buffer is None:
+            self.buffer = np.zeros(self.nbytes, dtype=np.uint8)
+        else:
+            self.buffer = np.frombuffer(buffer, dtype=np.uint8, count=self.nbytes)
+
+        bits = self._bit_section(size)
+        self.coils = self.buffer[0:size].view(np.bool_)
+        self.discrete_inputs = self.buffer[bits:bits + size].view(np.bool_)
+        offset = 2 * bits
+        self.holding_registers = self.buffer[offset:offset + 2 * size].view("<u2")
+        offset += 2 * size
+        self.input_registers = self.buffer[offset:offset + 2 * size].view("<u2")
+
+        # Scalar access through memoryviews returns plain Python bool/int,
+        # which is much cheaper than indexing a NumPy array element-wise
+        self.cells = {name: memoryview(self.table(name)) for name in TABLES}
+
+    @staticmethod
+    def _bit_section(size: int) -> int:
+        # Keep the register tables 2-byte aligned
+        return size + (size & 1)
+
+    @classmethod
+    def buffer_size(cls, size: int) -> int:
+        """Number of bytes needed for an image of `size` points per table"""
+        return 2 * cls._bit_section(size) + 4 * size
+
+    def table(self, name: str) -> np.ndarray:
+        """Return the live array for a table"""
+        if name not in TABLES:
+            raise KeyError(f"Unknown table: {name}")
+        return getattr(self, name)
+
+    def check_range(self, start: int, count: int):
+        """Raise IndexError unless the range fits inside the image"""
+        if start < 0 or count < 0 or start + count > self.size:
+            raise IndexError(f"Range {start}+{count} outside image of {self.size} points")
+
+    def view(self, name: str, start: int = 0, count: int = None) -> np.ndarray:
+        """Read-only zero-copy view of `count` points starting at `start`"""
+        if count is None:
+            count = self.size - start
+        self.check_range(start, count)
+        view = self.table(name)[start:start + count]
+        view.flags.writeable = False
+        return view
+
+    def coerce(self, name: str, values) -> np.ndarray:
+        """Convert values for a table; register values are clamped to 0..65535"""
+        self.table(name)  # Validates the table name
+        if name in REGISTER_TABLES:
+            return np.clip(np.asarray(values, dtype=np.int64), 0, 65535).astype(np.uint16).ravel()
+        return np.asarray(values, dtype=np.bool_).ravel()
+
+    def write(self, name: str, start: int, values):
+        """Bulk write `values` starting at `start`"""
+        values = self.coerce(name, values)
+        self.check_range(start, values.size)
+        self.table(name)[start:start + values.size] = values
+
+    def packed(self, name: str, start: int = 0, count: int = None) -> bytes:
+        """Bit-packed (LSB first, as on the Modbus wire) copy of a bit table range"""
+        return np.packbits(self.view(name, start, count), bitorder="little").tobytes()
+
+    def copy(self, readonly: bool = False) -> "ProcessImage":
+        """Independent copy of the whole image, optionally immutable"""
+        buffer = self.buffer.copy()
+        if readonly:
+            buffer.flags.writeable = False
+        return ProcessImage(self.size, buffer)
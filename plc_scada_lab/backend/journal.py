@@ -0,0 +1,321 @@
+"""Record and replay of PLC sessions
+
+A journal is an append-only file of everything that enters one PLC from
+outside: every external write, stamped with the scan it was applied at,
+and the seconds of process time per scan whenever that changes. Every
+`CHECKPOINT_INTERVAL` scans it also holds a checkpoint of the complete
+PLC state. Scans are deterministic given their starting state, writes and
+dt, so replaying a journal into a fresh PLCSimulator reproduces every scan
+bit for bit, as fast as the scans run, and seeking to a scan only replays
+from the checkpoint before it.
+
+File layout (little-endian)::
+
+    b"PLCJ", u16 version, u32 length, JSON metadata (image size, program
+    and process model definitions)
+    records: u8 kind, u32 payload length, u64 scan, payload
+
+    WRITES      u16 count, then per write: u8 table, u8 toggle, u32 start,
+                u32 count and the values (a byte per bit, u16 per register)
+                applied together before this scan
+    DT          f64 seconds of process time per scan from this scan on
+    CHECKPOINT  f64 dt, then the state before this scan (image buffer,
+                ladder memory arrays, process model state) as u32 length
+                and bytes each
+    END         written on close, the scan the recording stopped before
+
+Replay a journal from the command line with::
+
+    python -m plc_scada_lab.backend.journal <file> [--seek <scan>] [--until <scan>]
+"""
+import argparse
+import bisect
+import json
+import logging
+import pathlib
+import struct
+import threading
+import time
+
+import numpy as np
+
+from plc_scada_lab.backend.image import BIT_TABLES, TABLES
+from plc_scada_lab.backend.ladder import LadderProgram
+from plc_scada_lab.backend.modbus_core import PLCSimulator
+from plc_scada_lab.backend.process import ProcessModel
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"PLCJ"
+VERSION = 1
+CHECKPOINT_INTERVAL = 1000  # Scans between checkpoints
+BUFFER_SIZE = 1 << 16
+
+WRITES = 1
+DT = 2
+CHECKPOINT = 3
+END = 4
+
+FILE_HEADER = struct.Struct("<4sHI")
+RECORD = struct.Struct("<BIQ")
+WRITE = struct.Struct("<BBII")
+COUNT = struct.Struct("<H")
+LENGTH = struct.Struct("<I")
+SECONDS = struct.Struct("<d")
+TABLE_IDS = {table: i for i, table in enumerate(TABLES)}
+
+def _dtype(table: str):
+    return np.bool_ if table in BIT_TABLES else np.dtype("<u2")
+
+def encode_writes(batch) -> bytes:
+    """Payload of a WRITES record for `(table, start, values)` writes"""
+    parts = [COUNT.pack(len(batch))]
+    for table, start, values in batch:
+        if values is None:
+            parts.append(WRITE.pack(TABLE_IDS[table], 1, start, 1))
+        else:
+            parts.append(WRITE.pack(TABLE_IDS[table], 0, start, values.size))
+            parts.append(values.astype(_dtype(table), copy=False).tobytes())
+    return b"".join(parts)
+
+def decode_writes(payload: bytes) -> tuple:
+    (count,) = COUNT.unpack_from(payload)
+    offset = COUNT.size
+    batch = []
+    for _ in range(count):
+        table_id, toggle, start, size = WRITE.unpack_from(payload, offset)
+        offset += WRITE.size
+        table = TABLES[table_id]
+        if toggle:
+            batch.append((table, start, None))
+            continue
+        dtype = _dtype(table)
+        batch.append((table, start, np.frombuffer(payload, dtype, size, offset)))
+        offset += size * np.dtype(dtype).itemsize
+    return tuple(batch)
+
+class JournalWriter:
+    """Appends the writes and checkpoints of one PLC to a new journal file
+
+    Records are written on the scan thread, from `PLCSimulator.scan_once`;
+    `close()` may be called from any thread.
+    """
+
+    def __init__(self, path, plc: PLCSimulator, checkpoint_interval: int = None):
+        self.path = pathlib.Path(path)
+        self.checkpoint_interval = max(1, int(checkpoint_interval or CHECKPOINT_INTERVAL))
+        self._lock = threading.Lock()
+        self._dt = None
+        self._next_checkpoint = None
+        self._plc = plc
+        meta = json.dumps({
+            "size": plc.image.size,
+            "program": plc.program.definition,
+            "process": plc.process.definition,
+            "started": time.time(),
+            "checkpoint_interval": self.checkpoint_interval,
+        }).encode()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.path, "xb", buffering=BUFFER_SIZE)
+        self._file.write(FILE_HEADER.pack(MAGIC, VERSION, len(meta)) + meta)
+
+    def _record(self, kind: int, scan: int, payload: bytes):
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(RECORD.pack(kind, len(payload), scan))
+            self._file.write(payload)
+            if kind == CHECKPOINT:
+                self._file.flush()
+
+    def begin_scan(self, plc: PLCSimulator, dt: float):
+        """Called before every scan: checkpoints when due and records dt changes"""
+        scan = plc.scan_count
+        if self._next_checkpoint is None or scan >= self._next_checkpoint:
+            parts = [SECONDS.pack(dt)]
+            for data in plc.capture_state():
+                parts.append(LENGTH.pack(len(data)))
+                parts.append(data)
+            self._record(CHECKPOINT, scan, b"".join(parts))
+            self._next_checkpoint = scan + self.checkpoint_interval
+            self._dt = dt
+        elif dt != self._dt:
+            self._record(DT, scan, SECONDS.pack(dt))
+            self._dt = dt
+
+    def record_writes(self, scan: int, batch):
+        """Record writes applied together before `scan`"""
+        self._record(WRITES, scan, encode_writes(batch))
+
+    def close(self):
+        self._record(END, self._plc.scan_count, b"")
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+class Journal:
+    """A journal file, read into memory and indexed by scan"""
+
+    def __init__(self, path):
+        self.path = pathlib.Path(path)
+        data = self.path.read_bytes()
+        if len(data) < FILE_HEADER.size:
+            raise ValueError(f"{self.path} is not a PLC journal")
+        magic, version, length = FILE_HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError(f"{self.path} is not a PLC journal")
+        if version != VERSION:
+            raise ValueError(f"Unsupported journal version {version}")
+        offset = FILE_HEADER.size + length
+        self.meta = json.loads(data[FILE_HEADER.size:offset])
+        self.writes = {}        # scan -> [batch]
+        self.dts = []           # (scan, dt) changes, in order
+        self.checkpoints = []   # scans with a checkpoint, in order
+        self._checkpoints = {}  # scan -> payload
+        self.end = None
+        last = 0
+        while offset < len(data):
+            if offset + RECORD.size > len(data):
+                logger.warning(f"Journal {self.path} ends in a truncated record")
+                break
+            kind, length, scan = RECORD.unpack_from(data, offset)
+            start = offset + RECORD.size
+            if start + length > len(data):
+                logger.warning(f"Journal {self.path} ends in a truncated record")
+                break
+            payload = data[start:start + length]
+            offset = start + length
+            if kind == WRITES:
+                self.writes.setdefault(scan, []).append(decode_writes(payload))
+            elif kind == DT:
+                self.dts.append((scan, SECONDS.unpack(payload)[0]))
+            elif kind == CHECKPOINT:
+                self.checkpoints.append(scan)
+                self._checkpoints[scan] = payload
+                self.dts.append((scan, SECONDS.unpack_from(payload)[0]))
+            elif kind == END:
+                self.end = scan
+            last = max(last, scan)
+        if not self.checkpoints:
+            raise ValueError(f"Journal {self.path} holds no checkpoint")
+        if self.end is None:
+            self.end = last + 1  # Not closed: up to the last scan recorded
+        self._dt_scans = [scan for scan, _ in self.dts]
+
+    @property
+    def start(self) -> int:
+        """First scan of the recording"""
+        return self.checkpoints[0]
+
+    def checkpoint(self, scan: int) -> tuple:
+        """`(dt, state)` of the checkpoint taken before `scan`"""
+        payload = self._checkpoints[scan]
+        (dt,) = SECONDS.unpack_from(payload)
+        offset = SECONDS.size
+        state = []
+        while offset < len(payload):
+            (length,) = LENGTH.unpack_from(payload, offset)
+            offset += LENGTH.size
+            state.append(payload[offset:offset + length])
+            offset += length
+        return dt, state
+
+    def dt_at(self, scan: int) -> float:
+        """Seconds of process time of `scan`"""
+        return self.dts[bisect.bisect_right(self._dt_scans, scan) - 1][1]
+
+class Replay:
+    """A fresh PLCSimulator driven by a journal, scan by scan
+
+    The PLC is never started: scans run back to back on the caller's
+    thread. `plc.snapshot` holds the state after the last replayed scan.
+    """
+
+    def __init__(self, journal):
+        if not isinstance(journal, Journal):
+            journal = Journal(journal)
+        self.journal = journal
+        meta = journal.meta
+        self.plc = PLCSimulator(meta["size"], LadderProgram(meta["program"]),
+                                ProcessModel(meta["process"]))
+        self.plc.profile_interval = self.plc._profile_countdown = 0
+        self.plc.time_scale = 1.0  # The journal holds dt itself
+        self.mismatches = []  # Scans whose replayed state differed from the checkpoint
+        self._restore(journal.start)
+
+    @property
+    def scan(self) -> int:
+        """Next scan to replay"""
+        return self.plc.scan_count
+
+    def _restore(self, checkpoint: int):
+        self.plc.restore_state(checkpoint, self.journal.checkpoint(checkpoint)[1])
+
+    def seek(self, scan: int):
+        """Move to the state before `scan`, from the nearest checkpoint"""
+        journal = self.journal
+        if not journal.start <= scan <= journal.end:
+            raise ValueError(f"Scan {scan} outside the journal ({journal.start}..{journal.end})")
+        checkpoint = journal.checkpoints[bisect.bisect_right(journal.checkpoints, scan) - 1]
+        if not checkpoint <= self.scan <= scan:
+            self._restore(checkpoint)
+        self.run(scan, verify=False)
+
+    def run(self, until: int = None, verify: bool = True) -> int:
+        """Replay scans up to `until` (default: the end), returns how many ran
+
+        With `verify`, the state at every checkpoint passed is compared to
+        the recorded one; scans where they differ go to `mismatches`.
+        """
+        journal = self.journal
+        until = journal.end if until is None else min(until, journal.end)
+        plc = self.plc
+        checkpoints = journal.checkpoints
+        index = bisect.bisect_right(checkpoints, plc.scan_count)
+        next_checkpoint = checkpoints[index] if index < len(checkpoints) else None
+        started = plc.scan_count
+        while plc.scan_count < until:
+            scan = plc.scan_count
+            if scan == next_checkpoint:
+                if verify and plc.capture_state() != journal.checkpoint(scan)[1]:
+                    self.mismatches.append(scan)
+                index += 1
+                next_checkpoint = checkpoints[index] if index < len(checkpoints) else None
+            for batch in journal.writes.get(scan, ()):
+                plc.write_batch(batch)
+            plc.scan_time = journal.dt_at(scan)
+            plc.scan_once()
+        return plc.scan_count - started
+
+def main(args):
+    journal = Journal(args.journal)
+    started = time.perf_counter()
+    replay = Replay(journal)
+    if args.seek is not None:
+        replay.seek(args.seek)
+    seeked = time.perf_counter()
+    scans = replay.run(args.until)
+    elapsed = time.perf_counter() - seeked
+    snapshot = replay.plc.snapshot
+    print(json.dumps({
+        "journal": str(journal.path),
+        "program": replay.plc.program.name,
+        "scans": [journal.start, journal.end],
+        "checkpoints": len(journal.checkpoints),
+        "seek_seconds": round(seeked - started, 3),
+        "replayed_scans": scans,
+        "replay_seconds": round(elapsed, 3),
+        "scans_per_second": round(scans / elapsed) if elapsed > 0 else None,
+        "mismatches": replay.mismatches,
+        "final_scan": snapshot.scan_count,
+        "holding_registers": snapshot.image.holding_registers[:8].tolist(),
+        "coils": snapshot.image.coils[:8].tolist(),
+    }, indent=2))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a PLC journal as fast as possible")
+    parser.add_argument("journal", help="journal file")
+    parser.add_argument("--seek", type=int, help="start replaying at this scan")
+    parser.add_argument("--until", type=int, help="stop before this scan")
+    main(parser.parse_args())
@@ -0,0 +1,456 @@
+"""Ladder logic compiler
+
+Programs are declared as data (JSON) and compiled once into a single Python
+function with one straight-line block per rung. The generated code indexes
+memoryviews of the image tables and PLC memory directly, so a scan costs a
+handful of bytecodes per instruction with no attribute lookups or dispatch.
+
+Program format::
+
+    {
+      "name": "...",
+      "markers": 16, "timers": 4, "counters": 4,
+      "tags": {"motor_running": "m:0"},
+      "rungs": [
+        {"comment": "Seal in", "when": ["di:0", "!di:1"], "do": [{"set": "m:0"}]},
+        ...
+      ]
+    }
+
+Operands are ``<area>:<address>`` with an optional ``.<bit>`` for register
+bits and a leading ``!`` for normally-closed contacts. Areas are ``co``
+(coils), ``di`` (discrete inputs), ``hr``/``ir`` (holding/input registers),
+``m`` (markers), ``t`` (timer done bits) and ``c`` (counter done bits).
+
+Conditions (``when``): a list is a series connection (AND), ``{"any": [...]}``
+is a parallel branch (OR), ``{"cmp": [a, op, b]}`` is a compare block with
+``op`` one of ``> >= < <= == !=`` and ``a``/``b`` operands or constants.
+An empty or missing condition is always true.
+
+Instructions (``do``): ``{"out": x}`` coil, ``{"set": x}``/``{"reset": x}``
+latch/unlatch, ``{"ton": n, "preset_ms": p}``/``{"tof": n, "preset_ms": p}``
+timers, ``{"ctu": n, "preset": p, "reset": contact}`` up counter,
+``{"move": value, "to": x}`` and
+``{"hysteresis": x, "input": a, "setpoint": b, "low": l, "high": h}`` which
+turns `x` on below ``setpoint - low`` and off above ``setpoint + high``.
+"""
+import json
+import pathlib
+import re
+import time
+
+import numpy as np
+
+PROGRAMS = pathlib.Path(__file__).parent.parent / "programs"
+DEFAULT_PROGRAM = PROGRAMS / "default.json"
+
+# Operand area -> name of the memoryview in generated code
+AREAS = {
+    "co": "co",
+    "di": "di",
+    "hr": "hr",
+    "ir": "ir",
+    "m": "m",
+    "t": "td",
+    "c": "cd",
+}
+# Areas backed by the process image, and the table each one maps to
+IMAGE_AREAS = {
+    "co": "coils",
+    "di": "discrete_inputs",
+    "hr": "holding_registers",
+    "ir": "input_registers",
+}
+REGISTER_AREAS = ("hr", "ir")
+COMPARE_OPS = (">", ">=", "<", "<=", "==", "!=")
+
+_OPERAND = re.compile(r"^(!?)(co|di|hr|ir|m|t|c):(\d+)(?:\.(\d+))?$")
+
+class LadderError(ValueError):
+    """Raised for malformed ladder programs"""
+
+class LadderMemory:
+    """Internal PLC memory used by a program: markers, timers and counters"""
+
+    def __init__(self, markers: int = 16, timers: int = 0, counters: int = 0):
+        self.markers = np.zeros(max(markers, 1), dtype=np.bool_)
+        self.timer_acc = np.zeros(max(timers, 1), dtype=np.float64)  # ms
+        self.timer_done = np.zeros(max(timers, 1), dtype=np.bool_)
+        self.counter_acc = np.zeros(max(counters, 1), dtype=np.int32)
+        self.counter_done = np.zeros(max(counters, 1), dtype=np.bool_)
+        self.counter_edge = np.zeros(max(counters, 1), dtype=np.bool_)
+
+    def arrays(self):
+        """Name -> array for every memory area"""
+        return {
+            "markers": self.markers,
+            "timer_acc": self.timer_acc,
+            "timer_done": self.timer_done,
+            "counter_acc": self.counter_acc,
+            "counter_done": self.counter_done,
+            "counter_edge": self.counter_edge,
+        }
+
+class _Operand:
+    def __init__(self, text: str):
+        match = _OPERAND.match(text.strip()) if isinstance(text, str) else None
+        if match is None:
+            raise LadderError(f"Invalid operand: {text!r}")
+        negated, area, address, bit = match.groups()
+        self.negated = bool(negated)
+        self.area = area
+        self.address = int(address)
+        self.bit = int(bit) if bit is not None else None
+        if self.bit is not None and (area not in REGISTER_AREAS or self.bit > 15):
+            raise LadderError(f"Bit addressing needs a register and bit 0-15: {text!r}")
+
+    @property
+    def ref(self) -> str:
+        return f"{AREAS[self.area]}[{self.address}]"
+
+    def read(self) -> str:
+        if self.bit is not None:
+            expr = f"(({self.ref} >> {self.bit}) & 1 == 1)"
+        elif self.area in REGISTER_AREAS:
+            expr = f"({self.ref} != 0)"
+        else:
+            expr = self.ref
+        return f"(not {expr})" if self.negated else expr
+
+    def value(self) -> str:
+        if self.negated or self.bit is not None:
+            raise LadderError("Compare and move operands must be plain addresses")
+        return self.ref
+
+def _value(operand) -> str:
+    """Code for a numeric operand: a constant or a plain address"""
+    if isinstance(operand, bool) or not isinstance(operand, (int, float, str)):
+        raise LadderError(f"Invalid value operand: {operand!r}")
+    if isinstance(operand, (int, float)):
+        return repr(operand)
+    return _Operand(operand).value()
+
+class LadderProgram:
+    """A ladder program compiled into one scan function"""
+
+    def __init__(self, program: dict):
+        self.definition = program
+        self.name = program.get("name", "unnamed")
+        self.rungs = program.get("rungs", [])
+        self.tags = program.get("tags", {})
+        self.markers = int(program.get("markers", 16))
+        self.timers = int(program.get("timers", 0))
+        self.counters = int(program.get("counters", 0))
+        # Highest address used per area, checked against the image at bind time
+        self._extent = {}
+        self._branches = None  # Branch descriptions while generating coverage code
+        self._off_delays = {}  # Off-delay timer -> preset, their accumulators start expired
+        self.source = self._generate()
+        namespace = {}
+        exec(compile(self.source, f"<ladder:{self.name}>", "exec"), namespace)
+        self._factory = namespace["_bind"]
+        self._profiled_factory = None  # Compiled on first use, see bind()
+        self._coverage_factory = None
+        self.branches = None  # Descriptions of the branches coverage records, by index
+        self._tags = {name: self._use(_Operand(op)) for name, op in self.tags.items()}
+
+    def __reduce__(self):
+        # Compiled code does not pickle; recompile from the definition instead
+        return (type(self), (self.definition,))
+
+    @classmethod
+    def load(cls, path=DEFAULT_PROGRAM) -> "LadderProgram":
+        """Load and compile a program from a JSON file"""
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def create_memory(self) -> LadderMemory:
+        """Fresh internal memory sized for this program
+
+        Off-delay timers start expired, so their done bit stays off until
+        their input was on once.
+        """
+        memory = LadderMemory(self.markers, self.timers, self.counters)
+        for n, preset in self._off_delays.items():
+            if n < memory.timer_acc.size:  # Else bind() reports the missing timer
+                memory.timer_acc[n] = preset
+        return memory
+
+    def bind(self, image, memory: LadderMemory, marks: list = None, coverage=None):
+        """Return a `scan(dt)` function operating on `image` and `memory`
+
+        `dt` is the scan period in seconds, used to advance timers. With
+        `marks` (a list of len(rungs) + 1 floats) the function is a profiling
+        variant that stores `time.perf_counter()` before the first rung and
+        after every rung into it. With `coverage` (a uint8 array of
+        `len(coverage_branches())`) it sets the entry of every branch taken
+        instead: each rung condition true and false, each leg of a parallel
+        branch conducting and each way a hysteresis switches.
+        """
+        for area, address in self._extent.items():
+            if area in IMAGE_AREAS:
+                size = image.size
+            else:
+                size = {"m": memory.markers, "t": memory.timer_done,
+                        "c": memory.counter_done}[area].size
+            if address >= size:
+                raise LadderError(f"Address {area}:{address} outside memory of {size}")
+        cells = image.cells
+        factory = self._factory
+        extra = ()
+        if coverage is not None:
+            factory = self._coverage()
+            if len(coverage) != len(self.branches):
+                raise LadderError(f"Coverage needs {len(self.branches)} entries")
+            extra = (memoryview(coverage),)
+        elif marks is not None:
+            if self._profiled_factory is None:
+                namespace = {}
+                exec(compile(self._generate(profile=True), f"<ladder:{self.name}:profile>", "exec"),
+                     namespace)
+                self._profiled_factory = namespace["_bind"]
+            factory = self._profiled_factory
+            extra = (marks, time.perf_counter)
+        return factory(
+            cells["coils"], cells["discrete_inputs"],
+            cells["holding_registers"], cells["input_registers"],
+            memoryview(memory.markers),
+            memoryview(memory.timer_acc), memoryview(memory.timer_done),
+            memoryview(memory.counter_acc), memoryview(memory.counter_done),
+            memoryview(memory.counter_edge),
+            *extra
+        )
+
+    def coverage_branches(self) -> list:
+        """Descriptions of the branches `bind(coverage=...)` records, by index"""
+        self._coverage()
+        return self.branches
+
+    def _coverage(self):
+        if self._coverage_factory is None:
+            namespace = {}
+            exec(compile(self._generate(coverage=True), f"<ladder:{self.name}:coverage>", "exec"),
+                 namespace)
+            self._coverage_factory = namespace["_bind"]
+        return self._coverage_factory
+
+    def tag(self, name: str, image, memory: LadderMemory):
+        """Read a named tag declared in the program, or None if undeclared"""
+        operand = self._tags.get(name)
+        if operand is None:
+            return None
+        return self._read(operand, image, memory)
+
+    def read(self, operand: str, image, memory: LadderMemory):
+        """Value of a tag name or an operand such as ``co:0``, ``!di:2`` or ``hr:3.1``
+
+        Bits and register bits read as bool, registers as int. Raises
+        LadderError for malformed operands, IndexError outside memory.
+        """
+        if operand in self._tags:
+            return self._read(self._tags[operand], image, memory)
+        return self._read(_Operand(operand), image, memory)
+
+    def _read(self, operand: _Operand, image, memory: LadderMemory):
+        if operand.area in IMAGE_AREAS:
+            value = image.cells[IMAGE_AREAS[operand.area]][operand.address]
+        else:
+            value = {"m": memory.markers, "t": memory.timer_done,
+                     "c": memory.counter_done}[operand.area][operand.address]
+        if operand.bit is not None:
+            value = bool((value >> operand.bit) & 1)
+        elif operand.area not in REGISTER_AREAS:
+            value = bool(value)
+        return not value if operand.negated else value
+
+    # -- code generation -------------------------------------------------
+
+    def _use(self, operand: _Operand) -> _Operand:
+        self._extent[operand.area] = max(self._extent.get(operand.area, 0), operand.address)
+        return operand
+
+    def _index(self, area: str, index) -> int:
+        if not isinstance(index, int) or index < 0:
+            raise LadderError(f"Invalid {area} number: {index!r}")
+        self._extent[area] = max(self._extent.get(area, 0), index)
+        return index
+
+    def _condition(self, node) -> str:
+        if node is None:
+            return "True"
+        if isinstance(node, str):
+            return self._use(_Operand(node)).read()
+        if isinstance(node, list):
+            if not node:
+                return "True"
+            parts = [self._condition(n) for n in node]
+            return parts[0] if len(parts) == 1 else "(" + " and ".join(parts) + ")"
+        if isinstance(node, dict) and "any" in node:
+            parts = [self._condition(n) for n in node["any"]]
+            if not parts:
+                raise LadderError("Empty parallel branch")
+            if self._branches is not None:
+                for leg, part in zip(node["any"], parts):
+                    self._legs.append((part, self._branch(f"leg {json.dumps(leg)} conducts")))
+            return parts[0] if len(parts) == 1 else "(" + " or ".join(parts) + ")"
+        if isinstance(node, dict) and "cmp" in node:
+            left, op, right = node["cmp"]
+            if op not in COMPARE_OPS:
+                raise LadderError(f"Invalid compare operator: {op!r}")
+            for operand in (left, right):
+                if isinstance(operand, str):
+                    self._use(_Operand(operand))
+            return f"({_value(left)} {op} {_value(right)})"
+        raise LadderError(f"Invalid condition: {node!r}")
+
+    def _target(self, text) -> _Operand:
+        operand = self._use(_Operand(text))
+        if operand.negated or operand.area in ("t", "c"):
+            raise LadderError(f"Not a writable operand: {text!r}")
+        return operand
+
+    def _write(self, operand: _Operand, value: str) -> str:
+        """Statement storing boolean expression `value` into `operand`"""
+        if operand.bit is not None:
+            mask = 1 << operand.bit
+            return (f"{operand.ref} = ({operand.ref} | {mask}) if {value} "
+                    f"else ({operand.ref} & {0xFFFF ^ mask})")
+        if operand.area in REGISTER_AREAS:
+            return f"{operand.ref} = 1 if {value} else 0"
+        return f"{operand.ref} = {value}"
+
+    @staticmethod
+    def _guarded(enabled: str, lines: list) -> list:
+        """Wrap `lines` in `if enabled:` unless the rung is unconditional"""
+        if enabled == "True":
+            return lines
+        return [f"if {enabled}:"] + ["    " + line for line in lines]
+
+    def _instruction(self, ins: dict, enabled: str) -> list:
+        """Lines for one output instruction; `enabled` is the rung condition"""
+        if "out" in ins:
+            return [self._write(self._target(ins["out"]), enabled)]
+        if "set" in ins:
+            return self._guarded(enabled, [self._write(self._target(ins["set"]), "True")])
+        if "reset" in ins:
+            return self._guarded(enabled, [self._write(self._target(ins["reset"]), "False")])
+        if "ton" in ins or "tof" in ins:
+            on_delay = "ton" in ins
+            n = self._index("t", ins["ton"] if on_delay else ins["tof"])
+            preset = float(ins["preset_ms"])
+            if on_delay:
+                return [
+                    f"if {enabled}:",
+                    f"    ta[{n}] = min(ta[{n}] + dt_ms, {preset!r})",
+                    f"    td[{n}] = ta[{n}] >= {preset!r}",
+                    "else:",
+                    f"    ta[{n}] = 0.0",
+                    f"    td[{n}] = False",
+                ]
+            self._off_delays[n] = preset
+            return [
+                f"if {enabled}:",
+                f"    ta[{n}] = 0.0",
+                f"    td[{n}] = True",
+                "else:",
+                f"    ta[{n}] = min(ta[{n}] + dt_ms, {preset!r})",
+                f"    td[{n}] = ta[{n}] < {preset!r}",
+            ]
+        if "ctu" in ins:
+            n = self._index("c", ins["ctu"])
+            preset = int(ins["preset"])
+            lines = [
+                f"if {enabled} and not ce[{n}]:",
+                f"    ca[{n}] = min(ca[{n}] + 1, 2147483647)",
+                f"ce[{n}] = {enabled}",
+            ]
+            if ins.get("reset") is not None:
+                lines += [f"if {self._condition(ins['reset'])}:", f"    ca[{n}] = 0"]
+            lines.append(f"cd[{n}] = ca[{n}] >= {preset}")
+            return lines
+        if "move" in ins:
+            target = self._target(ins["to"])
+            if target.area not in REGISTER_AREAS or target.bit is not None:
+                raise LadderError("Move needs a register destination")
+            source = ins["move"]
+            if isinstance(source, str):
+                self._use(_Operand(source))
+                value = _value(source)
+            else:
+                value = repr(max(0, min(65535, int(source))))
+            return self._guarded(enabled, [f"{target.ref} = {value}"])
+        if "hysteresis" in ins:
+            target = self._target(ins["hysteresis"])
+            for operand in (ins["input"], ins["setpoint"]):
+                if isinstance(operand, str):
+                    self._use(_Operand(operand))
+            value, setpoint = _value(ins["input"]), _value(ins["setpoint"])
+            low, high = _value(ins.get("low", 0)), _value(ins.get("high", 0))
+            on, off = [self._write(target, "True")], [self._write(target, "False")]
+            if self._branches is not None:
+                name = ins["hysteresis"]
+                on.append(f"_cv[{self._branch(f'{name} switched on')}] = 1")
+                off.append(f"_cv[{self._branch(f'{name} switched off')}] = 1")
+            return self._guarded(enabled, [
+                f"if {value} < {setpoint} - {low}:",
+                *("    " + line for line in on),
+                f"elif {value} > {setpoint} + {high}:",
+                *("    " + line for line in off),
+            ])
+        raise LadderError(f"Unknown instruction: {ins!r}")
+
+    def _branch(self, description: str) -> int:
+        """Index of a new coverage branch of the rung being generated"""
+        self._branches.append(f"rung {self._rung_index}: {description}")
+        return len(self._branches) - 1
+
+    def _rung(self, index: int, rung: dict) -> list:
+        self._rung_index = index
+        self._legs = []
+        condition = self._condition(rung.get("when"))
+        lines = [f"# Rung {index}: {rung.get('comment', '')}".rstrip()]
+        instructions = rung.get("do", [])
+        if isinstance(instructions, dict):
+            instructions = [instructions]
+        # Evaluate the condition once when it is tested more than once
+        single = len(instructions) == 1 and not any(
+            key in instructions[0] for key in ("ton", "tof", "ctu"))
+        covered = self._branches is not None and condition != "True"
+        if self._legs:
+            lines += [f"if {leg}: _cv[{branch}] = 1" for leg, branch in self._legs]
+        if covered:
+            true, false = self._branch("true"), self._branch("false")
+        if condition != "True" and (covered or not single):
+            lines.append(f"x = {condition}")
+            condition = "x"
+        if covered:
+            lines.append(f"_cv[{true} if x else {false}] = 1")
+        self._legs = []
+        for ins in instructions:
+            lines += self._instruction(ins, condition)
+        # Parallel legs of counter reset contacts
+        lines += [f"if {leg}: _cv[{branch}] = 1" for leg, branch in self._legs]
+        return lines
+
+    def _generate(self, profile: bool = False, coverage: bool = False) -> str:
+        self._branches = [] if coverage else None
+        body = []
+        for index, rung in enumerate(self.rungs):
+            if profile:
+                body.append(f"_mk[{index}] = _clock()")
+            body += self._rung(index, rung)
+        if profile:
+            body.append(f"_mk[{len(self.rungs)}] = _clock()")
+        if coverage:
+            self.branches = self._branches
+            self._branches = None
+        lines = [
+            "def _bind(co, di, hr, ir, m, ta, td, ca, cd, ce"
+            + (", _mk, _clock):" if profile else ", _cv):" if coverage else "):"),
+            "    def scan(dt):",
+        ]
+        if "t" in self._extent:
+            lines.append("        dt_ms = dt * 1000.0")
+        lines += ["        " + line for line in body or ["pass"]]
+        lines += ["    return scan", ""]
+        return "\n".join(lines)
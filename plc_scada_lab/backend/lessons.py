@@ -1,10 +1,172 @@
-
+import asyncio
+import json
+import logging
 import pathlib
+import re
+import threading
+
+from markdown_it import MarkdownIt
+
+from plc_scada_lab.backend.http_cache import CachedBody
+from plc_scada_lab.backend.search import SearchIndex
+
+logger = logging.getLogger(__name__)
+
 DOCS = pathlib.Path(__file__).parent.parent / "docs"
+WATCH_INTERVAL = 1.0  # Seconds between checks of the docs directory
+
+def slugify(text: str) -> str:
+    """GitHub-style heading anchor"""
+    return re.sub(r"[^\w\- ]", "", text.lower()).strip().replace(" ", "-")
+
+def _inline_text(token) -> str:
+    return "".join(child.content if child.type in ("text", "code_inline") else " "
+                   for child in token.children or () if child.type != "html_inline")
+
+class Lesson:
+    """One lesson, read and rendered once per version of its file"""
+
+    def __init__(self, name: str, path: pathlib.Path, version: tuple, renderer: MarkdownIt):
+        self.name = name
+        self.path = path
+        self.version = version  # (mtime_ns, size) when read
+        self.content = path.read_text(encoding="utf-8")
+        self.sections = []  # (heading, anchor, text) in document order
+        self.html = self._render(renderer)
+        self.title = self.sections[0][0] if self.sections and self.sections[0][1] else name
+        payload = {"name": name, "title": self.title, "content": self.content, "html": self.html}
+        self.json_body = CachedBody(json.dumps(payload).encode(), "application/json")
+        self.html_body = CachedBody(self.html.encode(), "text/html")
+        # WebSocket message, serialized once for every client that asks
+        self.message = json.dumps({"kind": "lesson", "payload": payload})
+
+    def _render(self, renderer: MarkdownIt) -> str:
+        """Render to HTML, giving every heading an id and collecting its section text"""
+        tokens = renderer.parse(self.content)
+        anchors = set()
+        heading, anchor, text = "", "", []
+        for i, token in enumerate(tokens):
+            if token.type == "heading_open":
+                if heading or text:
+                    self.sections.append((heading, anchor, " ".join(" ".join(text).split())))
+                heading, text = _inline_text(tokens[i + 1]).strip(), []
+                anchor = base = slugify(heading) or "section"
+                n = 1
+                while anchor in anchors:
+                    anchor = f"{base}-{n}"
+                    n += 1
+                anchors.add(anchor)
+                token.attrSet("id", anchor)
+            elif token.type == "inline" and tokens[i - 1].type != "heading_open":
+                text.append(_inline_text(token).strip())
+            elif token.type in ("fence", "code_block"):
+                text.append(token.content.strip())
+        if heading or text:
+            self.sections.append((heading, anchor, " ".join(" ".join(text).split())))
+        return renderer.renderer.render(tokens, renderer.options, {})
+
+class LessonStore:
+    """All lessons of a directory, indexed and pre-rendered in memory
+
+    `refresh()` only stats the files and re-reads the ones whose mtime or size
+    changed, so serving a lesson never touches the disk. `watch` refreshes
+    in a worker thread; the lessons and index change under `_lock`, which
+    readers on the event loop take too.
+    """
+
+    def __init__(self, directory: pathlib.Path = DOCS, interval: float = WATCH_INTERVAL):
+        self.directory = pathlib.Path(directory)
+        self.interval = interval
+        self.lessons = {}  # name -> Lesson
+        self.index = SearchIndex()
+        self._lock = threading.Lock()
+        # markdown-it's JS default preset, which the frontend used to render with
+        self.renderer = MarkdownIt("js-default")
+        self.index_body = None
+        self.index_message = None
+        self.refresh()
+
+    def refresh(self) -> list:
+        """Pick up added, changed and removed lessons, returns their names"""
+        versions = {}
+        for path in self.directory.glob("*.md"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            versions[path.stem] = (stat.st_mtime_ns, stat.st_size)
+        removed = [name for name in self.lessons if name not in versions]
+        loaded = {}
+        for name, version in versions.items():
+            lesson = self.lessons.get(name)
+            if lesson is not None and lesson.version == version:
+                continue
+            try:
+                loaded[name] = Lesson(name, self.directory / f"{name}.md", version, self.renderer)
+            except (OSError, UnicodeDecodeError) as e:
+                logger.error(f"Error loading lesson {name}: {e}")
+        changed = removed + list(loaded)
+        if changed:
+            # Files are read and rendered above, only the swap holds the lock
+            with self._lock:
+                for name in removed:
+                    del self.lessons[name]
+                    self.index.remove(name)
+                for name, lesson in loaded.items():
+                    self.lessons[name] = lesson
+                    self.index.update(name, lesson.title, lesson.sections)
+        if self.index_body is not None and changed:
+            logger.info(f"Lessons reloaded: {', '.join(sorted(changed))}")
+        if changed or self.index_body is None:
+            names = self.names()
+            self.index_body = CachedBody(json.dumps({"lessons": names}).encode(), "application/json")
+            self.index_message = json.dumps({"kind": "lessons", "payload": names})
+        return changed
+
+    def names(self) -> list:
+        with self._lock:
+            return sorted(self.lessons)
+
+    def get(self, name: str) -> Lesson:
+        """Look up a lesson, raises FileNotFoundError for unknown names"""
+        lesson = self.lessons.get(name)
+        if lesson is None:
+            raise FileNotFoundError(name)
+        return lesson
+
+    def search(self, query: str, limit: int = 10) -> dict:
+        with self._lock:
+            return self.index.search(query, limit)
+
+    async def watch(self):
+        """Refresh the store whenever the docs directory changes"""
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await asyncio.to_thread(self.refresh)
+            except Exception as e:
+                logger.error(f"Lesson watch error: {e}")
+
+_store = None
+
+def default_store() -> LessonStore:
+    """The store of the docs directory, built on first use rather than on import"""
+    global _store
+    if _store is None:
+        _store = LessonStore()
+    return _store
+
+def __getattr__(name: str):
+    # `lessons.store` is the default store
+    if name == "store":
+        return default_store()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 def list_lessons():
-    return sorted(p.stem for p in DOCS.glob("*.md"))
+    return default_store().names()
+
 def load_md(name: str) -> str:
-    path = DOCS / f"{name}.md"
-    if not path.exists():
-        raise FileNotFoundError(name)
-    return path.read_text(encoding="utf-8")
+    return default_store().get(name).content
+
+def search_lessons(query: str, limit: int = 10) -> dict:
+    return default_store().search(query, limit)
@@ -0,0 +1,274 @@
+"""Built-in instrumentation exported in the Prometheus text format
+
+A small metrics registry without external dependencies. Counters and
+histograms are updated in place by the code they instrument; gauges are
+computed from live objects when `/metrics` is scraped, so they cost nothing
+in between. Scan phases and rungs are timed on one scan out of every
+`PROFILE_INTERVAL` (env `PLC_PROFILE_INTERVAL`, 0 disables it), which keeps
+profiling far below 1% of scan time.
+"""
+import asyncio
+import bisect
+import logging
+import math
+import os
+
+logger = logging.getLogger(__name__)
+
+PROFILE_INTERVAL = int(os.getenv("PLC_PROFILE_INTERVAL", "100"))
+LOOP_LAG_INTERVAL = 0.5  # Seconds between event loop lag probes
+
+# Seconds; rungs and scan phases run for microseconds, requests for milliseconds
+SCAN_BUCKETS = (1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4,
+                1e-3, 2.5e-3, 5e-3, 1e-2, 5e-2)
+LATENCY_BUCKETS = (1e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, 1e-2,
+                   2.5e-2, 5e-2, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+SCAN_PHASES = ("writes", "ladder", "process", "publish", "observers")
+
+def _format_value(value) -> str:
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, int):
+        return str(value)
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    parts = []
+    for key, value in labels.items():
+        value = str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+        parts.append(f'{key}="{value}"')
+    return "{" + ",".join(parts) + "}"
+
+class Registry:
+    """Metrics exported by one `/metrics` endpoint"""
+
+    def __init__(self):
+        self.metrics = {}  # name -> metric
+
+    def register(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError(f"Duplicate metric {metric.name}")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def unregister(self, name: str):
+        self.metrics.pop(name, None)
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        for metric in list(self.metrics.values()):
+            try:
+                samples = list(metric.samples())
+            except Exception as e:
+                logger.error(f"Error collecting metric {metric.name}: {e}")
+                continue
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for suffix, labels, value in samples:
+                lines.append(f"{metric.name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+        lines.append("")
+        return "\n".join(lines)
+
+REGISTRY = Registry()
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (),
+                 registry: Registry = REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}  # label values -> child
+        if not self.labelnames and hasattr(self, "_child"):
+            self.labels()  # Exported as 0 before the first update
+        if registry is not None:
+            registry.register(self)
+
+    def labels(self, *values):
+        """Child for one combination of label values; keep it to skip the lookup"""
+        values = tuple(str(v) for v in values)
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} takes labels {self.labelnames}")
+            child = self._children[values] = self._child()
+        return child
+
+    def _labeled(self):
+        for values, child in list(self._children.items()):
+            yield dict(zip(self.labelnames, values)), child
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+class Counter(_Metric):
+    """Monotonically increasing count"""
+
+    kind = "counter"
+    _child = _CounterChild
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def samples(self):
+        for labels, child in self._labeled():
+            yield "_total", labels, child.value
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds: tuple):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+class Histogram(_Metric):
+    """Distribution of observed values over fixed buckets"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (),
+                 buckets: tuple = LATENCY_BUCKETS, registry: Registry = REGISTRY):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def samples(self):
+        for labels, child in self._labeled():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), list(child.counts)):
+                cumulative += count
+                yield "_bucket", {**labels, "le": _format_value(bound)}, cumulative
+            yield "_sum", labels, child.sum
+            yield "_count", labels, cumulative
+
+class Gauge(_Metric):
+    """Values computed at scrape time by `collect()`
+
+    `collect` returns `(label values, value)` pairs, or a single number for
+    a gauge without labels.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, collect, labelnames: tuple = (),
+                 registry: Registry = REGISTRY):
+        self.collect = collect
+        super().__init__(name, documentation, labelnames, registry)
+
+    def samples(self):
+        result = self.collect()
+        if not self.labelnames:
+            yield "", {}, result
+            return
+        for values, value in result:
+            yield "", dict(zip(self.labelnames, map(str, values))), value
+
+# -- instrumentation shared by the backend ------------------------------
+
+SCAN_PHASE_SECONDS = Histogram(
+    "plc_scan_phase_seconds", "Time spent in each phase of profiled scans",
+    ("phase",), SCAN_BUCKETS)
+RUNG_SECONDS = Histogram(
+    "plc_rung_seconds", "Execution time of each ladder rung in profiled scans",
+    ("program", "rung"), SCAN_BUCKETS)
+MODBUS_REQUESTS = Counter(
+    "plc_modbus_requests", "Modbus requests by function code and validation result",
+    ("function_code", "result"))
+WS_FRAMES_SENT = Counter("plc_ws_frames_sent", "WebSocket frames written to clients")
+WS_FRAMES_DROPPED = Counter(
+    "plc_ws_frames_dropped", "State frames discarded for lagging clients, replaced by a keyframe")
+WS_SEND_FAILURES = Counter("plc_ws_send_failures", "WebSocket sends that failed")
+WS_EVICTIONS = Counter("plc_ws_evictions", "Clients disconnected for staying backed up")
+BROADCAST_SECONDS = Histogram(
+    "plc_broadcast_seconds", "Time to diff, serialize and queue state for all clients per tick",
+    ("kind",), SCAN_BUCKETS + (0.1, 0.5))
+REQUEST_SECONDS = Histogram(
+    "plc_request_seconds", "Latency of handling actions and other requests",
+    ("transport", "kind"))
+EVENT_LOOP_LAG_SECONDS = Histogram(
+    "plc_event_loop_lag_seconds", "How late the event loop woke up a sleeping task",
+    buckets=LATENCY_BUCKETS)
+
+_phase_children = [SCAN_PHASE_SECONDS.labels(phase) for phase in SCAN_PHASES]
+_rung_children = {}  # program name -> [child per rung]
+_modbus_children = {}
+
+def record_scan_profile(program: str, phases: list, rungs: list):
+    """Record the timestamps of one profiled scan
+
+    `phases` holds the clock before the first phase and after each of
+    `SCAN_PHASES`, `rungs` the clock before the first rung and after each.
+    """
+    for child, start, end in zip(_phase_children, phases, phases[1:]):
+        child.observe(end - start)
+    children = _rung_children.get(program)
+    if children is None or len(children) != len(rungs) - 1:
+        children = _rung_children[program] = [
+            RUNG_SECONDS.labels(program, i) for i in range(len(rungs) - 1)]
+    for child, start, end in zip(children, rungs, rungs[1:]):
+        child.observe(end - start)
+
+def count_modbus_request(function_code: int, valid: bool):
+    child = _modbus_children.get((function_code, valid))
+    if child is None:
+        child = _modbus_children[function_code, valid] = MODBUS_REQUESTS.labels(
+            function_code, "ok" if valid else "invalid")
+    child.inc()
+
+async def monitor_event_loop(interval: float = LOOP_LAG_INTERVAL):
+    """Measure how late the event loop runs a task that sleeps `interval`"""
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG_SECONDS.observe(max(0.0, loop.time() - started - interval))
+
+def scan_gauges(plcs, registry: Registry = REGISTRY) -> list:
+    """Per-PLC scan statistics, read from `plcs()` (id -> PLC) at scrape time
+
+    Returns the gauges, for `Registry.unregister` once the PLCs are gone.
+    """
+    def stat(field: str, scale: float = None):
+        def collect():
+            result = []
+            for plc_id, plc in sorted(plcs().items()):
+                value = plc.stats.summary().get(field, 0)
+                result.append(((plc_id,), value if scale is None else value * scale))
+            return result
+        return collect
+
+    return [
+        Gauge("plc_scans", "Scans executed", stat("scans"), ("plc",), registry),
+        Gauge("plc_scan_overruns", "Scans that finished after their next deadline",
+              stat("overruns"), ("plc",), registry),
+        Gauge("plc_scan_faults", "Scans that raised an exception", stat("faults"), ("plc",), registry),
+        Gauge("plc_scan_duration_avg_seconds", "Average scan time over the recent window",
+              stat("avg_ms", 1e-3), ("plc",), registry),
+        Gauge("plc_scan_duration_p99_seconds", "99th percentile scan time over the recent window",
+              stat("p99_ms", 1e-3), ("plc",), registry),
+        Gauge("plc_scan_jitter_p99_seconds", "99th percentile scan start lateness over the recent window",
+              stat("jitter_p99_ms", 1e-3), ("plc",), registry),
+    ]
@@ -1,19 +1,101 @@
-import threading
-import time
+import collections
 import logging
+import time
+
+import numpy as np
+
+from pymodbus.datastore import ModbusBaseSlaveContext, ModbusServerContext
+from pymodbus.server import ModbusTcpServer
+
+from plc_scada_lab.backend import metrics
+from plc_scada_lab.backend.image import BIT_TABLES, ProcessImage
+from plc_scada_lab.backend.ladder import LadderProgram
+from plc_scada_lab.backend.process import MAX_TIME_SCALE, ProcessModel
+from plc_scada_lab.backend.scheduler import MIN_SCAN_TIME, ScanScheduler, ScanStats
 
 logger = logging.getLogger(__name__)
 
+MODBUS_PORT = 1502
+MAX_BATCH_ACTIONS = 10000
+
+# Image table written by each action type of the API
+ACTION_TABLES = {
+    "set_input": "discrete_inputs",
+    "toggle_input": "discrete_inputs",
+    "set_register": "holding_registers",
+}
+
+def prepare_write(image: ProcessImage, table: str, start: int, values) -> tuple:
+    """Validated `(table, start, values)` write for an image; values None toggles a bit
+
+    Raises KeyError/IndexError for an unknown table or a range outside the
+    image, ValueError/TypeError for values that do not convert.
+    """
+    if values is None:
+        if table not in BIT_TABLES:
+            raise KeyError(f"Cannot toggle {table}")
+        image.check_range(start, 1)
+        return table, start, None
+    values = image.coerce(table, values)
+    image.check_range(start, values.size)
+    return table, start, values
+
+def check_scan_config(scan_time: float = None, time_scale: float = None):
+    """Raise ValueError for a scan time below 1ms or a time scale outside 0..MAX_TIME_SCALE"""
+    if scan_time is not None and scan_time < MIN_SCAN_TIME:
+        raise ValueError(f"Scan time must be at least {MIN_SCAN_TIME * 1000:.0f}ms")
+    if time_scale is not None and not 0 < time_scale <= MAX_TIME_SCALE:
+        raise ValueError(f"Time scale must be above 0 and at most {MAX_TIME_SCALE:g}")
+
+class PLCSnapshot:
+    """Immutable, consistent PLC state published at the end of a scan"""
+    
+    __slots__ = ("image", "scan_count", "motor_running", "pump_running", "scan_time", "timestamp")
+    
+    def __init__(self, plc: "PLCSimulator"):
+        self.image = plc.image.copy(readonly=True)
+        self.scan_count = plc.scan_count
+        self.motor_running = plc.motor_running
+        self.pump_running = plc.pump_running
+        self.scan_time = plc.scan_time
+        self.timestamp = time.time()
+        
+    @classmethod
+    def build(cls, image: ProcessImage, scan_count: int, motor_running: bool,
+              pump_running: bool, scan_time: float, timestamp: float) -> "PLCSnapshot":
+        """Snapshot from state captured elsewhere, e.g. another process"""
+        snapshot = cls.__new__(cls)
+        snapshot.image = image
+        snapshot.scan_count = scan_count
+        snapshot.motor_running = motor_running
+        snapshot.pump_running = pump_running
+        snapshot.scan_time = scan_time
+        snapshot.timestamp = timestamp
+        return snapshot
+
 class PLCSimulator:
-    """Simplified PLC simulation for WebContainer compatibility"""
+    """Simplified PLC simulation for WebContainer compatibility
+
+    The live image is owned by the scan thread. Other threads read the
+    latest `snapshot`, swapped in atomically at the end of every scan, and
+    write through `write`/`toggle`/`write_batch`, which queue the change for
+    the start of the next scan. Neither side ever takes a lock.
+    """
     
-    def __init__(self):
+    def __init__(self, size: int = 64, program: LadderProgram = None,
+                 process: ProcessModel = None):
         self.running = False
         self.scan_time = 0.1  # 100ms scan cycle
-        self.coils = [False] * 64
-        self.discrete_inputs = [False] * 64
-        self.holding_registers = [0] * 64
-        self.input_registers = [0] * 64
+        self.fast_forward = False  # Run scans back to back, ignoring scan_time
+        self.time_scale = 1.0  # Process and timer seconds per second of scan time
+        self.scan_count = 0
+        self.stats = ScanStats()
+        self.scheduler = None
+        self.image = ProcessImage(size)
+        self.coils = self.image.coils
+        self.discrete_inputs = self.image.discrete_inputs
+        self.holding_registers = self.image.holding_registers
+        self.input_registers = self.image.input_registers
         
         # Initialize some realistic values
         self.holding_registers[0] = 800   # Process temperature
@@ -22,132 +104,356 @@ class PLCSimulator:
         self.holding_registers[3] = 0     # Alarm status
         self.holding_registers[4] = 800   # Temperature setpoint
         
-        # Simulation variables
-        self.motor_running = False
-        self.pump_running = False
+        # Ladder program, compiled once and bound to this PLC's memory
+        self.program = program or LadderProgram.load()
+        self.memory = self.program.create_memory()
+        self._ladder_scan = self.program.bind(self.image, self.memory)
+        
+        # Plant model, stepped after the ladder logic every scan
+        self.process = process or ProcessModel.load()
+        self.plant = self.process.bind(self.image)
         
-    def start_simulation(self):
-        """Start the PLC simulation loop"""
+        # External writes waiting for the next scan, and the published state
+        self._writes = collections.deque()
+        self.observers = []  # Called with each published snapshot, on the scan thread
+        self.journal = None  # JournalWriter recording this PLC, see start_journal()
+        
+        # One scan in `profile_interval` times its phases and rungs (0: never)
+        self.profile_interval = metrics.PROFILE_INTERVAL
+        self._profile_countdown = self.profile_interval
+        self._profiled_ladder = None
+        self._rung_marks = [0.0] * (len(self.program.rungs) + 1)
+        self.snapshot = None
+        self._publish()
+        
+    @property
+    def motor_running(self) -> bool:
+        return bool(self.program.tag("motor_running", self.image, self.memory))
+        
+    @property
+    def pump_running(self) -> bool:
+        return bool(self.program.tag("pump_running", self.image, self.memory))
+        
+    def start_simulation(self, scheduler: ScanScheduler = None):
+        """Start the PLC simulation loop
+
+        Scans run on `scheduler`, or on a private scheduler thread if none
+        is given.
+        """
         self.running = True
-        self.simulation_thread = threading.Thread(target=self._simulation_loop, daemon=True)
-        self.simulation_thread.start()
+        if scheduler is None:
+            scheduler = ScanScheduler()
+            scheduler.start()
+        self.scheduler = scheduler
+        scheduler.add(self)
         logger.info("PLC Simulation started")
         
     def stop_simulation(self):
         """Stop the PLC simulation"""
         self.running = False
+        if self.scheduler is not None:
+            self.scheduler.wake()
         logger.info("PLC Simulation stopped")
         
-    def _simulation_loop(self):
-        """Main simulation loop - executes ladder logic"""
-        while self.running:
-            try:
-                self._execute_ladder_logic()
-                self._update_process_values()
-                time.sleep(self.scan_time)
-            except Exception as e:
-                logger.error(f"Simulation error: {e}")
-                
-    def _execute_ladder_logic(self):
-        """Execute ladder logic - simplified for WebContainer"""
-        
-        # Rung 1: Motor control
-        start_button = self.discrete_inputs[0]
-        stop_button = self.discrete_inputs[1]
-        motor_fault = self.discrete_inputs[2]
-        
-        if start_button and not stop_button and not motor_fault:
-            self.motor_running = True
-        elif stop_button or motor_fault:
-            self.motor_running = False
-            
-        self.coils[0] = self.motor_running
-        
-        # Rung 2: Pump control (depends on motor)
-        tank_level_low = self.discrete_inputs[3]
-        
-        if self.motor_running and tank_level_low:
-            self.pump_running = True
-        elif not self.motor_running:
-            self.pump_running = False
-            
-        self.coils[1] = self.pump_running
-        
-        # Rung 3: Temperature control
-        current_temp = self.holding_registers[0]
-        temp_setpoint = self.holding_registers[4]
-        
-        # Heater control with hysteresis
-        if current_temp < (temp_setpoint - 20):
-            self.coils[2] = True  # Heater ON
-        elif current_temp > (temp_setpoint + 10):
-            self.coils[2] = False  # Heater OFF
-            
-        # Rung 4: Alarm logic
-        alarm_status = 0
-        if current_temp > 1200:  # Over-temperature
-            alarm_status |= 0x01
-        if self.holding_registers[1] > 1000:  # Over-pressure
-            alarm_status |= 0x02
-        if motor_fault:  # Motor fault
-            alarm_status |= 0x04
-            
-        self.holding_registers[3] = alarm_status
-        self.coils[3] = alarm_status > 0  # Alarm indicator
-        
-    def _update_process_values(self):
-        """Simulate realistic process values"""
-        
-        # Temperature simulation
-        current_temp = self.holding_registers[0]
-        heater_on = self.coils[2]
-        
-        if heater_on:
-            # Heat up with some inertia
-            self.holding_registers[0] = min(1500, current_temp + 2)
-        else:
-            # Cool down naturally
-            self.holding_registers[0] = max(200, current_temp - 1)
-            
-        # Pressure simulation (depends on pump)
-        current_pressure = self.holding_registers[1]
-        if self.pump_running:
-            self.holding_registers[1] = min(1200, current_pressure + 5)
-        else:
-            self.holding_registers[1] = max(0, current_pressure - 3)
-            
-        # Flow rate (depends on pump and pressure)
-        if self.pump_running and current_pressure > 100:
-            self.holding_registers[2] = min(100, self.holding_registers[2] + 2)
-        else:
-            self.holding_registers[2] = max(0, self.holding_registers[2] - 1)
-            
-        # Update input registers with sensor readings
-        self.input_registers[0] = self.holding_registers[0]  # Temperature sensor
-        self.input_registers[1] = self.holding_registers[1]  # Pressure sensor
-        self.input_registers[2] = self.holding_registers[2]  # Flow sensor
+    def configure_scan(self, scan_time: float = None, fast_forward: bool = None,
+                       time_scale: float = None):
+        """Change the scan period (seconds, >= 1ms), fast-forward mode and/or time scale
+
+        With a time scale of N every scan advances timers and the process
+        model by N scan periods, so the plant runs N times faster than real
+        time at the same scan rate.
+        """
+        check_scan_config(scan_time, time_scale)
+        if scan_time is not None:
+            self.scan_time = float(scan_time)
+        if fast_forward is not None:
+            self.fast_forward = bool(fast_forward)
+        if time_scale is not None:
+            self.time_scale = float(time_scale)
+        if self.scheduler is not None:
+            self.scheduler.wake()
+        
+    def write(self, table: str, start: int, values):
+        """Queue a range write for the start of the next scan
+
+        Raises KeyError/IndexError for an unknown table or a range outside
+        the image, so callers can report failures immediately.
+        """
+        self._writes.append((prepare_write(self.image, table, start, values),))
+        
+    def toggle(self, table: str, address: int):
+        """Queue inverting a coil or discrete input at the next scan"""
+        self._writes.append((prepare_write(self.image, table, address, None),))
+        
+    def write_batch(self, writes):
+        """Queue `(table, start, values)` writes to be applied together at the next scan
+
+        `values` None toggles a bit. Every write is validated before any is
+        queued, and the batch is applied in order between two scans.
+        """
+        batch = tuple(prepare_write(self.image, *write) for write in writes)
+        if batch:
+            self._writes.append(batch)
+        
+    def _apply_writes(self, journal=None):
+        """Apply queued external writes, in order, recording them to `journal`"""
+        writes = self._writes
+        while writes:
+            batch = writes.popleft()
+            if journal is not None:
+                journal.record_writes(self.scan_count, batch)
+            for table, start, values in batch:
+                data = self.image.table(table)
+                if values is None:
+                    data[start] = not data[start]
+                else:
+                    data[start:start + values.size] = values
+        
+    def scan_once(self):
+        """Execute one complete PLC scan"""
+        # Read once: configure_scan() may change it from another thread
+        dt = self.scan_time * self.time_scale
+        journal = self.journal
+        if journal is not None:
+            journal.begin_scan(self, dt)
+        self._profile_countdown -= 1
+        if self._profile_countdown == 0:
+            self._profile_countdown = self.profile_interval
+            self._profiled_scan(dt, journal)
+            return
+        self._apply_writes(journal)
+        self._execute_ladder_logic(dt)
+        self._update_process_values(dt)
+        self.scan_count += 1
+        self._publish()
+        for observer in self.observers:
+            observer(self.snapshot)
+        
+    def _profiled_scan(self, dt: float, journal=None):
+        """`scan_once` with every phase and rung timed into the metrics"""
+        clock = time.perf_counter
+        if self._profiled_ladder is None:
+            self._profiled_ladder = self.program.bind(self.image, self.memory, self._rung_marks)
+        phases = [clock()]
+        self._apply_writes(journal)
+        phases.append(clock())
+        self._profiled_ladder(dt)
+        phases.append(clock())
+        self._update_process_values(dt)
+        phases.append(clock())
+        self.scan_count += 1
+        self._publish()
+        phases.append(clock())
+        for observer in self.observers:
+            observer(self.snapshot)
+        phases.append(clock())
+        metrics.record_scan_profile(self.program.name, phases, self._rung_marks)
+        
+    def _publish(self):
+        """Make the state at the end of a scan visible to readers"""
+        self.snapshot = PLCSnapshot(self)
+        
+    def _execute_ladder_logic(self, dt: float):
+        """Execute one scan of the compiled ladder program"""
+        self._ladder_scan(dt)
+        
+    def _update_process_values(self, dt: float):
+        """Advance the process model by `dt` seconds"""
+        self.plant(dt)
+        
+    def capture_state(self) -> list:
+        """Everything the next scan depends on, as bytes
+
+        The image buffer, every ladder memory array and the process model
+        state. Only consistent between scans, i.e. on the scan thread.
+        """
+        return ([self.image.buffer.tobytes()]
+                + [array.tobytes() for array in self.memory.arrays().values()]
+                + [self.plant.state().tobytes()])
+        
+    def restore_state(self, scan_count: int, state: list):
+        """Continue from `capture_state()` taken after `scan_count` scans
+
+        Pending writes are dropped. The PLC must not be scanning.
+        """
+        arrays = list(self.memory.arrays().values())
+        if len(state) != len(arrays) + 2 or len(state[0]) != self.image.nbytes:
+            raise ValueError("State does not match this PLC's image and program")
+        self.image.buffer[:] = np.frombuffer(state[0], dtype=np.uint8)
+        for array, data in zip(arrays, state[1:-1]):
+            array[...] = np.frombuffer(data, dtype=array.dtype)
+        self.plant.restore(np.frombuffer(state[-1], dtype=np.float64))
+        self._writes.clear()
+        self.scan_count = scan_count
+        self._publish()
+        
+    def start_journal(self, path, checkpoint_interval: int = None):
+        """Record every external write into a new journal file from the next scan on"""
+        from plc_scada_lab.backend.journal import JournalWriter
+        self.stop_journal()
+        self.journal = JournalWriter(path, self, checkpoint_interval)
+        logger.info(f"Journaling PLC to {path}")
+        
+    def stop_journal(self):
+        journal, self.journal = self.journal, None
+        if journal is not None:
+            journal.close()
+
+class PLCSlaveContext(ModbusBaseSlaveContext):
+    """Modbus slave context serving requests straight from PLCSimulator memory
+
+    There is no intermediate datastore: reads slice the latest published
+    scan snapshot and writes are queued for the next scan, so Modbus masters
+    see exactly what the ladder logic sees. Addresses are zero based
+    (address 0 is coil/register 0).
+    """
+
+    # Function code datastore letter -> PLCSimulator attribute
+    _tables = {
+        "c": "coils",
+        "d": "discrete_inputs",
+        "h": "holding_registers",
+        "i": "input_registers",
+    }
+
+    def __init__(self, plc: PLCSimulator):
+        self.plc = plc
+        self._echo = None  # (table, address, values, scan count) of the last write
+
+    def _table(self, fc_as_hex):
+        return self.plc.snapshot.image.table(self._tables[self.decode(fc_as_hex)])
+
+    def reset(self):
+        """Resetting is not supported, the simulator owns its memory"""
+
+    def validate(self, fc_as_hex, address, count=1):
+        """Check that the requested range fits inside the table"""
+        valid = 0 <= address and address + count <= len(self._table(fc_as_hex))
+        metrics.count_modbus_request(fc_as_hex, valid)
+        return valid
+
+    def getValues(self, fc_as_hex, address, count=1):
+        """Read `count` values starting at `address`
+
+        Right after a write, and until the scan applying it, the written
+        values are returned: FC5/FC6 responses echo what was written.
+        """
+        echo, self._echo = self._echo, None
+        if echo is not None:
+            table, start, values, scan_count = echo
+            if (table == self.decode(fc_as_hex) and start == address and count <= len(values)
+                    and scan_count == self.plc.snapshot.scan_count):
+                return values[:count]
+        return self._table(fc_as_hex)[address:address + count].tolist()
+
+    def setValues(self, fc_as_hex, address, values):
+        """Queue a write of values starting at `address`"""
+        table = self.decode(fc_as_hex)
+        self.plc.write(self._tables[table], address, values)
+        self._echo = (table, address, list(values), self.plc.snapshot.scan_count)
 
 # Global instances
-plc_simulator = None
+fleet = None
+plc_simulator = None  # The default PLC of the fleet
+checkpoints = None    # FleetCheckpoints of the fleet, if enabled
+modbus_servers = {}   # port -> ModbusTcpServer
+modbus_port = MODBUS_PORT
+
+def start_modbus(port: int = MODBUS_PORT, size: int = 64, config=None, count: int = 1,
+                 shards: int = 0, checkpoint_dir=None, checkpoint_interval: float = None):
+    """Start the PLC fleet and build one Modbus server context per port
 
-def start_modbus(port: int = 1502):
-    """Start the simplified PLC system for WebContainer"""
-    global plc_simulator
+    `config` is a fleet config (dict or JSON path, see `PLCFleet`);
+    without one `count` identical PLCs are started. With `shards` > 0 the
+    PLCs are scanned by that many worker processes (see `ShardedFleet`).
+    With `checkpoint_dir` every PLC resumes from its checkpoint there and
+    is checkpointed every `checkpoint_interval` seconds (see `checkpoint`).
+    Returns the `{port: context}` mapping and the default PLC. The TCP
+    listeners themselves are started by `serve_modbus`, which must run on
+    the application event loop.
+    """
+    global fleet, plc_simulator, modbus_port, checkpoints
+    # The fleets build on the simulator classes defined above
+    from plc_scada_lab.backend.fleet import PLCFleet
+    from plc_scada_lab.backend.shards import ShardedFleet
     try:
-        # Create and start PLC simulation
-        plc_simulator = PLCSimulator()
-        plc_simulator.start_simulation()
+        fleet = ShardedFleet(port, shards) if shards > 0 else PLCFleet(port)
+        if config is not None:
+            fleet.configure(config)
+        else:
+            fleet.add_uniform(count, size=size)
+        if checkpoint_dir is not None:
+            from plc_scada_lab.backend.checkpoint import FleetCheckpoints
+            checkpoints = FleetCheckpoints(checkpoint_dir, checkpoint_interval)
+            restored = checkpoints.attach_fleet(fleet)
+            logger.info(f"Restored {restored} of {len(fleet.plcs)} PLCs from {checkpoint_dir}")
+            checkpoints.start()
+        fleet.start()
+        plc_simulator = fleet.default
+        modbus_port = port
         
-        logger.info("Simplified PLC system started (WebContainer mode)")
-        return None, plc_simulator
+        contexts = fleet.server_contexts()
+        logger.info(f"PLC system started with {len(fleet.plcs)} PLCs on {len(contexts)} ports")
+        return contexts, plc_simulator
         
     except Exception as e:
         logger.error(f"Failed to start PLC system: {e}")
         return None, None
 
-def get_plc_state():
+async def serve_modbus(context: ModbusServerContext, host: str = "0.0.0.0", port: int = None):
+    """Run a Modbus TCP server on the current event loop until stopped
+
+    Every master connection gets its own protocol handler task and requests
+    are answered synchronously from PLC memory, so a slow or pipelining
+    client never holds up the others.
+    """
+    port = port or modbus_port
+    server = modbus_servers[port] = ModbusTcpServer(context, address=(host, port))
+    logger.info(f"Modbus TCP server listening on {host}:{port}")
+    try:
+        await server.serve_forever()
+    finally:
+        modbus_servers.pop(port, None)
+
+async def stop_modbus():
+    """Stop all running Modbus TCP servers"""
+    for server in list(modbus_servers.values()):
+        await server.shutdown()
+
+def stop_plcs():
+    """Stop the fleet's scans and write its final checkpoints
+
+    `start_modbus` may start a new fleet afterwards.
+    """
+    global fleet, plc_simulator, checkpoints
+    if fleet is not None:
+        try:
+            fleet.stop()
+        except Exception as e:
+            logger.error(f"Error stopping PLC fleet: {e}")
+    if checkpoints is not None:
+        try:
+            checkpoints.close()
+        except Exception as e:
+            logger.error(f"Error writing final checkpoints: {e}")
+    fleet = plc_simulator = checkpoints = None
+
+def get_plc(plc_id: int = None):
+    """PLC by id, the default PLC if None; raises KeyError for unknown ids"""
+    if fleet is None:
+        return None
+    return fleet.get(plc_id)
+
+def list_plcs():
+    """Summary of every PLC in the fleet"""
+    if fleet is None:
+        return []
+    return fleet.describe()
+
+def get_plc_state(plc_id: int = None):
     """Get current PLC state"""
-    if plc_simulator is None:
+    plc = get_plc(plc_id)
+    if plc is None:
         return {
             'coils': [False] * 8,
             'discrete_inputs': [False] * 8,
@@ -158,32 +464,114 @@ def get_plc_state():
             'scan_time': 0.1
         }
     
+    snapshot = plc.snapshot
+    image = snapshot.image
     return {
-        'coils': plc_simulator.coils[:8],
-        'discrete_inputs': plc_simulator.discrete_inputs[:8],
-        'holding_registers': plc_simulator.holding_registers[:8],
-        'input_registers': plc_simulator.input_registers[:8],
-        'motor_running': plc_simulator.motor_running,
-        'pump_running': plc_simulator.pump_running,
-        'scan_time': plc_simulator.scan_time
+        'coils': image.coils[:8].tolist(),
+        'discrete_inputs': image.discrete_inputs[:8].tolist(),
+        'holding_registers': image.holding_registers[:8].tolist(),
+        'input_registers': image.input_registers[:8].tolist(),
+        'motor_running': snapshot.motor_running,
+        'pump_running': snapshot.pump_running,
+        'scan_time': snapshot.scan_time
     }
 
-def set_discrete_input(address: int, value: bool):
-    """Set discrete input value"""
-    if plc_simulator is None:
+def get_scan_stats(plc_id: int = None):
+    """Get scan timing statistics and scheduler settings"""
+    plc = get_plc(plc_id)
+    if plc is None:
+        return {"scan_time": 0.1, "fast_forward": False, "time_scale": 1.0,
+                "stats": ScanStats().summary()}
+    return {
+        "scan_time": plc.scan_time,
+        "fast_forward": plc.fast_forward,
+        "time_scale": plc.time_scale,
+        "stats": plc.stats.summary(),
+    }
+
+def configure_scan(scan_time: float = None, fast_forward: bool = None, plc_id: int = None,
+                   time_scale: float = None):
+    """Change scan period, fast-forward mode and/or time scale of a PLC"""
+    plc = get_plc(plc_id)
+    if plc is None:
         return True  # Mock success
-        
-    if 0 <= address < len(plc_simulator.discrete_inputs):
-        plc_simulator.discrete_inputs[address] = value
+    plc.configure_scan(scan_time, fast_forward, time_scale)
+    return True
+
+def read_table(table: str, start: int = 0, count: int = None, plc_id: int = None):
+    """Zero-copy read-only view of a range of one image table, as of the last scan"""
+    plc = get_plc(plc_id)
+    if plc is None:
+        return None
+    return plc.snapshot.image.view(table, start, count)
+
+def write_table(table: str, start: int, values, plc_id: int = None) -> bool:
+    """Bulk write a range of one image table at the next scan"""
+    plc = get_plc(plc_id)
+    if plc is None:
+        return True  # Mock success
+    try:
+        plc.write(table, start, values)
         return True
-    return False
+    except (IndexError, KeyError):
+        return False
 
-def set_holding_register(address: int, value: int):
-    """Set holding register value"""
-    if plc_simulator is None:
+def set_discrete_input(address: int, value: bool, plc_id: int = None):
+    """Set discrete input value"""
+    return write_table("discrete_inputs", address, [bool(value)], plc_id)
+
+def toggle_discrete_input(address: int, plc_id: int = None):
+    """Invert a discrete input at the next scan"""
+    plc = get_plc(plc_id)
+    if plc is None:
         return True  # Mock success
-        
-    if 0 <= address < len(plc_simulator.holding_registers):
-        plc_simulator.holding_registers[address] = max(0, min(65535, value))
+    try:
+        plc.toggle("discrete_inputs", address)
         return True
-    return False
\ No newline at end of file
+    except (IndexError, KeyError):
+        return False
+
+def set_holding_register(address: int, value: int, plc_id: int = None):
+    """Set holding register value"""
+    return write_table("holding_registers", address, [value], plc_id)
+
+def _action_write(action: dict) -> tuple:
+    """`(table, start, values)` write of one action in the /api/action format"""
+    action_type = action.get("action_type")
+    if action_type not in ACTION_TABLES:
+        raise ValueError(f"Invalid action type {action_type!r}")
+    address = int(action["address"])
+    if action_type == "toggle_input":
+        return ACTION_TABLES[action_type], address, None
+    # "values" writes a range starting at "address", like Modbus FC15/16
+    values = action["values"] if "values" in action else [action["value"]]
+    if not isinstance(values, list):
+        raise ValueError("values must be a list")
+    if action_type == "set_input":
+        values = [bool(v) for v in values]
+    else:
+        values = [int(v) for v in values]
+    return ACTION_TABLES[action_type], address, values
+
+def batch_actions(actions: list, plc_id: int = None) -> int:
+    """Apply an ordered list of actions atomically at the next scan
+
+    Returns the number of actions queued. Raises ValueError naming the first
+    invalid action, in which case nothing is written, and KeyError for an
+    unknown PLC.
+    """
+    if len(actions) > MAX_BATCH_ACTIONS:
+        raise ValueError(f"At most {MAX_BATCH_ACTIONS} actions per batch")
+    plc = get_plc(plc_id)
+    writes = []
+    for i, action in enumerate(actions):
+        try:
+            write = _action_write(action)
+            if plc is not None:
+                write = prepare_write(plc.snapshot.image, *write)
+        except (KeyError, IndexError, TypeError, ValueError, AttributeError) as e:
+            raise ValueError(f"Action {i}: {e}") from None
+        writes.append(write)
+    if plc is not None:
+        plc.write_batch(writes)
+    return len(writes)
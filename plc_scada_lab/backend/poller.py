@@ -0,0 +1,523 @@
+"""SCADA polling: an asyncio Modbus TCP master for external devices
+
+Polled devices appear in the fleet next to the simulated PLCs. Each one
+mirrors the tags it polls into its own image and publishes a snapshot
+after every poll round, so state, streaming, history and alarms treat it
+like any PLC.
+
+Config format::
+
+    {
+      "classes": {"fast": {"interval": 1.0},
+                  "slow": {"interval": 10.0, "max_interval": 60.0}},
+      "devices": [
+        {"id": 101, "host": "10.0.0.5", "port": 502, "unit_id": 1, "size": 1000,
+         "connections": 1, "pipeline": 8, "timeout": 2.0, "gap": 8,
+         "tags": [{"tag": "hr:0", "count": 100, "class": "fast"},
+                  {"tag": ["di:3", "di:7"], "class": "slow"}]},
+        ...
+      ]
+    }
+
+Tags of one class and table are coalesced into the fewest range reads
+(FC1/2/3/4) within the protocol limits of 2000 bits and 125 registers per
+request, bridging holes of up to `gap` points (default: 8 registers or
+96 bits) since reading a few unused points is cheaper than another
+request. Every read repeats at its class `interval`. Reads of a class with
+a `max_interval` back off, doubling their interval up to it, while they
+keep returning the same values, and return to `interval` as soon as
+anything changes.
+
+Each device keeps up to `connections` TCP connections with up to
+`pipeline` requests in flight on each. Writes from the API and Modbus go
+to the device as FC15/FC16, one at a time in the order they were made,
+whatever the number of connections; discrete inputs and input registers
+are read-only.
+"""
+import asyncio
+import json
+import logging
+import struct
+import time
+
+import numpy as np
+
+from plc_scada_lab.backend.image import BIT_TABLES, ProcessImage
+from plc_scada_lab.backend.ladder import IMAGE_AREAS
+from plc_scada_lab.backend.modbus_core import PLCSnapshot, prepare_write
+from plc_scada_lab.backend.scheduler import ScanStats
+
+logger = logging.getLogger(__name__)
+
+MAX_READ_BITS = 2000
+MAX_READ_REGISTERS = 125
+MAX_WRITE_BITS = 1968
+MAX_WRITE_REGISTERS = 123
+GAP = {"bits": 96, "registers": 8}  # Unused points worth reading to save a request
+DEFAULT_CLASSES = {
+    "fast": {"interval": 1.0},
+    "normal": {"interval": 5.0, "max_interval": 30.0},
+    "slow": {"interval": 30.0, "max_interval": 300.0},
+}
+DEFAULT_CLASS = "normal"
+BACKOFF_AFTER = 3        # Unchanged reads before a read slows down
+RECONNECT_DELAY = 2.0    # Seconds between connection attempts to a device
+TICK = 0.05              # Longest sleep of a device's poll loop
+
+READ_CODES = {"coils": 1, "discrete_inputs": 2, "holding_registers": 3, "input_registers": 4}
+MBAP = struct.Struct(">HHHB")
+REQUEST = struct.Struct(">BHH")
+WRITE_MULTIPLE = struct.Struct(">BHHB")
+
+class ModbusError(IOError):
+    """A Modbus exception response, a malformed response or a timeout"""
+
+def plan_reads(addresses, table: str, gap: int = None) -> list:
+    """Fewest `(start, count)` reads covering `addresses` of one table
+
+    Consecutive addresses are merged into one read as long as the hole
+    between them is at most `gap` points and the read stays within the
+    protocol limit of the table.
+    """
+    bits = table in BIT_TABLES
+    limit = MAX_READ_BITS if bits else MAX_READ_REGISTERS
+    gap = GAP["bits" if bits else "registers"] if gap is None else gap
+    addresses = np.unique(np.asarray(addresses, dtype=np.int64))
+    reads = []
+    if not addresses.size:
+        return reads
+    # Split where the hole is too wide, then cut runs longer than the limit
+    breaks = np.flatnonzero(np.diff(addresses) > gap + 1) + 1
+    for run in np.split(addresses, breaks):
+        start = int(run[0])
+        while True:
+            last = int(run[np.searchsorted(run, start + limit, "left") - 1])
+            reads.append((start, last - start + 1))
+            rest = np.searchsorted(run, last, "right")
+            if rest == run.size:
+                break
+            run = run[rest:]
+            start = int(run[0])
+    return reads
+
+class ModbusClient(asyncio.Protocol):
+    """One Modbus TCP connection with up to `pipeline` requests in flight
+
+    Responses are matched to requests by transaction id, so they may
+    arrive in any order.
+    """
+
+    def __init__(self, pipeline: int = 8):
+        self.transport = None
+        self._buffer = bytearray()
+        self._pending = {}  # transaction id -> future
+        self._tid = 0
+        self._slots = asyncio.Semaphore(pipeline)
+
+    @classmethod
+    async def connect(cls, host: str, port: int, pipeline: int = 8,
+                      timeout: float = 2.0) -> "ModbusClient":
+        loop = asyncio.get_running_loop()
+        _, client = await asyncio.wait_for(
+            loop.create_connection(lambda: cls(pipeline), host, port), timeout)
+        return client
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._pending)
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def connection_lost(self, exc):
+        self.transport = None
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError("Connection lost"))
+        self._pending.clear()
+
+    def data_received(self, data: bytes):
+        buffer = self._buffer
+        buffer += data
+        while len(buffer) >= MBAP.size:
+            tid, _, length, _ = MBAP.unpack_from(buffer)
+            end = 6 + length
+            if len(buffer) < end:
+                break
+            future = self._pending.pop(tid, None)
+            if future is not None and not future.done():
+                future.set_result(bytes(buffer[MBAP.size:end]))
+            del buffer[:end]
+
+    @staticmethod
+    def _expire(future):
+        if not future.done():
+            future.set_exception(ModbusError("Request timed out"))
+
+    async def request(self, unit: int, pdu: bytes, timeout: float) -> bytes:
+        """Send one PDU and return the response PDU"""
+        async with self._slots:
+            if self.transport is None:
+                raise ConnectionError("Not connected")
+            loop = asyncio.get_running_loop()
+            self._tid = tid = (self._tid + 1) & 0xFFFF
+            future = self._pending[tid] = loop.create_future()
+            self.transport.write(MBAP.pack(tid, 0, len(pdu) + 1, unit) + pdu)
+            timer = loop.call_later(timeout, self._expire, future)
+            try:
+                response = await future
+            finally:
+                timer.cancel()
+                self._pending.pop(tid, None)
+        if response[0] & 0x80:
+            raise ModbusError(f"Exception code {response[1]} for function {pdu[0]}")
+        return response
+
+    async def read(self, unit: int, table: str, start: int, count: int,
+                   timeout: float) -> np.ndarray:
+        """Values of a range of one table"""
+        response = await self.request(unit, REQUEST.pack(READ_CODES[table], start, count), timeout)
+        data = response[2:]
+        bits = table in BIT_TABLES
+        if response[1] != len(data) or len(data) != ((count + 7) // 8 if bits else 2 * count):
+            raise ModbusError(f"Malformed response to reading {count} {table}")
+        if bits:
+            return np.unpackbits(np.frombuffer(data, np.uint8), count=count,
+                                 bitorder="little").view(np.bool_)
+        return np.frombuffer(data, ">u2")
+
+    async def write(self, unit: int, table: str, start: int, values: np.ndarray,
+                    timeout: float):
+        """Write a range of coils (FC15) or holding registers (FC16)"""
+        if table == "coils":
+            data = np.packbits(values, bitorder="little").tobytes()
+            fc = 15
+        else:
+            data = values.astype(">u2").tobytes()
+            fc = 16
+        await self.request(unit, WRITE_MULTIPLE.pack(fc, start, values.size, len(data)) + data,
+                           timeout)
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+
+class ReadBlock:
+    """One coalesced range read, repeated at an adaptive interval"""
+
+    def __init__(self, table: str, start: int, count: int, interval: float,
+                 max_interval: float, tags: int):
+        self.table = table
+        self.start = start
+        self.count = count
+        self.base_interval = interval
+        self.max_interval = max(max_interval, interval)
+        self.interval = interval
+        self.tags = tags          # Configured tags this read covers
+        self.next_due = 0.0
+        self.unchanged = 0
+        self.last = None          # Raw values of the previous read
+
+    def update(self, values: np.ndarray, now: float) -> bool:
+        """Take a read result and schedule the next read, True if it changed"""
+        data = values.tobytes()
+        changed = data != self.last
+        self.last = data
+        if changed:
+            self.unchanged = 0
+            self.interval = self.base_interval
+        else:
+            self.unchanged += 1
+            if self.unchanged >= BACKOFF_AFTER:
+                self.interval = min(self.interval * 2, self.max_interval)
+        self.next_due = max(self.next_due + self.interval, now)
+        return changed
+
+class PolledDevice:
+    """An external Modbus TCP device mirrored into a local image
+
+    Offers the parts of the PLCSimulator interface the API, streaming,
+    historian and alarms use: `snapshot`, `observers`, `stats` and the
+    write methods. A poll round (every read that is due) counts as a
+    scan: its duration and lateness go to `stats`, and the snapshot is
+    republished when any value changed. Observers run on the event loop.
+    """
+
+    def __init__(self, plc_id: int, host: str, port: int = 502, unit_id: int = 1,
+                 size: int = 64, tags: list = (), classes: dict = None,
+                 connections: int = 1, pipeline: int = 8, timeout: float = 2.0,
+                 gap: int = None):
+        self.plc_id = plc_id
+        self.host = host
+        self.port = int(port)
+        self.unit_id = int(unit_id)
+        self.endpoint = f"{host}:{self.port}/{self.unit_id}"
+        self.image = ProcessImage(size)
+        self.connections = max(1, int(connections))
+        self.pipeline = max(1, int(pipeline))
+        self.timeout = float(timeout)
+        self.program = None
+        self.process = None
+        self.running = False
+        self.fast_forward = False
+        self.time_scale = 1.0
+        self.scan_count = 0
+        self.stats = ScanStats()
+        self.observers = []
+        self.blocks = self._plan(tags, {**DEFAULT_CLASSES, **(classes or {})}, gap)
+        self.tags = sum(block.tags for block in self.blocks)
+        self.scan_time = min((block.base_interval for block in self.blocks), default=1.0)
+        self.clients = []
+        self._connecting = None
+        self._retry_at = 0.0
+        self._loop = None
+        self._task = None
+        self._writes = None  # asyncio.Queue of write batches, while running
+        self.snapshot = None
+        self._publish()
+
+    def _plan(self, tags: list, classes: dict, gap: int) -> list:
+        """Read blocks for the tag list, coalesced per class and table"""
+        groups = {}  # (class, table) -> addresses
+        for entry in tags:
+            name = entry.get("class", DEFAULT_CLASS)
+            if name not in classes:
+                raise ValueError(f"Unknown tag class {name!r}")
+            tag = entry["tag"]
+            operands = tag if isinstance(tag, list) else [tag]
+            count = int(entry.get("count", 1)) if isinstance(tag, str) else 1
+            for operand in operands:
+                area, _, address = str(operand).partition(":")
+                if area not in IMAGE_AREAS or not address.isdigit():
+                    raise ValueError(f"Invalid tag {operand!r}, expected e.g. hr:0 or co:3")
+                start = int(address)
+                self.image.check_range(start, count)
+                groups.setdefault((name, IMAGE_AREAS[area]), []).append(
+                    np.arange(start, start + count))
+        blocks = []
+        for (name, table), parts in groups.items():
+            addresses = np.unique(np.concatenate(parts))
+            interval = float(classes[name]["interval"])
+            if interval <= 0:
+                raise ValueError(f"Tag class {name!r} needs a positive interval")
+            max_interval = float(classes[name].get("max_interval", interval))
+            for start, count in plan_reads(addresses, table, gap):
+                covered = int(np.count_nonzero((addresses >= start) & (addresses < start + count)))
+                blocks.append(ReadBlock(table, start, count, interval, max_interval, covered))
+        return blocks
+
+    def _publish(self):
+        self.snapshot = PLCSnapshot.build(self.image.copy(readonly=True), self.scan_count,
+                                          False, False, self.scan_time, time.time())
+
+    def start_simulation(self, scheduler=None):
+        """Polling runs on the event loop, see `run`"""
+        self.running = True
+
+    def stop_simulation(self):
+        self.running = False
+
+    def configure_scan(self, scan_time: float = None, fast_forward: bool = None,
+                       time_scale: float = None):
+        raise ValueError("Polled devices are paced by their tag classes")
+
+    def start_journal(self, path, checkpoint_interval: int = None):
+        logger.warning(f"Polled device {self.endpoint} cannot be journaled")
+
+    def stop_journal(self):
+        pass
+
+    async def _client(self) -> ModbusClient:
+        """Least busy connection, opening another one when allowed"""
+        live = [client for client in self.clients if client.transport is not None]
+        if len(live) < self.connections and time.monotonic() >= self._retry_at:
+            if self._connecting is None:
+                self._connecting = asyncio.ensure_future(self._connect())
+            try:
+                live.append(await asyncio.shield(self._connecting))
+            except (OSError, asyncio.TimeoutError) as e:
+                if not live:
+                    raise ConnectionError(f"{self.endpoint} unreachable: {e}") from None
+            finally:
+                self._connecting = None
+            self.clients = live
+        if not live:
+            raise ConnectionError(f"{self.endpoint} unreachable")
+        return min(live, key=lambda client: client.in_flight)
+
+    async def _connect(self) -> ModbusClient:
+        try:
+            return await ModbusClient.connect(self.host, self.port, self.pipeline, self.timeout)
+        except Exception:
+            self._retry_at = time.monotonic() + RECONNECT_DELAY
+            raise
+
+    async def _read(self, block: ReadBlock, now: float) -> bool:
+        """Read one block into the image, True if its values changed"""
+        try:
+            client = await self._client()
+            values = await client.read(self.unit_id, block.table, block.start, block.count,
+                                       self.timeout)
+        except (OSError, ModbusError) as e:
+            self.stats.faults += 1
+            block.next_due = now + block.interval
+            logger.debug(f"Reading {block.table} {block.start}+{block.count} "
+                         f"from {self.endpoint} failed: {e}")
+            return False
+        self.image.table(block.table)[block.start:block.start + block.count] = values
+        return block.update(values, now)
+
+    async def poll(self) -> bool:
+        """Run every read that is due, returns whether any value changed"""
+        now = time.monotonic()
+        due = [block for block in self.blocks if block.next_due <= now]
+        if not due:
+            return False
+        # Reads are first due at 0, so the first round is never late
+        lateness = now - min(block.next_due for block in due) if self.stats.scans else 0.0
+        results = await asyncio.gather(*(self._read(block, now) for block in due))
+        changed = any(results)
+        if changed or self.scan_count == 0:
+            self.scan_count += 1
+            self._publish()
+            for observer in self.observers:
+                try:
+                    observer(self.snapshot)
+                except Exception as e:
+                    logger.error(f"Observer of {self.endpoint} failed: {e}")
+        if any(lateness > block.interval for block in due):
+            self.stats.overruns += 1
+        self.stats.record(time.monotonic() - now, lateness)
+        return changed
+
+    async def run(self):
+        """Poll until stopped, writing on a task of its own"""
+        self._writes = asyncio.Queue()
+        self._loop = asyncio.get_running_loop()
+        writer = asyncio.ensure_future(self._write_loop())
+        self.running = True
+        try:
+            while self.running:
+                try:
+                    await self.poll()
+                except Exception as e:
+                    logger.error(f"Error polling {self.endpoint}: {e}")
+                now = time.monotonic()
+                next_due = min((block.next_due for block in self.blocks), default=now + TICK)
+                await asyncio.sleep(min(max(next_due - now, 0.0), TICK))
+        finally:
+            writer.cancel()
+
+    def _check_writable(self, table: str):
+        if table not in ("coils", "holding_registers"):
+            raise KeyError(f"{table} are read-only on a polled device")
+
+    def _submit(self, batch: list):
+        """Send writes to the device in order, from any thread"""
+        if self._loop is None:
+            raise KeyError(f"Polled device {self.endpoint} is not running")
+        self._loop.call_soon_threadsafe(self._writes.put_nowait, batch)
+
+    async def _write_loop(self):
+        """Send queued batches one after the other, so writes never overtake each other"""
+        while True:
+            batch = await self._writes.get()
+            try:
+                await self._write(batch)
+            except Exception as e:
+                logger.error(f"Error writing to {self.endpoint}: {e}")
+
+    async def _write(self, batch: list):
+        try:
+            client = await self._client()
+            for table, start, values in batch:
+                if values is None:
+                    values = ~self.image.table(table)[start:start + 1]
+                limit = MAX_WRITE_BITS if table in BIT_TABLES else MAX_WRITE_REGISTERS
+                for offset in range(0, values.size, limit):
+                    await client.write(self.unit_id, table, start + offset,
+                                       values[offset:offset + limit], self.timeout)
+        except (OSError, ModbusError) as e:
+            logger.error(f"Writing to {self.endpoint} failed: {e}")
+            return
+        # Read back what was written with the next round
+        now = time.monotonic()
+        for table, start, values in batch:
+            end = start + (1 if values is None else values.size)
+            for block in self.blocks:
+                if block.table == table and block.start < end and start < block.start + block.count:
+                    block.next_due = now
+                    block.interval = block.base_interval
+
+    def write(self, table: str, start: int, values):
+        """Write a range of coils or holding registers to the device"""
+        self._check_writable(table)
+        self._submit([prepare_write(self.image, table, start, values)])
+
+    def toggle(self, table: str, address: int):
+        """Invert a coil on the device, from its last polled value"""
+        self._check_writable(table)
+        self._submit([prepare_write(self.image, table, address, None)])
+
+    def write_batch(self, writes):
+        """Send writes to the device in order; unlike a PLC, not atomically"""
+        batch = [prepare_write(self.image, *write) for write in writes]
+        for table, _, _ in batch:
+            try:
+                self._check_writable(table)
+            except KeyError as e:
+                raise ValueError(str(e)) from None
+        if batch:
+            self._submit(batch)
+
+    def describe(self) -> dict:
+        """Polling plan and current rates"""
+        return {
+            "endpoint": self.endpoint,
+            "tags": self.tags,
+            "reads": len(self.blocks),
+            "points_read": sum(block.count for block in self.blocks),
+            "connected": sum(client.transport is not None for client in self.clients),
+            "reads_per_second": round(sum(1.0 / block.interval for block in self.blocks), 1),
+        }
+
+    def close(self):
+        self.running = False
+        for client in self.clients:
+            client.close()
+        self.clients = []
+
+class Poller:
+    """The polled devices of a SCADA front end"""
+
+    def __init__(self):
+        self.devices = {}  # plc id -> PolledDevice
+
+    @classmethod
+    def from_config(cls, config) -> "Poller":
+        """Devices of a config dict or JSON config file"""
+        if not isinstance(config, dict):
+            with open(config, encoding="utf-8") as f:
+                config = json.load(f)
+        poller = cls()
+        classes = config.get("classes")
+        for entry in config.get("devices", []):
+            entry = dict(entry)
+            plc_id = int(entry.pop("id"))
+            if plc_id in poller.devices:
+                raise ValueError(f"Duplicate device id {plc_id}")
+            poller.devices[plc_id] = PolledDevice(plc_id, classes=classes, **entry)
+        return poller
+
+    def attach(self, fleet):
+        """Add every device to a fleet, next to its PLCs"""
+        for plc_id, device in self.devices.items():
+            fleet.add_device(plc_id, device)
+
+    async def run(self):
+        """Poll every device, each on its own task"""
+        await asyncio.gather(*(device.run() for device in self.devices.values()))
+
+    def close(self):
+        for device in self.devices.values():
+            device.close()
@@ -0,0 +1,441 @@
+"""Process models: the simulated plant a PLC controls
+
+A process model is declared as data (JSON) and bound to a PLC image once.
+Loops of the same type form a group whose state is a NumPy array, so every
+group advances all its loops with a handful of array operations per scan,
+however many loops it holds.
+
+Model format::
+
+    {
+      "name": "...",
+      "loops": [
+        {"type": "lag", "count": 1000, "output": "hr:100", "drive": "co:100",
+         "tau": 30, "high": 900, "low": 200},
+        ...
+      ]
+    }
+
+Point keys take either one operand, the first of `count` consecutive points,
+or a list of `count` operands from the same area. Bit inputs are ``co``/``di``
+operands, optionally negated with a leading ``!``; register inputs and
+outputs are ``hr``/``ir`` operands. Parameters are a number or a list with
+one number per loop. `count` defaults to the length of the `output` list, or 1.
+
+Loop types (rates are per second of process time):
+
+- ``ramp``: `output` rises by `rise` while `drive` is on and the optional
+  `interlock` register is above `above`, else falls by `fall`, within
+  `min`..`max`. A ``null`` interlock entry leaves that loop unconditioned.
+- ``lag``: first-order lag of `output` towards `high` while `drive` is on,
+  else towards `low`, with time constant `tau` (thermal loops).
+- ``valve``: position `output` (0..100%) travels towards the `command`
+  register at up to `rate` per second.
+- ``pump``: flow `output` settles within `tau` on the pump curve
+  `q_max * sqrt(1 - head / h_max)` while `drive` is on, else on 0. `head` is
+  an optional register, e.g. a pressure or tank level.
+- ``tank``: level `output` integrates `inflow * inflow_gain` from an optional
+  register minus the outflow `outflow * sqrt(level) * valve / 100` through
+  an optional outlet `valve` register, divided by `area`.
+- ``sensor``: `output` reads `input * gain + offset`, filtered by a lag of
+  `tau` seconds (0: none).
+
+Groups step in order, so a loop sees the outputs of earlier groups from the
+same scan. Loop state is kept in floating point and rounded into the output
+registers; a value written to an output register from outside (Modbus, API)
+becomes the loop's new state.
+"""
+import json
+import pathlib
+import re
+
+import numpy as np
+
+from plc_scada_lab.backend.ladder import IMAGE_AREAS, REGISTER_AREAS
+
+PROCESSES = pathlib.Path(__file__).parent.parent / "processes"
+DEFAULT_PROCESS = PROCESSES / "default.json"
+
+MAX_TIME_SCALE = 1000.0  # Process seconds per second of scan time
+
+_POINT = re.compile(r"^(!?)(co|di|hr|ir):(\d+)$")
+
+class ProcessError(ValueError):
+    """Raised for malformed process models"""
+
+class _Points:
+    """Image addresses bound to one key of a loop group"""
+
+    def __init__(self, spec, count: int, key: str, registers: bool, nullable: bool = False):
+        if isinstance(spec, str):
+            operands = [spec]
+        elif isinstance(spec, list) and len(spec) == count:
+            operands = spec
+        else:
+            raise ProcessError(f"{key!r} needs an operand or a list of {count} operands")
+        areas = set()
+        addresses, negated, unused = [], [], []
+        for operand in operands:
+            if operand is None and nullable:
+                addresses.append(0)
+                negated.append(False)
+                unused.append(True)
+                continue
+            match = _POINT.match(operand.strip()) if isinstance(operand, str) else None
+            if match is None:
+                raise ProcessError(f"Invalid operand for {key!r}: {operand!r}")
+            bang, area, address = match.groups()
+            if (area in REGISTER_AREAS) != registers or (bang and registers):
+                kind = "a register" if registers else "a coil or discrete input"
+                raise ProcessError(f"{key!r} needs {kind}: {operand!r}")
+            areas.add(area)
+            addresses.append(int(address))
+            negated.append(bool(bang))
+            unused.append(False)
+        if len(areas) > 1:
+            raise ProcessError(f"Operands of {key!r} must share one area")
+        if isinstance(spec, str):
+            addresses = list(range(addresses[0], addresses[0] + count))
+            negated = negated * count
+            unused = unused * count
+        self.key = key
+        self.table = IMAGE_AREAS[areas.pop()] if areas else "holding_registers"
+        self.addresses = np.array(addresses, dtype=np.intp)
+        self.negated = np.array(negated) if any(negated) else None
+        self.unused = np.array(unused) if any(unused) else None
+        start = addresses[0]
+        if addresses == list(range(start, start + len(addresses))):
+            self.index = slice(start, start + len(addresses))
+        else:
+            self.index = self.addresses
+
+    def bind(self, image):
+        """Function returning the current values of the points"""
+        if int(self.addresses.max()) >= image.size:
+            raise ProcessError(f"{self.key!r} addresses outside image of {image.size} points")
+        table = image.table(self.table)
+        index = self.index
+        negated = self.negated
+        if negated is not None:
+            return lambda: table[index] ^ negated
+        if isinstance(index, slice):
+            view = table[index]  # Live view, no copy per scan
+            return lambda: view
+        return lambda: table[index]
+
+class _Output:
+    """Loop state and the output registers it is rounded into
+
+    Groups keep their state within 0..65535, so it can be stored without
+    clipping.
+    """
+
+    def __init__(self, points: _Points, image):
+        if points.table not in ("holding_registers", "input_registers"):
+            raise ProcessError("Loop outputs must be registers")
+        points.bind(image)  # Checks the range
+        self.table = image.table(points.table)
+        self.index = points.index
+        current = self.table[self.index]
+        self.state = current.astype(np.float64)
+        self.written = current.tobytes()
+        self._rounded = np.empty_like(self.state)
+
+    def sync(self) -> np.ndarray:
+        """State, taking over values written to the outputs since the last step"""
+        current = self.table[self.index]
+        if current.tobytes() != self.written:
+            changed = current != np.frombuffer(self.written, dtype=current.dtype)
+            self.state[changed] = current[changed]
+        return self.state
+
+    def store(self):
+        table = self.table
+        table[self.index] = np.rint(self.state, out=self._rounded)
+        self.written = table[self.index].tobytes()
+
+    def restore(self, state: np.ndarray):
+        """Set the state, after the image has been restored to match it"""
+        self.state[...] = state
+        self.written = self.table[self.index].tobytes()
+
+class _Group:
+    """Loops of one type, advanced together by a `step(dt)` function per image"""
+
+    kind = None
+    bits = ()          # Keys of bit inputs, required unless in `optional`
+    registers = ()     # Keys of register inputs
+    optional = ()
+    nullable = ()      # Keys whose list entries may be null
+    params = {}        # name -> default, None for required
+    bounded = ()       # Parameters that are register values, 0..65535
+
+    def __init__(self, spec: dict):
+        self.comment = spec.get("comment", "")
+        output = spec.get("output")
+        if output is None:
+            raise ProcessError(f"{self.kind} loop without an output")
+        count = spec.get("count", len(output) if isinstance(output, list) else 1)
+        if not isinstance(count, int) or count < 1:
+            raise ProcessError(f"Invalid loop count: {count!r}")
+        self.count = count
+        self.output = _Points(output, count, "output", True)
+        self.points = {}
+        for key in self.bits + self.registers:
+            if key not in spec:
+                if key not in self.optional:
+                    raise ProcessError(f"{self.kind} loop without {key!r}")
+                continue
+            self.points[key] = _Points(spec[key], count, key, key in self.registers,
+                                       key in self.nullable)
+        for name, default in self.params.items():
+            value = spec.get(name, default)
+            if value is None:
+                raise ProcessError(f"{self.kind} loop without {name!r}")
+            try:
+                value = np.asarray(value, dtype=np.float64)
+            except (TypeError, ValueError):
+                raise ProcessError(f"Invalid {name!r} of {self.kind} loop: {value!r}") from None
+            if value.ndim == 0:
+                value = float(value)
+            elif value.shape != (count,):
+                raise ProcessError(f"{name!r} needs a number or a list of {count} numbers")
+            if name in self.bounded and not np.all((0 <= value) & (value <= 65535)):
+                raise ProcessError(f"{name!r} of {self.kind} loop outside 0..65535")
+            setattr(self, name, value)
+        unknown = set(spec) - {"type", "comment", "count", "output", *self.bits,
+                               *self.registers, *self.params}
+        if unknown:
+            raise ProcessError(f"Unknown keys of {self.kind} loop: {', '.join(sorted(unknown))}")
+
+    def bind(self, image) -> tuple:
+        """`(output, step)` of the group's loops on `image`"""
+        output = _Output(self.output, image)
+        inputs = {key: points.bind(image) for key, points in self.points.items()}
+        return output, self._stepper(output, inputs)
+
+    def _stepper(self, output: _Output, inputs: dict):
+        raise NotImplementedError
+
+class _Smoothing:
+    """`1 - exp(-dt / tau)` per loop, recomputed only when dt changes"""
+
+    def __init__(self, tau):
+        self.tau = np.maximum(tau, 0.0)
+        self.dt = None
+        self.alpha = 1.0
+
+    def __call__(self, dt: float):
+        if dt != self.dt:
+            with np.errstate(divide="ignore"):
+                self.alpha = -np.expm1(-dt / self.tau)
+            self.dt = dt
+        return self.alpha
+
+class Ramp(_Group):
+    kind = "ramp"
+    bits = ("drive",)
+    registers = ("interlock",)
+    optional = ("interlock",)
+    nullable = ("interlock",)
+    params = {"rise": None, "fall": None, "above": 0.0, "min": 0.0, "max": 65535.0}
+    bounded = ("min", "max")
+
+    def _stepper(self, output, inputs):
+        drive = inputs["drive"]
+        interlock = inputs.get("interlock")
+        above = self.above
+        if interlock is not None and self.points["interlock"].unused is not None:
+            # Registers are never negative, so these loops are always permitted
+            above = np.where(self.points["interlock"].unused, -1.0, above)
+        rise, fall = np.asarray(self.rise), np.asarray(self.fall)
+        low, high = self.min, self.max
+        rates = [None, None, None]  # dt, fall per step, rise - fall per step
+
+        def step(dt):
+            state = output.sync()
+            if dt != rates[0]:
+                rates[:] = dt, -fall * dt, (rise + fall) * dt
+            rising = drive()
+            if interlock is not None:
+                rising = rising & (interlock() > above)
+            state += rates[1]
+            state += rising * rates[2]
+            np.maximum(state, low, out=state)
+            np.minimum(state, high, out=state)
+            output.store()
+        return step
+
+class Lag(_Group):
+    kind = "lag"
+    bits = ("drive",)
+    optional = ("drive",)
+    params = {"tau": None, "high": None, "low": 0.0}
+    bounded = ("high", "low")
+
+    def _stepper(self, output, inputs):
+        drive = inputs.get("drive")
+        smoothing = _Smoothing(self.tau)
+        high, low = self.high, self.low
+
+        def step(dt):
+            state = output.sync()
+            target = high if drive is None else np.where(drive(), high, low)
+            state += (target - state) * smoothing(dt)
+            output.store()
+        return step
+
+class Valve(_Group):
+    kind = "valve"
+    registers = ("command",)
+    params = {"rate": None, "min": 0.0, "max": 100.0}
+    bounded = ("min", "max")
+
+    def _stepper(self, output, inputs):
+        command = inputs["command"]
+        rate, low, high = self.rate, self.min, self.max
+
+        def step(dt):
+            state = output.sync()
+            limit = rate * dt
+            state += np.minimum(np.maximum(command() - state, -limit), limit)
+            np.maximum(state, low, out=state)
+            np.minimum(state, high, out=state)
+            output.store()
+        return step
+
+class Pump(_Group):
+    kind = "pump"
+    bits = ("drive",)
+    registers = ("head",)
+    optional = ("head",)
+    params = {"q_max": None, "h_max": 65535.0, "tau": 1.0}
+    bounded = ("q_max",)
+
+    def _stepper(self, output, inputs):
+        drive = inputs["drive"]
+        head = inputs.get("head")
+        smoothing = _Smoothing(self.tau)
+        q_max, h_max = self.q_max, self.h_max
+
+        def step(dt):
+            state = output.sync()
+            flow = q_max
+            if head is not None:
+                flow = q_max * np.sqrt(np.clip(1.0 - head() / h_max, 0.0, 1.0))
+            state += (np.where(drive(), flow, 0.0) - state) * smoothing(dt)
+            output.store()
+        return step
+
+class Tank(_Group):
+    kind = "tank"
+    registers = ("inflow", "valve")
+    optional = ("inflow", "valve")
+    params = {"area": 1.0, "inflow_gain": 1.0, "outflow": 0.0, "min": 0.0, "max": 65535.0}
+    bounded = ("min", "max")
+
+    def _stepper(self, output, inputs):
+        inflow = inputs.get("inflow")
+        valve = inputs.get("valve")
+        gain, outflow, area = self.inflow_gain, self.outflow, self.area
+        low, high = self.min, self.max
+
+        def step(dt):
+            state = output.sync()
+            drain = outflow * np.sqrt(state)
+            if valve is not None:
+                drain = drain * (np.clip(valve(), 0, 100) / 100.0)
+            net = -drain if inflow is None else inflow() * gain - drain
+            state += net * (dt / area)
+            np.maximum(state, low, out=state)
+            np.minimum(state, high, out=state)
+            output.store()
+        return step
+
+class Sensor(_Group):
+    kind = "sensor"
+    registers = ("input",)
+    params = {"gain": 1.0, "offset": 0.0, "tau": 0.0}
+
+    def _stepper(self, output, inputs):
+        source = inputs["input"]
+        gain, offset = self.gain, self.offset
+        scaled = np.any(np.asarray(gain) != 1.0) or np.any(np.asarray(offset) != 0.0)
+        filtered = np.any(np.asarray(self.tau) > 0)
+        smoothing = _Smoothing(self.tau)
+        table, index = output.table, output.index
+
+        def step(dt):
+            if not (scaled or filtered):
+                table[index] = source()  # Plain copy of the input registers
+                return
+            reading = np.clip(source() * gain + offset, 0, 65535)
+            state = output.sync()
+            if filtered:
+                state += (reading - state) * smoothing(dt)
+            else:
+                state[...] = reading
+            output.store()
+        return step
+
+LOOP_TYPES = {group.kind: group for group in (Ramp, Lag, Valve, Pump, Tank, Sensor)}
+
+class ProcessModel:
+    """A process model, parsed once and bound to any number of PLC images"""
+
+    def __init__(self, model: dict):
+        self.definition = model
+        self.name = model.get("name", "unnamed")
+        self.groups = []
+        for i, spec in enumerate(model.get("loops", [])):
+            kind = spec.get("type") if isinstance(spec, dict) else None
+            group = LOOP_TYPES.get(kind)
+            if group is None:
+                raise ProcessError(f"Loop {i}: unknown type {kind!r}")
+            try:
+                self.groups.append(group(spec))
+            except ProcessError as e:
+                raise ProcessError(f"Loop {i}: {e}") from None
+
+    @classmethod
+    def load(cls, path=DEFAULT_PROCESS) -> "ProcessModel":
+        """Load a model from a JSON file"""
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    @property
+    def loops(self) -> int:
+        return sum(group.count for group in self.groups)
+
+    def bind(self, image) -> "BoundProcess":
+        """The plant of `image`, advanced by `dt` seconds per call"""
+        return BoundProcess(self, image)
+
+class BoundProcess:
+    """A process model bound to one image"""
+
+    def __init__(self, model: ProcessModel, image):
+        self.model = model
+        self.outputs = []
+        self.steps = []
+        for group in model.groups:
+            output, step = group.bind(image)
+            self.outputs.append(output)
+            self.steps.append(step)
+
+    def __call__(self, dt: float):
+        for step in self.steps:
+            step(dt)
+
+    def state(self) -> np.ndarray:
+        """Loop state of every group, which the image alone does not hold"""
+        if not self.outputs:
+            return np.zeros(0)
+        return np.concatenate([output.state for output in self.outputs])
+
+    def restore(self, state: np.ndarray):
+        """Restore `state()`, once the image has been restored from the same scan"""
+        offset = 0
+        for output in self.outputs:
+            output.restore(state[offset:offset + output.state.size])
+            offset += output.state.size
@@ -0,0 +1,321 @@
+"""Headless scenario runner for regression tests of PLC programs
+
+A scenario drives a fresh PLCSimulator through timed input and register
+changes and checks coils, registers, markers and tags along the way. Scans
+run back to back in virtual time, without sleeping, and suites run in
+parallel over a process pool, so hours of plant time take seconds.
+
+Scenario format::
+
+    {
+      "name": "Motor seals in",
+      "program": "default.json", "process": "default.json",
+      "size": 64, "scan_time": 0.1, "time_scale": 1.0, "duration": 5,
+      "steps": [
+        {"at": 0, "set": {"di:0": true}},
+        {"at": 0.5, "set": {"di:0": false, "hr:4": 900}},
+        {"at": 1, "expect": {"co:0": true, "motor_running": true, "hr:0": {">": 790}}}
+      ],
+      "invariants": [
+        {"when": ["di:2"], "expect": {"co:0": false}}
+      ]
+    }
+
+Everything but `steps` is optional. `program` and `process` name files in
+`programs/` and `processes/` or hold a definition inline; `"process": null`
+runs without a plant. `set` writes coils, inputs and registers before the
+first scan starting at or after `at` seconds. `expect` checks tag names or
+operands (see `LadderProgram.read`), against a value or ``{op: value}``
+comparisons, after the first scan ending at or after `at`. Invariants are
+checked after every scan, whenever all of their `when` operands are on.
+`duration` defaults to the last step plus one scan.
+
+A scenario with a `fuzz` block stands for `count` generated scenarios, each
+making `changes` random changes over `duration` seconds::
+
+    "fuzz": {"count": 1000, "seed": 1, "duration": 30, "changes": 20,
+             "inputs": ["di:0", "di:1", "di:2", "di:3"],
+             "registers": {"hr:4": [300, 1500]}}
+
+Fuzzed scenarios usually only check invariants. Every scan runs an
+instrumented build of the program that records which rung branches were
+taken (see `LadderProgram.bind`); the report lists those never taken.
+
+Run every scenario file of `scenarios/` with::
+
+    python -m plc_scada_lab.backend.scenarios [files or directories] [--workers N]
+"""
+import argparse
+import concurrent.futures
+import json
+import logging
+import math
+import multiprocessing
+import operator
+import os
+import pathlib
+import sys
+import time
+
+import numpy as np
+
+from plc_scada_lab.backend.ladder import IMAGE_AREAS, PROGRAMS, DEFAULT_PROGRAM, LadderProgram
+from plc_scada_lab.backend.modbus_core import PLCSimulator
+from plc_scada_lab.backend.process import PROCESSES, DEFAULT_PROCESS, ProcessModel
+
+logger = logging.getLogger(__name__)
+
+SCENARIOS = pathlib.Path(__file__).parent.parent / "scenarios"
+MAX_FAILURES = 10   # Failed checks recorded per scenario
+MAX_REPORTED = 20   # Failed scenarios listed in a report
+NO_PROCESS = {"name": "none", "loops": []}
+
+COMPARISONS = {
+    ">": operator.gt, ">=": operator.ge, "<": operator.lt,
+    "<=": operator.le, "==": operator.eq, "!=": operator.ne,
+}
+
+class ScenarioError(ValueError):
+    """Raised for malformed scenarios"""
+
+# Programs and process models of this process, compiled once per definition
+_programs = {}
+_processes = {}
+
+def _program(spec) -> LadderProgram:
+    key = json.dumps(spec, sort_keys=True)
+    if key not in _programs:
+        if spec is None:
+            _programs[key] = LadderProgram.load(DEFAULT_PROGRAM)
+        elif isinstance(spec, dict):
+            _programs[key] = LadderProgram(spec)
+        else:
+            _programs[key] = LadderProgram.load(PROGRAMS / spec)
+    return _programs[key]
+
+def _process(spec) -> ProcessModel:
+    key = json.dumps(spec, sort_keys=True)
+    if key not in _processes:
+        if spec is None:
+            _processes[key] = ProcessModel(NO_PROCESS)
+        elif isinstance(spec, dict):
+            _processes[key] = ProcessModel(spec)
+        else:
+            _processes[key] = ProcessModel.load(PROCESSES / spec)
+    return _processes[key]
+
+def _write(operand: str, value) -> tuple:
+    """`(table, address, [value])` write of a `set` entry"""
+    area, _, address = str(operand).partition(":")
+    if area not in IMAGE_AREAS or not address.isdigit():
+        raise ScenarioError(f"Cannot set {operand!r}, expected e.g. di:0 or hr:4")
+    return IMAGE_AREAS[area], int(address), [value]
+
+def _matches(actual, expected) -> bool:
+    if isinstance(expected, dict):
+        for op, value in expected.items():
+            if op not in COMPARISONS:
+                raise ScenarioError(f"Unknown comparison {op!r}")
+            if not COMPARISONS[op](actual, value):
+                return False
+        return True
+    if isinstance(expected, bool):
+        return bool(actual) == expected
+    return actual == expected
+
+def _value(value):
+    """JSON-friendly value read from the image or memory"""
+    return value.item() if isinstance(value, np.generic) else value
+
+def fuzzed(scenario: dict) -> list:
+    """The scenarios a `fuzz` block stands for"""
+    fuzz = scenario["fuzz"]
+    count = int(fuzz.get("count", 100))
+    seed = int(fuzz.get("seed", 0))
+    duration = float(fuzz.get("duration", 30.0))
+    changes = int(fuzz.get("changes", 20))
+    inputs = list(fuzz.get("inputs", []))
+    registers = dict(fuzz.get("registers", {}))
+    if not inputs and not registers:
+        raise ScenarioError(f"Fuzzing {scenario.get('name')!r} needs inputs or registers")
+    template = {key: value for key, value in scenario.items() if key != "fuzz"}
+    points = inputs + list(registers)
+    result = []
+    for i in range(count):
+        rng = np.random.default_rng([seed, i])
+        times = np.sort(rng.uniform(0.0, duration, changes)).round(3)
+        steps = []
+        for at, point in zip(times.tolist(), rng.integers(0, len(points), changes).tolist()):
+            operand = points[point]
+            if operand in registers:
+                low, high = registers[operand]
+                value = int(rng.integers(low, high + 1))
+            else:
+                value = bool(rng.integers(0, 2))
+            steps.append({"at": at, "set": {operand: value}})
+        result.append({**template, "name": f"{scenario.get('name', 'fuzz')} #{i}",
+                       "seed": [seed, i], "duration": duration, "steps": steps})
+    return result
+
+def load(paths) -> list:
+    """Scenarios of JSON files and directories of them, fuzz blocks expanded
+
+    A file holds one scenario, a list of them or ``{"scenarios": [...]}``.
+    """
+    scenarios = []
+    for path in map(pathlib.Path, paths):
+        files = sorted(path.glob("*.json")) if path.is_dir() else [path]
+        for file in files:
+            with open(file, encoding="utf-8") as f:
+                data = json.load(f)
+            if isinstance(data, dict):
+                data = data.get("scenarios", [data])
+            for scenario in data:
+                if not isinstance(scenario, dict) or not ("steps" in scenario or "fuzz" in scenario):
+                    raise ScenarioError(f"{file}: a scenario needs steps or a fuzz block")
+                scenario.setdefault("name", file.stem)
+                scenarios.extend(fuzzed(scenario) if "fuzz" in scenario else [scenario])
+    return scenarios
+
+def run(scenario: dict) -> dict:
+    """Run one scenario, returns its result
+
+    The result holds `passed`, the first failed checks, the scans run and
+    the branch coverage of the program.
+    """
+    name = scenario.get("name", "unnamed")
+    try:
+        return _run(scenario)
+    except Exception as e:
+        return {"name": name, "passed": False, "error": f"{type(e).__name__}: {e}",
+                "failures": [], "scans": 0, "scan_time": 0.0}
+
+def _run(scenario: dict) -> dict:
+    program = _program(scenario.get("program"))
+    process = _process(scenario.get("process", DEFAULT_PROCESS.name))
+    scan_time = float(scenario.get("scan_time", 0.1))
+    plc = PLCSimulator(int(scenario.get("size", 64)), program, process)
+    plc.configure_scan(scan_time, time_scale=float(scenario.get("time_scale", 1.0)))
+    plc.profile_interval = plc._profile_countdown = 0
+    coverage = np.zeros(len(program.coverage_branches()), dtype=np.uint8)
+    plc._ladder_scan = program.bind(plc.image, plc.memory, coverage=coverage)
+
+    # Steps by scan: writes before scan k, checks after the k-th scan
+    writes, checks = {}, {}
+    last = 0.0
+    for step in scenario.get("steps", []):
+        at = float(step.get("at", 0.0))
+        last = max(last, at)
+        scans = math.ceil(at / scan_time - 1e-9)
+        if "set" in step:
+            writes.setdefault(scans, []).extend(
+                _write(operand, value) for operand, value in step["set"].items())
+        if "expect" in step:
+            checks.setdefault(max(1, scans), []).append((at, step["expect"]))
+    duration = float(scenario.get("duration", last + scan_time))
+    total = max(1, math.ceil(duration / scan_time - 1e-9), max(checks, default=0))
+    invariants = [([str(operand) for operand in invariant.get("when", [])], invariant["expect"])
+                  for invariant in scenario.get("invariants", [])]
+
+    failures = []
+    read = program.read
+    image, memory = plc.image, plc.memory
+
+    def check(at, expect, invariant):
+        for operand, expected in expect.items():
+            actual = _value(read(operand, image, memory))
+            if not _matches(actual, expected) and len(failures) < MAX_FAILURES:
+                failures.append({"at": round(at, 6), "check": operand, "expected": expected,
+                                 "actual": actual, "invariant": invariant})
+
+    for scan in range(total):
+        batch = writes.get(scan)
+        if batch:
+            plc.write_batch(batch)
+        plc.scan_once()
+        now = (scan + 1) * scan_time
+        for at, expect in checks.get(scan + 1, ()):
+            check(at, expect, False)
+        for when, expect in invariants:
+            if all(read(operand, image, memory) for operand in when):
+                check(now, expect, True)
+    return {
+        "name": scenario.get("name", "unnamed"),
+        "passed": not failures,
+        "failures": failures,
+        "scans": total,
+        "scan_time": scan_time,
+        "program": program.name,
+        "coverage": coverage,
+        **({"seed": scenario["seed"]} if "seed" in scenario else {}),
+    }
+
+def run_suite(scenarios: list, workers: int = None) -> dict:
+    """Run scenarios over a pool of `workers` processes, returns the report
+
+    `workers` defaults to one per CPU; 1 runs them in this process.
+    """
+    workers = workers or os.cpu_count() or 1
+    started = time.perf_counter()
+    if workers == 1 or len(scenarios) < 2:
+        results = [run(scenario) for scenario in scenarios]
+    else:
+        context = multiprocessing.get_context("spawn")
+        chunksize = max(1, len(scenarios) // (workers * 8))
+        with concurrent.futures.ProcessPoolExecutor(workers, mp_context=context) as pool:
+            results = list(pool.map(run, scenarios, chunksize=chunksize))
+    elapsed = time.perf_counter() - started
+
+    coverage = {}  # program name -> branches taken by any scenario
+    for result in results:
+        hits = result.pop("coverage", None)
+        if hits is not None:
+            covered = coverage.get(result["program"])
+            coverage[result["program"]] = hits if covered is None else covered | hits
+    failed = [result for result in results if not result["passed"]]
+    real_time = sum(result["scans"] * result["scan_time"] for result in results)
+    report = {
+        "scenarios": len(results),
+        "passed": len(results) - len(failed),
+        "failed": len(failed),
+        "workers": workers,
+        "scans": sum(result["scans"] for result in results),
+        "real_time_s": round(real_time, 1),
+        "wall_time_s": round(elapsed, 3),
+        "speedup": round(real_time / elapsed) if elapsed > 0 else None,
+        "coverage": {},
+        "failures": [{key: value for key, value in result.items() if key != "scan_time"}
+                     for result in failed[:MAX_REPORTED]],
+    }
+    for scenario in scenarios:
+        try:
+            program = _program(scenario.get("program"))
+        except (OSError, ValueError):
+            continue  # Reported as the scenario's error
+        hits = coverage.get(program.name)
+        if hits is None or program.name in report["coverage"]:
+            continue
+        branches = program.coverage_branches()
+        report["coverage"][program.name] = {
+            "branches": len(branches),
+            "covered": int(np.count_nonzero(hits)),
+            "percent": round(100.0 * np.count_nonzero(hits) / max(1, len(branches)), 1),
+            "missed": [branch for branch, hit in zip(branches, hits) if not hit],
+        }
+    return report
+
+def main(args):
+    try:
+        scenarios = load(args.paths or [SCENARIOS])
+    except (OSError, ValueError) as e:
+        print(f"Cannot load scenarios: {e}", file=sys.stderr)
+        sys.exit(2)
+    report = run_suite(scenarios, args.workers)
+    print(json.dumps(report, indent=2))
+    sys.exit(1 if report["failed"] else 0)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run PLC program scenarios faster than real time")
+    parser.add_argument("paths", nargs="*", help="scenario files or directories (default: scenarios/)")
+    parser.add_argument("--workers", type=int, help="worker processes (default: one per CPU)")
+    main(parser.parse_args())
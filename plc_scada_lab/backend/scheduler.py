@@ -0,0 +1,162 @@
+import collections
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+MIN_SCAN_TIME = 0.001  # 1ms
+
+# Phase step for newly added PLCs, as a fraction of their period. The golden
+# ratio spreads any number of PLCs evenly without knowing the count upfront.
+PHASE_STEP = 0.6180339887498949
+
+class ScanStats:
+    """Scan duration and jitter statistics over a sliding window of scans"""
+
+    def __init__(self, window: int = 1024):
+        self.window = window
+        self.durations = np.zeros(window, dtype=np.float64)
+        self.jitter = np.zeros(window, dtype=np.float64)
+        self.reset()
+
+    def reset(self):
+        self.scans = 0
+        self.overruns = 0
+        self.faults = 0
+        self.min_duration = float("inf")
+        self.max_duration = 0.0
+
+    def record(self, duration: float, lateness: float):
+        """Record one scan's execution time and start lateness (seconds)"""
+        i = self.scans % self.window
+        self.durations[i] = duration
+        self.jitter[i] = lateness
+        self.scans += 1
+        if duration < self.min_duration:
+            self.min_duration = duration
+        if duration > self.max_duration:
+            self.max_duration = duration
+
+    def summary(self) -> dict:
+        """Statistics in milliseconds; avg/p99/jitter cover the recent window"""
+        n = min(self.scans, self.window)
+        if n == 0:
+            return {"scans": 0, "overruns": 0, "faults": self.faults}
+        durations = self.durations[:n] * 1000.0
+        jitter = self.jitter[:n] * 1000.0
+        return {
+            "scans": self.scans,
+            "overruns": self.overruns,
+            "faults": self.faults,
+            "min_ms": round(self.min_duration * 1000.0, 4),
+            "avg_ms": round(float(durations.mean()), 4),
+            "max_ms": round(self.max_duration * 1000.0, 4),
+            "p99_ms": round(float(np.percentile(durations, 99)), 4),
+            "jitter_avg_ms": round(float(jitter.mean()), 4),
+            "jitter_max_ms": round(float(jitter.max()), 4),
+            "jitter_p99_ms": round(float(np.percentile(jitter, 99)), 4),
+        }
+
+class ScanScheduler:
+    """Runs PLC scans against absolute monotonic deadlines from one thread
+
+    Each PLC is scheduled at `deadline + scan_time`, so execution time does
+    not stretch the period. A scan that finishes after its next deadline is
+    an overrun: it is counted and the missed periods are skipped rather than
+    replayed back to back. PLCs in fast-forward mode are rescheduled
+    immediately after each scan and run as fast as the CPU allows. The
+    first PLC scans immediately, later ones are phase shifted within their
+    period so a large fleet does not scan in one burst every period.
+
+    Scheduled objects need `running`, `scan_time`, `fast_forward`, `stats`
+    and `scan_once()`.
+    """
+
+    def __init__(self, name: str = "plc-scheduler"):
+        self.name = name
+        self.running = False
+        self._queue = []
+        # PLCs added from other threads, moved into the heap by the scheduler
+        self._pending = collections.deque()
+        self._order = itertools.count()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def add(self, plc):
+        """Schedule a PLC, its first scan is due within one period"""
+        self._pending.append(plc)
+        self.wake()
+
+    def wake(self):
+        """Interrupt the current wait, e.g. after a scan period change"""
+        self._wake.set()
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.running = False
+        self.wake()
+
+    def join(self, timeout: float = None):
+        """Wait for the scheduler thread to exit after `stop`"""
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        """Scheduler loop - earliest deadline first"""
+        queue = self._queue
+        pending = self._pending
+        while self.running:
+            while pending:
+                plc = pending.popleft()
+                order = next(self._order)
+                phase = (order * PHASE_STEP) % 1.0 * plc.scan_time
+                heapq.heappush(queue, (time.monotonic() + phase, order, plc))
+            if not queue:
+                self._wake.wait()
+                self._wake.clear()
+                continue
+            deadline, order, plc = queue[0]
+            if not plc.running:
+                heapq.heappop(queue)
+                continue
+            now = time.monotonic()
+            if deadline > now and not plc.fast_forward:
+                self._wake.wait(deadline - now)
+                self._wake.clear()
+                continue
+            heapq.heappop(queue)
+            self._scan(plc, deadline, now)
+
+    def _scan(self, plc, deadline: float, started: float):
+        stats = plc.stats
+        try:
+            plc.scan_once()
+        except Exception as e:
+            stats.faults += 1
+            if stats.faults <= 10 or stats.faults % 1000 == 0:
+                logger.error(f"Simulation error ({stats.faults} faults): {e}")
+        finished = time.monotonic()
+        stats.record(finished - started, max(0.0, started - deadline))
+
+        if plc.fast_forward:
+            next_deadline = finished
+        else:
+            period = plc.scan_time
+            next_deadline = deadline + period
+            if next_deadline <= finished:
+                # Overrun: skip the periods we missed and keep the phase
+                stats.overruns += 1
+                missed = int((finished - deadline) // period)
+                next_deadline = deadline + (missed + 1) * period
+        heapq.heappush(self._queue, (next_deadline, next(self._order), plc))
@@ -0,0 +1,199 @@
+import bisect
+import collections
+import heapq
+import html
+import math
+import re
+
+TERM = re.compile(r"[a-z0-9]+")
+BM25_K1 = 1.2
+BM25_B = 0.75
+PREFIX_WEIGHT = 0.5   # Score of a prefix match of the last query term
+PHRASE_BOOST = 2.0    # Multiplier for sections holding the query verbatim
+HEADING_WEIGHT = 3    # A heading term counts as this many body terms
+SNIPPET_CHARS = 160
+
+def normalize(word: str) -> str:
+    """Fold plurals so "codes" finds "code" and vice versa"""
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+def tokenize(text: str) -> list:
+    return [normalize(word) for word in TERM.findall(text.lower())]
+
+class Section:
+    """One heading of a lesson and the text up to the next heading"""
+
+    __slots__ = ("lesson", "title", "heading", "anchor", "text", "words", "terms", "length")
+
+    def __init__(self, lesson: str, title: str, heading: str, anchor: str, text: str):
+        self.lesson = lesson
+        self.title = title
+        self.heading = heading
+        self.anchor = anchor
+        self.text = text
+        words = tokenize(text)
+        self.words = f" {' '.join(words)} "  # Normalized text for phrase matches
+        terms = collections.Counter(words)
+        for term in tokenize(heading):
+            terms[term] += HEADING_WEIGHT
+        self.terms = terms
+        self.length = sum(terms.values())
+
+class SearchIndex:
+    """In-memory inverted index over lesson sections, ranked with BM25
+
+    Lessons are replaced as a whole by `update()`, so a changed doc only
+    re-indexes its own sections.
+    """
+
+    def __init__(self):
+        self.postings = {}     # term -> {section id: term frequency}
+        self.sections = {}     # section id -> Section
+        self.by_lesson = {}    # lesson name -> [section id]
+        self.total_length = 0
+        self._next_id = 0
+        self._vocabulary = None  # Sorted terms for prefix lookups, built on demand
+        self._impacts = {}       # term -> {section id: BM25 term weight}, until the next update
+
+    def update(self, lesson: str, title: str, sections: list):
+        """Index a lesson given as (heading, anchor, text) sections"""
+        self.remove(lesson)
+        ids = []
+        for heading, anchor, text in sections:
+            section = Section(lesson, title, heading, anchor, text)
+            section_id = self._next_id
+            self._next_id += 1
+            self.sections[section_id] = section
+            self.total_length += section.length
+            for term, count in section.terms.items():
+                self.postings.setdefault(term, {})[section_id] = count
+            ids.append(section_id)
+        self.by_lesson[lesson] = ids
+        self._invalidate()
+
+    def remove(self, lesson: str):
+        for section_id in self.by_lesson.pop(lesson, ()):
+            section = self.sections.pop(section_id)
+            self.total_length -= section.length
+            for term in section.terms:
+                posting = self.postings[term]
+                del posting[section_id]
+                if not posting:
+                    del self.postings[term]
+        self._invalidate()
+
+    def _invalidate(self):
+        self._vocabulary = None
+        self._impacts = {}
+
+    def _expand(self, prefix: str) -> list:
+        """Indexed terms starting with `prefix`"""
+        if self._vocabulary is None:
+            self._vocabulary = sorted(self.postings)
+        start = bisect.bisect_left(self._vocabulary, prefix)
+        end = bisect.bisect_left(self._vocabulary, prefix + "\x7f")
+        return self._vocabulary[start:end]
+
+    def _impact(self, term: str) -> dict:
+        """BM25 score of `term` per section, cached until the index changes"""
+        impact = self._impacts.get(term)
+        if impact is None:
+            posting = self.postings[term]
+            count = len(self.sections)
+            average = self.total_length / count
+            idf = math.log(1 + (count - len(posting) + 0.5) / (len(posting) + 0.5))
+            sections = self.sections
+            impact = {
+                section_id: idf * tf * (BM25_K1 + 1)
+                / (tf + BM25_K1 * (1 - BM25_B + BM25_B * sections[section_id].length / average))
+                for section_id, tf in posting.items()
+            }
+            self._impacts[term] = impact
+        return impact
+
+    def _score(self, terms: list) -> dict:
+        """BM25 score per section id, requiring every query term to match"""
+        matches = []
+        for i, term in enumerate(terms):
+            weights = {term: 1.0} if term in self.postings else {}
+            if i == len(terms) - 1 and len(term) > 1:
+                for longer in self._expand(term):
+                    weights.setdefault(longer, PREFIX_WEIGHT)
+            if not weights:
+                return {}
+            matches.append(weights)
+        # Start from the rarest term so later terms only look up candidates
+        matches.sort(key=lambda weights: sum(len(self.postings[t]) for t in weights))
+        scores = None
+        for weights in matches:
+            term_scores = {}
+            for matched, weight in weights.items():
+                impact = self._impact(matched)
+                if scores is not None and len(scores) < len(impact):
+                    impact = {s: impact[s] for s in scores if s in impact}
+                for section_id, score in impact.items():
+                    score *= weight
+                    if score > term_scores.get(section_id, 0.0):
+                        term_scores[section_id] = score
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = {s: scores[s] + v for s, v in term_scores.items() if s in scores}
+            if not scores:
+                return {}
+        return scores
+
+    def search(self, query: str, limit: int = 10) -> dict:
+        """Ranked section hits with highlighted snippets"""
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms or not self.sections:
+            return {"query": query, "total": 0, "hits": []}
+        scores = self._score(terms)
+        phrase = f" {' '.join(terms)} "
+        if len(terms) > 1:
+            for section_id in scores:
+                if phrase in self.sections[section_id].words:
+                    scores[section_id] *= PHRASE_BOOST
+        ranked = heapq.nlargest(max(limit, 0), scores.items(), key=lambda item: item[1])
+        pattern = highlight_pattern(terms)
+        hits = []
+        for section_id, score in ranked:
+            section = self.sections[section_id]
+            hits.append({
+                "lesson": section.lesson,
+                "title": section.title,
+                "section": section.heading,
+                "anchor": section.anchor,
+                "score": round(score, 3),
+                "snippet": snippet(section.text, pattern),
+            })
+        return {"query": query, "total": len(scores), "hits": hits}
+
+def highlight_pattern(terms: list) -> re.Pattern:
+    """Regex matching the words of the text that a query's terms stand for"""
+    return re.compile(r"\b(?:" + "|".join(re.escape(t) for t in terms) + r")[a-z0-9]*",
+                      re.IGNORECASE)
+
+def snippet(text: str, pattern: re.Pattern, width: int = SNIPPET_CHARS) -> str:
+    """HTML excerpt of `text` around the first match, matches wrapped in <mark>"""
+    first = pattern.search(text)
+    start = 0
+    if first is not None and first.start() > width // 3:
+        start = text.rfind(" ", 0, first.start() - width // 3) + 1
+    end = len(text)
+    if end - start > width:
+        end = text.find(" ", start + width)
+        end = len(text) if end < 0 else end
+    excerpt = text[start:end]
+    parts = []
+    last = 0
+    for match in pattern.finditer(excerpt):
+        parts.append(html.escape(excerpt[last:match.start()]))
+        parts.append(f"<mark>{html.escape(match.group())}</mark>")
+        last = match.end()
+    parts.append(html.escape(excerpt[last:]))
+    prefix = "…" if start > 0 else ""
+    suffix = "…" if end < len(text) else ""
+    return prefix + "".join(parts) + suffix
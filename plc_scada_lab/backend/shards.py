@@ -0,0 +1,351 @@
+import gc
+import logging
+import multiprocessing
+import os
+import queue
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from plc_scada_lab.backend.fleet import PLCFleet
+from plc_scada_lab.backend.image import ProcessImage
+from plc_scada_lab.backend.modbus_core import (
+    MODBUS_PORT, PLCSimulator, PLCSnapshot, check_scan_config, prepare_write)
+from plc_scada_lab.backend.scheduler import ScanScheduler
+
+logger = logging.getLogger(__name__)
+
+# Scan statistics mirrored into shared memory, in ScanStats.summary() terms
+STATS_FIELDS = ("scans", "overruns", "faults", "min_ms", "avg_ms", "max_ms", "p99_ms",
+                "jitter_avg_ms", "jitter_max_ms", "jitter_p99_ms")
+STATS_INTERVAL = 0.5  # Seconds between statistics updates from a shard
+
+MOTOR_RUNNING = 0x01
+PUMP_RUNNING = 0x02
+
+class ShardMemory:
+    """Views into the shared memory segment of one shard
+
+    Every PLC of the shard owns a slot: the image published at the end of
+    its last scan plus scan count, timestamp, status flags and statistics.
+    Slots are guarded by a seqlock: the worker makes `seq` odd while it
+    publishes and even again when done, and a reader retries if `seq` was
+    odd or changed while it copied. Readers never block the scan.
+    """
+
+    def __init__(self, sizes: list, buffer):
+        offsets, images, _ = self._layout(sizes)
+        n = len(sizes)
+        self.seq = np.ndarray((n,), "<u8", buffer, offsets[0])
+        self.scan_count = np.ndarray((n,), "<u8", buffer, offsets[1])
+        self.timestamp = np.ndarray((n,), "<f8", buffer, offsets[2])
+        self.stats = np.ndarray((n, len(STATS_FIELDS)), "<f8", buffer, offsets[3])
+        self.flags = np.ndarray((n,), "u1", buffer, offsets[4])
+        self.images = [ProcessImage(size, buffer[offset:offset + ProcessImage.buffer_size(size)])
+                       for size, offset in zip(sizes, images)]
+
+    @staticmethod
+    def _layout(sizes: list) -> tuple:
+        n = len(sizes)
+        offsets = []
+        offset = 0
+        for nbytes in (8 * n, 8 * n, 8 * n, 8 * n * len(STATS_FIELDS), n):
+            offsets.append(offset)
+            offset += nbytes
+        images = []
+        for size in sizes:
+            offset = (offset + 7) & ~7
+            images.append(offset)
+            offset += ProcessImage.buffer_size(size)
+        return offsets, images, offset
+
+    @classmethod
+    def nbytes(cls, sizes: list) -> int:
+        """Size of the segment for PLCs with the given image sizes"""
+        return max(cls._layout(sizes)[2], 1)
+
+    def publish(self, slot: int, plc: PLCSimulator):
+        """Copy a PLC's state into its slot (worker side)"""
+        seq = self.seq
+        seq[slot] += 1
+        self.images[slot].buffer[:] = plc.image.buffer
+        self.scan_count[slot] = plc.scan_count
+        self.timestamp[slot] = time.time()
+        self.flags[slot] = (MOTOR_RUNNING if plc.motor_running else 0) | \
+                           (PUMP_RUNNING if plc.pump_running else 0)
+        seq[slot] += 1
+
+    def read(self, slot: int, scan_time: float) -> tuple:
+        """Consistent (seq, PLCSnapshot) of a slot (reader side)"""
+        seq = self.seq
+        while True:
+            before = int(seq[slot])
+            if before & 1:
+                continue  # Publishing, which takes a memcpy
+            image = self.images[slot].copy(readonly=True)
+            scan_count = int(self.scan_count[slot])
+            timestamp = float(self.timestamp[slot])
+            flags = int(self.flags[slot])
+            if int(seq[slot]) == before:
+                return before, PLCSnapshot.build(image, scan_count, bool(flags & MOTOR_RUNNING),
+                                                 bool(flags & PUMP_RUNNING), scan_time, timestamp)
+
+class ShardPLC(PLCSimulator):
+    """PLC running inside a shard worker, publishing into shared memory"""
+
+    def __init__(self, shared: ShardMemory, slot: int, size: int, program, process):
+        self.shared = shared
+        self.slot = slot
+        super().__init__(size, program, process)
+        # Scan profiles would stay in the worker's own metrics registry
+        self.profile_interval = self._profile_countdown = 0
+
+    def _publish(self):
+        self.shared.publish(self.slot, self)
+
+class SharedStats:
+    """Scan statistics of a sharded PLC, as last reported by its worker"""
+
+    def __init__(self, shard: "Shard", slot: int):
+        self.shard = shard
+        self.slot = slot
+
+    def summary(self) -> dict:
+        if self.shard.memory is None:
+            return {"scans": 0, "overruns": 0, "faults": 0}
+        summary = dict(zip(STATS_FIELDS, self.shard.memory.stats[self.slot].tolist()))
+        for field in ("scans", "overruns", "faults"):
+            summary[field] = int(summary[field])
+        if not summary["scans"]:
+            return {"scans": 0, "overruns": 0, "faults": summary["faults"]}
+        return summary
+
+class RemotePLC:
+    """Handle on a PLC that runs in a shard worker process
+
+    Offers the parts of the PLCSimulator interface the API and the Modbus
+    server use. Reads come straight from shared memory; writes, toggles
+    and scan changes are validated here and forwarded to the owning shard,
+    which applies them at the start of the next scan as usual.
+    """
+
+    def __init__(self, plc_id: int, shard: "Shard", slot: int, size: int, program,
+                 scan_time: float, process=None):
+        self.plc_id = plc_id
+        self.shard = shard
+        self.slot = slot
+        self.size = size
+        self.program = program
+        self.process = process
+        self.running = False
+        self.scan_time = scan_time
+        self.fast_forward = False
+        self.time_scale = 1.0
+        self.stats = SharedStats(shard, slot)
+        self._shape = ProcessImage(size)  # Validates writes, never holds state
+        self._seq = None
+        self._snapshot = None
+
+    @property
+    def snapshot(self) -> PLCSnapshot:
+        """State at the end of the latest scan, re-read only after a new scan
+
+        Once the fleet is stopped this stays at the last state read.
+        """
+        memory = self.shard.memory
+        if memory is not None and int(memory.seq[self.slot]) != self._seq:
+            self._seq, self._snapshot = memory.read(self.slot, self.scan_time)
+        return self._snapshot
+
+    @property
+    def scan_count(self) -> int:
+        return self.snapshot.scan_count
+
+    def _send(self, method: str, *args):
+        if self.shard.commands is not None:
+            self.shard.commands.put((self.plc_id, method, args))
+
+    def configure_scan(self, scan_time: float = None, fast_forward: bool = None,
+                       time_scale: float = None):
+        """Change the scan period (seconds, >= 1ms), fast-forward mode and/or time scale"""
+        check_scan_config(scan_time, time_scale)
+        if scan_time is not None:
+            self.scan_time = float(scan_time)
+        if fast_forward is not None:
+            self.fast_forward = bool(fast_forward)
+        if time_scale is not None:
+            self.time_scale = float(time_scale)
+        self._send("configure_scan", scan_time, fast_forward, time_scale)
+
+    def start_journal(self, path, checkpoint_interval: int = None):
+        """Journal the PLC from within its shard worker"""
+        self._send("start_journal", str(path), checkpoint_interval)
+
+    def stop_journal(self):
+        self._send("stop_journal")
+
+    def write(self, table: str, start: int, values):
+        """Queue a range write on the owning shard"""
+        self._send("write", *prepare_write(self._shape, table, start, values))
+
+    def toggle(self, table: str, address: int):
+        """Queue inverting a coil or discrete input on the owning shard"""
+        prepare_write(self._shape, table, address, None)
+        self._send("toggle", table, address)
+
+    def write_batch(self, writes):
+        """Queue writes applied together at the next scan, as one command"""
+        batch = [prepare_write(self._shape, *write) for write in writes]
+        if batch:
+            self._send("write_batch", batch)
+
+class Shard:
+    """One worker process and the PLCs it scans"""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.plcs = []
+        self.memory = None
+        self.segment = None
+        self.commands = None
+        self.process = None
+
+def run_shard(index: int, segment_name: str, specs: list, commands, ready):
+    """Worker process main: scan the shard's PLCs until told to stop
+
+    `specs` holds `(plc_id, size, program, process, scan_time, fast_forward,
+    time_scale)` per
+    slot. Scans run on a scheduler thread; this thread applies commands
+    from the parent and mirrors scan statistics into shared memory.
+    """
+    # Spawned workers share the parent's resource tracker, so attaching
+    # here does not make the segment outlive or die before the parent
+    segment = shared_memory.SharedMemory(name=segment_name)
+    shared = ShardMemory([spec[1] for spec in specs], segment.buf)
+    scheduler = ScanScheduler(f"plc-shard-{index}")
+    plcs = {}
+    for slot, (plc_id, size, program, process, scan_time, fast_forward,
+               time_scale) in enumerate(specs):
+        plc = plcs[plc_id] = ShardPLC(shared, slot, size, program, process)
+        plc.configure_scan(scan_time, fast_forward, time_scale)
+    scheduler.start()
+    for plc in plcs.values():
+        plc.start_simulation(scheduler)
+    ready.set()
+
+    next_stats = time.monotonic()
+    while True:
+        try:
+            command = commands.get(timeout=STATS_INTERVAL)
+        except queue.Empty:
+            command = ()
+        if command is None:
+            break
+        if command:
+            plc_id, method, args = command
+            try:
+                getattr(plcs[plc_id], method)(*args)
+            except Exception as e:
+                logger.error(f"Shard {index}: {method} on PLC {plc_id} failed: {e}")
+        now = time.monotonic()
+        if now >= next_stats:
+            for plc in plcs.values():
+                summary = plc.stats.summary()
+                shared.stats[plc.slot] = [summary.get(field, 0) for field in STATS_FIELDS]
+            next_stats = now + STATS_INTERVAL
+
+    for plc in plcs.values():
+        plc.running = False
+    scheduler.stop()
+    scheduler.join()
+    for plc in plcs.values():
+        plc.stop_journal()
+    # Every view into the segment must be gone before it can be closed
+    del plc, plcs, shared, scheduler
+    gc.collect()
+    segment.close()
+
+class ShardedFleet(PLCFleet):
+    """PLC fleet scanned by a pool of worker processes
+
+    Python ladder logic holds the GIL, so one process tops out at one
+    core. Here PLCs are dealt round-robin to `shards` worker processes,
+    each scanning its share on its own scheduler. Images are published
+    into one shared memory segment per shard, so this process reads state
+    for the API, streaming and Modbus without any IPC round trip; only
+    writes travel to the owning worker, over its command queue.
+    """
+
+    def __init__(self, base_port: int = MODBUS_PORT, shards: int = None):
+        super().__init__(base_port)
+        self.shards = [Shard(i) for i in range(shards or os.cpu_count() or 1)]
+        self.started = False
+
+    def add(self, plc_id: int, unit_id: int = None, port: int = None, size: int = 64,
+            program=None, scan_time: float = 0.1, process=None,
+            time_scale: float = 1.0) -> RemotePLC:
+        """Assign a PLC to a shard; all PLCs must be added before `start`"""
+        if self.started:
+            raise RuntimeError("Cannot add PLCs to a running sharded fleet")
+        plc_id = int(plc_id)
+        port, unit_id = self._address(plc_id, unit_id, port)
+        shard = self.shards[len(self.plcs) % len(self.shards)]
+        plc = RemotePLC(plc_id, shard, len(shard.plcs), size, self._program(program), scan_time,
+                        self._process(process))
+        plc.configure_scan(scan_time, time_scale=time_scale)
+        shard.plcs.append(plc)
+        self.plcs[plc_id] = plc
+        self.addresses[plc_id] = (port, unit_id)
+        return plc
+
+    def start(self, timeout: float = 60.0):
+        """Spawn the workers and wait until every PLC has published once"""
+        context = multiprocessing.get_context("spawn")
+        pending = []
+        for shard in self.shards:
+            if not shard.plcs:
+                continue
+            sizes = [plc.size for plc in shard.plcs]
+            shard.segment = shared_memory.SharedMemory(create=True, size=ShardMemory.nbytes(sizes))
+            shard.memory = ShardMemory(sizes, shard.segment.buf)
+            shard.commands = context.Queue()
+            ready = context.Event()
+            specs = [(plc.plc_id, plc.size, plc.program, plc.process, plc.scan_time,
+                      plc.fast_forward, plc.time_scale) for plc in shard.plcs]
+            shard.process = context.Process(
+                target=run_shard, name=f"plc-shard-{shard.index}", daemon=True,
+                args=(shard.index, shard.segment.name, specs, shard.commands, ready))
+            shard.process.start()
+            pending.append((shard, ready))
+        for shard, ready in pending:
+            if not ready.wait(timeout):
+                raise RuntimeError(f"PLC shard {shard.index} did not start")
+        for plc in self.plcs.values():
+            plc.running = True
+        self.started = True
+        logger.info(f"PLC fleet of {len(self.plcs)} started on {len(pending)} worker processes")
+
+    def stop(self):
+        for shard in self.shards:
+            if shard.process is None:
+                continue
+            shard.commands.put(None)
+            shard.process.join(timeout=5.0)
+            if shard.process.is_alive():
+                shard.process.terminate()
+            shard.process = None
+            shard.commands = None
+        for plc in self.plcs.values():
+            plc.running = False
+        for shard in self.shards:
+            if shard.segment is None:
+                continue
+            shard.memory = None
+            try:
+                shard.segment.close()
+            except BufferError:
+                pass  # A view is still referenced; the mapping goes with the process
+            shard.segment.unlink()
+            shard.segment = None
+        self.started = False
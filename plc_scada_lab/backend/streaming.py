@@ -0,0 +1,554 @@
+import asyncio
+import collections
+import json
+import logging
+import time
+
+import numpy as np
+
+from plc_scada_lab.backend import binary_frames, metrics
+from plc_scada_lab.backend.image import BIT_TABLES, TABLES
+
+logger = logging.getLogger(__name__)
+
+# What a client sees until it subscribes: the first 8 points of every table,
+# the same window `get_plc_state` reports
+DEFAULT_SUBSCRIPTION = {table: [[0, 8]] for table in TABLES}
+STATUS_FIELDS = ("motor_running", "pump_running", "scan_time")
+
+MIN_PUBLISH_INTERVAL = 0.05  # Never stream faster than 20 frames/s
+KEYFRAME_INTERVAL = 5.0
+MAX_SUBSCRIPTION_INTERVAL = 3600.0
+
+_frames_sent = metrics.WS_FRAMES_SENT.labels()
+_delta_seconds = metrics.BROADCAST_SECONDS.labels("delta")
+_broadcast_seconds = metrics.BROADCAST_SECONDS.labels("broadcast")
+
+MAX_QUEUED_FRAMES = 32  # Per client, before state frames are coalesced
+EVICT_AFTER = 10.0      # Seconds a client may stay backed up before eviction
+
+def subscription_key(subscription: dict, size: int) -> tuple:
+    """Validate a subscription and turn it into a hashable, canonical key
+
+    A subscription maps table names to lists of `[start, count]` ranges, or
+    `[start, count, deadband]` for register ranges whose values are only
+    sent once they moved by more than `deadband` from the value last sent.
+    `"interval"` sets the minimum seconds between two deltas. Tables that
+    are not mentioned are not streamed; without any table the default
+    ranges are watched.
+    """
+    if not isinstance(subscription, dict):
+        raise ValueError("Subscription must map table names to ranges")
+    interval = float(subscription.get("interval", 0.0))
+    if not 0.0 <= interval <= MAX_SUBSCRIPTION_INTERVAL:
+        raise ValueError(f"Interval must be between 0 and {MAX_SUBSCRIPTION_INTERVAL:.0f} seconds")
+    if not any(table in subscription for table in TABLES):
+        subscription = {**DEFAULT_SUBSCRIPTION, **subscription}
+    key = []
+    for table in TABLES:
+        ranges = []
+        for entry in subscription.get(table, []):
+            start, count, *rest = entry
+            if len(rest) > 1:
+                raise ValueError(f"Range {entry} must be [start, count] or [start, count, deadband]")
+            start, count = int(start), int(count)
+            deadband = float(rest[0]) if rest else 0.0
+            if start < 0 or count <= 0 or start + count > size:
+                raise ValueError(f"Range {start}+{count} outside {table} of {size} points")
+            if deadband < 0 or (deadband and table in BIT_TABLES):
+                raise ValueError(f"Invalid deadband {deadband} for {table}: registers only, >= 0")
+            ranges.append((start, count, deadband))
+        key.append((table, tuple(sorted(ranges))))
+    return tuple(key), interval
+
+class Delta:
+    """Image changes between two publish ticks, computed once for all clients"""
+
+    def __init__(self, tables: dict, status: dict, current: dict):
+        # table -> (changed addresses, new values)
+        self.tables = tables
+        self.status = status    # Status fields that changed
+        self.current = current  # All status fields
+
+    def __bool__(self):
+        return bool(self.status) or any(idx.size for idx, _ in self.tables.values())
+
+class SubscriptionGroup:
+    """Clients with identical subscriptions share filtering and serialization
+
+    A group serializes either JSON text or binary frames (`binary_frames`);
+    clients of both kinds watching the same ranges are in separate groups.
+
+    Groups without deadbands or an interval forward the streamer's delta.
+    Groups with them compare what they watch against the values they last
+    sent, so a value creeping by less than its deadband per tick is still
+    sent once it moved far enough, and changes held back by the interval go
+    out with the next delta. Keyframes for joining or resyncing clients hold
+    those last sent values, so every member sees the same state.
+    """
+
+    def __init__(self, key: tuple, binary: bool = False):
+        self.key = key
+        self.binary = binary
+        tables, self.interval = key
+        self.ranges = {table: [(start, count) for start, count, _ in ranges]
+                       for table, ranges in tables if ranges}
+        self.clients = set()
+        self.seq = 0
+        # Members get a keyframe when they join, the next one is due later
+        self.last_keyframe = time.monotonic()
+        self.filtered = self.interval > 0 or any(
+            deadband for _, ranges in tables for _, _, deadband in ranges)
+        self.addresses = {}   # table -> sorted watched addresses
+        self.deadbands = {}   # table -> deadband per watched address, None if all 0
+        for table, ranges in tables:
+            if not ranges:
+                continue
+            addresses = np.unique(np.concatenate(
+                [np.arange(start, start + count) for start, count, _ in ranges]))
+            self.addresses[table] = addresses
+            if any(deadband for _, _, deadband in ranges):
+                # Overlapping ranges: the smallest deadband wins
+                deadbands = np.full(addresses.size, np.inf)
+                for start, count, deadband in ranges:
+                    lo, hi = np.searchsorted(addresses, (start, start + count))
+                    np.minimum(deadbands[lo:hi], deadband, out=deadbands[lo:hi])
+                self.deadbands[table] = deadbands
+            else:
+                self.deadbands[table] = None
+        self.sent = None         # table -> values last sent, for filtered groups
+        self.sent_status = None
+        self.dirty = False       # Changes arrived since the last evaluation
+        self.last_sent = 0.0
+
+    def _frame(self, payload: dict, keyframe: bool) -> str:
+        # Keyframes carry the current sequence number without consuming one,
+        # so a keyframe sent to a single client leaves no gap for the others
+        if not keyframe:
+            self.seq += 1
+        payload["seq"] = self.seq
+        payload["keyframe"] = keyframe
+        return json.dumps({"kind": "delta", "payload": payload})
+
+    def _binary_frame(self, kind: int, status: dict, scan: int, blocks: list) -> bytes:
+        if kind == binary_frames.DELTA:
+            self.seq += 1
+        return binary_frames.encode_frame(kind, self.seq, status, scan, blocks)
+
+    def _changes_frame(self, changes: dict, status: dict, current: dict, scan: int):
+        """Serialized delta of `(addresses, values)` per table and changed status"""
+        if not changes and not status:
+            return None
+        if self.binary:
+            blocks = [binary_frames.sparse_block(table, indices, values)
+                      for table, (indices, values) in changes.items()]
+            return self._binary_frame(binary_frames.DELTA, current, scan, blocks)
+        payload = {table: dict(zip(map(str, indices.tolist()), values.tolist()))
+                   for table, (indices, values) in changes.items()}
+        payload.update(status)
+        payload["scan"] = scan
+        return self._frame(payload, False)
+
+    def delta_frame(self, delta: Delta, scan: int):
+        """Serialized delta for this group, or None if nothing it watches changed"""
+        changes = {}
+        for table, ranges in self.ranges.items():
+            indices, values = delta.tables[table]
+            if not indices.size:
+                continue
+            mask = np.zeros(indices.size, dtype=np.bool_)
+            for start, count in ranges:
+                mask |= (indices >= start) & (indices < start + count)
+            if mask.any():
+                changes[table] = (indices[mask], values[mask])
+        return self._changes_frame(changes, delta.status, delta.current, scan)
+
+    def rebase(self, image, status: dict):
+        """Take the current state as sent, after a keyframe to every member"""
+        if self.filtered:
+            self.sent = {table: image.table(table)[addresses]
+                         for table, addresses in self.addresses.items()}
+            self.sent_status = dict(status)
+            self.dirty = False
+
+    def filtered_frame(self, image, status: dict, scan: int, now: float):
+        """Serialized delta of a filtered group, or None if nothing is due
+
+        Sends what moved beyond its deadband since it was last sent, at most
+        once per `interval`.
+        """
+        if not self.dirty or now - self.last_sent < self.interval:
+            return None
+        self.dirty = False
+        changes = {}
+        for table, addresses in self.addresses.items():
+            current = image.table(table)[addresses]
+            sent = self.sent[table]
+            deadbands = self.deadbands[table]
+            if deadbands is None:
+                mask = current != sent
+            else:
+                mask = np.abs(current.astype(np.int32) - sent) > deadbands
+            if mask.any():
+                changes[table] = (addresses[mask], current[mask])
+                sent[mask] = current[mask]
+        changed = {k: v for k, v in status.items() if self.sent_status.get(k) != v}
+        self.sent_status = dict(status)
+        frame = self._changes_frame(changes, changed, status, scan)
+        if frame is not None:
+            self.last_sent = now
+        return frame
+
+    def keyframe(self, image, status: dict, scan: int):
+        """Serialized full snapshot of everything this group watches
+
+        Filtered groups describe the state last sent to their members
+        rather than the live image; see `rebase()`.
+        """
+        if self.sent is not None:
+            sent = self.sent
+            status = self.sent_status
+
+            def data(table, start, count):
+                offset = int(np.searchsorted(self.addresses[table], start))
+                return sent[table][offset:offset + count]
+        else:
+            def data(table, start, count):
+                return image.table(table)[start:start + count]
+        if self.binary:
+            blocks = [binary_frames.range_block(table, start, data(table, start, count))
+                      for table, ranges in self.ranges.items() for start, count in ranges]
+            return self._binary_frame(binary_frames.KEYFRAME, status, scan, blocks)
+        payload = {}
+        for table, ranges in self.ranges.items():
+            values = {}
+            for start, count in ranges:
+                values.update(zip(map(str, range(start, start + count)),
+                                  data(table, start, count).tolist()))
+            payload[table] = values
+        payload.update(status)
+        payload["scan"] = scan
+        return self._frame(payload, True)
+
+class ClientConnection:
+    """One WebSocket client with its own bounded outbound queue and writer task
+
+    Sending only enqueues, so producers never wait on a slow socket. State
+    frames are droppable: when the queue is full they are discarded and
+    replaced by a single fresh keyframe generated when the writer gets to
+    it, so a slow client always receives the newest state instead of a
+    backlog. Other messages (lessons, errors) are never dropped. A client
+    that stays backed up for `evict_after` seconds is disconnected.
+    """
+
+    def __init__(self, websocket, manager, max_queue: int = MAX_QUEUED_FRAMES,
+                 evict_after: float = EVICT_AFTER, binary: bool = False):
+        self.websocket = websocket
+        self.manager = manager
+        self.max_queue = max_queue
+        self.evict_after = evict_after
+        self.frames = collections.deque()  # (text or bytes, droppable)
+        self.binary = binary  # State frames use the binary subprotocol
+        self.streamer = None  # StateStreamer of the PLC this client watches
+        self.needs_keyframe = False
+        self.backlogged_since = None
+        self.closed = False
+        self._ready = asyncio.Event()
+        self._writer = asyncio.create_task(self._write_loop())
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self.frames)
+
+    def send(self, text, droppable: bool = False):
+        """Queue a text (str) or binary (bytes) frame for this client without blocking"""
+        if self.closed:
+            return
+        full = len(self.frames) >= self.max_queue
+        # Still backed up while the keyframe replacing dropped frames is unsent
+        if full or self.needs_keyframe:
+            now = time.monotonic()
+            if self.backlogged_since is None:
+                self.backlogged_since = now
+            elif now - self.backlogged_since > self.evict_after:
+                logger.warning("Evicting WebSocket client that stayed backed up "
+                               f"for {self.evict_after:.0f}s")
+                metrics.WS_EVICTIONS.inc()
+                self.manager.disconnect(self.websocket)
+                return
+        if full:
+            # Coalesce: drop unsent state frames, a keyframe will replace them
+            queued = len(self.frames)
+            self.frames = collections.deque(f for f in self.frames if not f[1])
+            metrics.WS_FRAMES_DROPPED.inc(queued - len(self.frames))
+            self.needs_keyframe = True
+        if droppable and self.needs_keyframe:
+            return  # Superseded by the pending keyframe
+        self.frames.append((text, droppable))
+        self._ready.set()
+
+    async def _write_loop(self):
+        websocket = self.websocket
+        try:
+            while True:
+                await self._ready.wait()
+                self._ready.clear()
+                while self.frames or self.needs_keyframe:
+                    if self.needs_keyframe and not any(not d for _, d in self.frames):
+                        self.needs_keyframe = False
+                        text = self.manager.keyframe(websocket)
+                        if text is None:
+                            continue
+                    else:
+                        text, _ = self.frames.popleft()
+                    if isinstance(text, bytes):
+                        await websocket.send_bytes(text)
+                    else:
+                        await websocket.send_text(text)
+                    _frames_sent.inc()
+                self.backlogged_since = None
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            metrics.WS_SEND_FAILURES.inc()
+            self.manager.disconnect(websocket)
+
+    def close(self):
+        """Stop the writer and close the socket in the background"""
+        if self.closed:
+            return
+        self.closed = True
+        self._writer.cancel()
+        self.frames.clear()
+        asyncio.create_task(self._close_socket())
+
+    async def _close_socket(self):
+        try:
+            await asyncio.wait_for(self.websocket.close(), timeout=1.0)
+        except Exception:
+            pass
+
+class ConnectionManager:
+    """Manage WebSocket connections"""
+
+    def __init__(self, max_queue: int = MAX_QUEUED_FRAMES, evict_after: float = EVICT_AFTER):
+        self.active_connections = {}  # websocket -> ClientConnection
+        self.max_queue = max_queue
+        self.evict_after = evict_after
+
+    async def connect(self, websocket):
+        """Accept a client, agreeing on binary state frames if it offers them"""
+        binary = binary_frames.SUBPROTOCOL in websocket.scope.get("subprotocols", ())
+        await websocket.accept(subprotocol=binary_frames.SUBPROTOCOL if binary else None)
+        self.active_connections[websocket] = ClientConnection(
+            websocket, self, self.max_queue, self.evict_after, binary)
+        logger.info(f"Client connected. Total connections: {len(self.active_connections)}")
+
+    def is_binary(self, websocket) -> bool:
+        """Whether a client negotiated binary state frames"""
+        connection = self.active_connections.get(websocket)
+        return connection is not None and connection.binary
+
+    def disconnect(self, websocket):
+        connection = self.active_connections.pop(websocket, None)
+        if connection is None:
+            return
+        connection.close()
+        if connection.streamer is not None:
+            connection.streamer.unsubscribe(websocket)
+        logger.info(f"Client disconnected. Total connections: {len(self.active_connections)}")
+
+    def attach(self, websocket, streamer):
+        """Stream a client's state from `streamer`, leaving its previous one"""
+        connection = self.active_connections.get(websocket)
+        if connection is None:
+            return
+        if connection.streamer is not None and connection.streamer is not streamer:
+            connection.streamer.unsubscribe(websocket)
+        connection.streamer = streamer
+
+    def keyframe(self, websocket):
+        """Fresh keyframe for a client whose state frames were coalesced"""
+        connection = self.active_connections.get(websocket)
+        if connection is None or connection.streamer is None:
+            return None
+        return connection.streamer.keyframe_frame(websocket)
+
+    def send(self, websocket, message_str, droppable: bool = False):
+        """Queue a serialized message (str or bytes) for one client"""
+        connection = self.active_connections.get(websocket)
+        if connection is not None:
+            connection.send(message_str, droppable)
+
+    def send_json(self, websocket, message: dict):
+        """Queue a message for one client"""
+        self.send(websocket, json.dumps(message))
+
+    def send_state(self, websocket, message_str):
+        """Queue a state frame, which may be coalesced if the client lags"""
+        self.send(websocket, message_str, droppable=True)
+
+    def broadcast(self, message: dict):
+        """Queue a state message for all connected clients, serialized once"""
+        if self.active_connections:
+            started = time.perf_counter()
+            message_str = json.dumps(message)
+            for websocket in list(self.active_connections):
+                self.send_state(websocket, message_str)
+            _broadcast_seconds.observe(time.perf_counter() - started)
+
+    def queue_depths(self) -> list:
+        """`((client,), queued frames)` per connection, for the metrics endpoint"""
+        result = []
+        for websocket, connection in list(self.active_connections.items()):
+            client = websocket.client
+            name = f"{client.host}:{client.port}" if client else str(id(websocket))
+            result.append(((name,), connection.queue_depth))
+        return result
+
+class StateStreamer:
+    """Change-driven state streaming to WebSocket clients
+
+    Once per publish tick the latest scan snapshot is diffed against the
+    one published at the previous tick,
+    the delta is filtered and serialized once per subscription group and
+    sent only to groups that watch a changed address. Every group gets a
+    keyframe (a full snapshot of its subscription) periodically and on
+    request, so clients can resync after a gap in `seq`.
+    """
+
+    def __init__(self, plc, send, keyframe_interval: float = KEYFRAME_INTERVAL):
+        self.plc = plc
+        self.send = send  # send(websocket, text or bytes), must not block
+        self.keyframe_interval = keyframe_interval
+        self.groups = {}
+        self.client_groups = {}
+        self._previous = plc.snapshot
+        self._previous_status = self._status(self._previous)
+
+    @staticmethod
+    def _status(snapshot) -> dict:
+        return {field: getattr(snapshot, field) for field in STATUS_FIELDS}
+
+    def subscribe(self, websocket, subscription: dict = None, binary: bool = False):
+        """Set a client's subscription, returns the group it joined
+
+        `binary` clients get state frames in the `binary_frames` format.
+        """
+        snapshot = self.plc.snapshot
+        key = subscription_key(subscription or DEFAULT_SUBSCRIPTION, snapshot.image.size)
+        self.unsubscribe(websocket)
+        group = self.groups.get((key, binary))
+        if group is None:
+            group = self.groups[key, binary] = SubscriptionGroup(key, binary)
+            group.rebase(snapshot.image, self._status(snapshot))
+        group.clients.add(websocket)
+        self.client_groups[websocket] = group
+        return group
+
+    def unsubscribe(self, websocket):
+        group = self.client_groups.pop(websocket, None)
+        if group is not None:
+            group.clients.discard(websocket)
+            if not group.clients:
+                del self.groups[group.key, group.binary]
+
+    def keyframe_frame(self, websocket):
+        """Serialized snapshot of a client's subscription, or None"""
+        group = self.client_groups.get(websocket)
+        if group is None:
+            return None
+        snapshot = self.plc.snapshot
+        return group.keyframe(snapshot.image, self._status(snapshot), snapshot.scan_count)
+
+    def send_keyframe(self, websocket):
+        """Send a client a fresh snapshot of its subscription"""
+        frame = self.keyframe_frame(websocket)
+        if frame is not None:
+            self.send(websocket, frame)
+
+    def _diff(self, snapshot) -> Delta:
+        tables = {}
+        for table in TABLES:
+            current = snapshot.image.table(table)
+            indices = np.flatnonzero(current != self._previous.image.table(table))
+            tables[table] = (indices, current[indices])
+        status = self._status(snapshot)
+        changed = {k: v for k, v in status.items() if self._previous_status.get(k) != v}
+        self._previous = snapshot
+        self._previous_status = status
+        return Delta(tables, changed, status)
+
+    def publish(self):
+        """Diff the latest snapshot once and queue changes for interested clients"""
+        snapshot = self.plc.snapshot
+        if not self.groups:
+            # Nobody is watching, just move the baseline along
+            if snapshot is not self._previous:
+                self._previous = snapshot
+                self._previous_status = self._status(snapshot)
+            return
+        if snapshot is self._previous:
+            delta = None  # No scan since the last tick
+        else:
+            delta = self._diff(snapshot)
+        now = time.monotonic()
+        scan = snapshot.scan_count
+        status = None
+        for group in list(self.groups.values()):
+            if now - group.last_keyframe >= self.keyframe_interval:
+                status = status or self._status(snapshot)
+                group.rebase(snapshot.image, status)
+                frame = group.keyframe(snapshot.image, status, scan)
+                group.last_keyframe = now
+            elif group.filtered:
+                group.dirty = group.dirty or bool(delta)
+                status = status or self._status(snapshot)
+                frame = group.filtered_frame(snapshot.image, status, scan, now)
+            elif delta:
+                frame = group.delta_frame(delta, scan)
+            else:
+                frame = None
+            if frame is not None:
+                for websocket in list(group.clients):
+                    self.send(websocket, frame)
+
+class FleetStreamer:
+    """State streaming for a fleet of PLCs from a single publish loop
+
+    A `StateStreamer` is created per PLC the first time a client watches
+    it. One loop ticks all of them, and PLCs nobody watches cost a
+    reference comparison per tick.
+    """
+
+    def __init__(self, fleet, send, keyframe_interval: float = KEYFRAME_INTERVAL):
+        self.fleet = fleet
+        self.send = send
+        self.keyframe_interval = keyframe_interval
+        self.streamers = {}  # plc id -> StateStreamer
+
+    def streamer(self, plc_id: int = None) -> StateStreamer:
+        """Streamer for a PLC, the default one if None; KeyError if unknown"""
+        plc_id = self.fleet.resolve(plc_id)
+        streamer = self.streamers.get(plc_id)
+        if streamer is None:
+            streamer = self.streamers[plc_id] = StateStreamer(
+                self.fleet.plcs[plc_id], self.send, self.keyframe_interval)
+        return streamer
+
+    def publish(self):
+        if not self.streamers:
+            return
+        started = time.perf_counter()
+        for streamer in list(self.streamers.values()):
+            streamer.publish()
+        _delta_seconds.observe(time.perf_counter() - started)
+
+    async def run(self):
+        """Publish loop for every PLC, ticking at MIN_PUBLISH_INTERVAL"""
+        while True:
+            try:
+                self.publish()
+            except Exception as e:
+                logger.error(f"Error streaming state: {e}")
+            await asyncio.sleep(MIN_PUBLISH_INTERVAL)
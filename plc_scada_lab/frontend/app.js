@@ -1,12 +1,57 @@
 // PLC SCADA Lab Frontend Application
+
+// Binary state frames, see backend/binary_frames.py for the layout
+const BINARY_SUBPROTOCOL = 'plc-scada.binary.v1';
+const FRAME_TABLES = ['coils', 'discrete_inputs', 'holding_registers', 'input_registers'];
+const FRAME_HEADER_SIZE = 26;
+const FRAME_BLOCK_SIZE = 10;
+
+function decodeBinaryFrame(buffer) {
+    // Returns the same shape as a JSON delta payload
+    const view = new DataView(buffer);
+    const flags = view.getUint8(2);
+    const delta = {
+        keyframe: view.getUint8(1) === 2,
+        seq: view.getUint32(4, true),
+        scan: Number(view.getBigUint64(8, true)),
+        scan_time: view.getFloat64(16, true),
+        motor_running: (flags & 1) !== 0,
+        pump_running: (flags & 2) !== 0
+    };
+    const blocks = view.getUint16(24, true);
+    let offset = FRAME_HEADER_SIZE;
+    for (let b = 0; b < blocks; b++) {
+        const tableId = view.getUint8(offset);
+        const sparse = view.getUint8(offset + 1) === 1;
+        const start = view.getUint32(offset + 2, true);
+        const count = view.getUint32(offset + 6, true);
+        offset += FRAME_BLOCK_SIZE;
+        const addresses = offset;
+        if (sparse) offset += 2 * count;
+        const table = FRAME_TABLES[tableId];
+        const values = delta[table] || (delta[table] = {});
+        for (let i = 0; i < count; i++) {
+            const address = sparse ? view.getUint16(addresses + 2 * i, true) : start + i;
+            values[address] = tableId < 2
+                ? (view.getUint8(offset + (i >> 3)) >> (i & 7) & 1) === 1
+                : view.getUint16(offset + 2 * i, true);
+        }
+        offset += tableId < 2 ? (count + 7) >> 3 : 2 * count;
+    }
+    return delta;
+}
 class PLCSCADAApp {
     constructor() {
         this.ws = null;
-        this.md = window.markdownit();
         this.reconnectAttempts = 0;
         this.maxReconnectAttempts = 5;
         this.reconnectDelay = 2000;
         this.currentLesson = null;
+        this.pendingAnchor = null;
+        this.searchTimer = null;
+        this.plcState = {};
+        this.deltaSeq = null;
+        this.resyncPending = false;
         
         this.init();
     }
@@ -19,10 +64,14 @@ class PLCSCADAApp {
     
     setupWebSocket() {
         const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
-        const wsUrl = `${protocol}//${window.location.host}/ws`;
+        // Open the page as /?plc=<id> to watch another PLC of the fleet
+        const plc = new URLSearchParams(window.location.search).get('plc');
+        const wsUrl = `${protocol}//${window.location.host}/ws` + (plc ? `?plc=${encodeURIComponent(plc)}` : '');
         
         try {
-            this.ws = new WebSocket(wsUrl);
+            // Offer binary state frames; servers without them fall back to JSON
+            this.ws = new WebSocket(wsUrl, [BINARY_SUBPROTOCOL]);
+            this.ws.binaryType = 'arraybuffer';
             this.setupWebSocketHandlers();
         } catch (error) {
             console.error('WebSocket connection failed:', error);
@@ -39,6 +88,10 @@ class PLCSCADAApp {
         
         this.ws.onmessage = (event) => {
             try {
+                if (event.data instanceof ArrayBuffer) {
+                    this.applyDelta(decodeBinaryFrame(event.data));
+                    return;
+                }
                 const message = JSON.parse(event.data);
                 this.handleMessage(message);
             } catch (error) {
@@ -66,8 +119,15 @@ class PLCSCADAApp {
             case 'lesson':
                 this.renderLesson(message.payload);
                 break;
+            case 'search':
+                this.renderSearchResults(message.payload);
+                break;
             case 'state':
-                this.updatePLCState(message.payload);
+                this.plcState = message.payload;
+                this.updatePLCState(this.plcState);
+                break;
+            case 'delta':
+                this.applyDelta(message.payload);
                 break;
             case 'error':
                 this.showError(message.payload);
@@ -120,6 +180,15 @@ class PLCSCADAApp {
     }
     
     setupEventListeners() {
+        // Lesson search, sent once typing pauses
+        const searchInput = document.getElementById('lessonSearch');
+        if (searchInput) {
+            searchInput.addEventListener('input', () => {
+                clearTimeout(this.searchTimer);
+                this.searchTimer = setTimeout(() => this.searchLessons(searchInput.value), 150);
+            });
+        }
+        
         // Digital input buttons
         document.querySelectorAll('[data-input]').forEach(button => {
             button.addEventListener('click', (e) => {
@@ -178,9 +247,48 @@ class PLCSCADAApp {
             .replace(/(\d+)\s+/, '$1 - ');
     }
     
-    loadLesson(lessonName) {
+    searchLessons(query) {
+        if (!query.trim()) {
+            this.renderSearchResults({ hits: [] });
+            return;
+        }
+        if (this.ws && this.ws.readyState === WebSocket.OPEN) {
+            this.ws.send(JSON.stringify({
+                kind: 'search',
+                payload: query
+            }));
+        }
+    }
+    
+    renderSearchResults(result) {
+        const resultsElement = document.getElementById('searchResults');
+        if (!resultsElement) return;
+        
+        const input = document.getElementById('lessonSearch');
+        if (result.query !== undefined && input && input.value !== result.query) return;  // stale answer
+        
+        resultsElement.replaceChildren(...result.hits.map(hit => {
+            const item = document.createElement('button');
+            item.className = 'search-hit';
+            const heading = document.createElement('strong');
+            heading.textContent = hit.section || hit.title;
+            const lesson = document.createElement('small');
+            lesson.textContent = this.formatLessonName(hit.lesson);
+            const snippet = document.createElement('p');
+            snippet.innerHTML = hit.snippet;  // escaped by the server, with <mark> highlights
+            item.append(heading, lesson, snippet);
+            item.addEventListener('click', () => this.loadLesson(hit.lesson, hit.anchor));
+            return item;
+        }));
+        if (result.query && !result.hits.length) {
+            resultsElement.textContent = 'No matches';
+        }
+    }
+    
+    loadLesson(lessonName, anchor = null) {
         if (this.ws && this.ws.readyState === WebSocket.OPEN) {
             this.currentLesson = lessonName;
+            this.pendingAnchor = anchor;
             this.ws.send(JSON.stringify({
                 kind: 'lesson',
                 payload: lessonName
@@ -188,15 +296,28 @@ class PLCSCADAApp {
         }
     }
     
-    renderLesson(content) {
+    renderLesson(lesson) {
         const lessonElement = document.getElementById('lesson');
         if (!lessonElement) return;
         
-        lessonElement.innerHTML = this.md.render(content);
+        // Lessons arrive rendered by the server; plain text if only Markdown came
+        if (lesson.html !== undefined) {
+            lessonElement.innerHTML = lesson.html;
+        } else {
+            const pre = document.createElement('pre');
+            pre.textContent = lesson.content;
+            lessonElement.replaceChildren(pre);
+        }
         lessonElement.classList.add('fade-in');
         
-        // Scroll to top of lesson
-        lessonElement.scrollTop = 0;
+        // Scroll to the searched section, or the top of the lesson
+        const target = this.pendingAnchor && document.getElementById(this.pendingAnchor);
+        this.pendingAnchor = null;
+        if (target) {
+            target.scrollIntoView({ behavior: 'smooth' });
+        } else {
+            lessonElement.scrollTop = 0;
+        }
     }
     
     updatePLCState(state) {
@@ -281,6 +402,32 @@ class PLCSCADAApp {
         }
     }
     
+    applyDelta(delta) {
+        // Deltas must arrive in sequence; after a gap wait for a keyframe
+        if (!delta.keyframe && delta.seq !== this.deltaSeq + 1) {
+            if (!this.resyncPending && this.ws && this.ws.readyState === WebSocket.OPEN) {
+                this.resyncPending = true;
+                this.ws.send(JSON.stringify({ kind: 'resync' }));
+            }
+            return;
+        }
+        this.deltaSeq = delta.seq;
+        this.resyncPending = false;
+        
+        ['coils', 'discrete_inputs', 'holding_registers', 'input_registers'].forEach(table => {
+            if (!delta[table]) return;
+            const values = this.plcState[table] || (this.plcState[table] = []);
+            Object.entries(delta[table]).forEach(([address, value]) => {
+                values[address] = value;
+            });
+        });
+        ['motor_running', 'pump_running', 'scan_time'].forEach(field => {
+            if (field in delta) this.plcState[field] = delta[field];
+        });
+        
+        this.updatePLCState(this.plcState);
+    }
+    
     toggleDigitalInput(address) {
         if (this.ws && this.ws.readyState === WebSocket.OPEN) {
             this.ws.send(JSON.stringify({
@@ -12,19 +12,29 @@ logger = logging.getLogger(__name__)
 def main():
     """Main application entry point"""
     try:
-        # Import the FastAPI app
-        from plc_scada_lab.backend.api import app
+        # Check the app imports; each worker builds its own with create_app()
+        from plc_scada_lab.backend.api import AppConfig, create_app
         
-        # Get port from environment or default to 8000
+        # Get port and worker processes from environment or default to 8000 and 1
         port = int(os.getenv("PORT", "8000"))
+        workers = int(os.getenv("WORKERS", "1"))
+        
+        # Each worker would run its own PLCs, so clients of different workers
+        # would see different plants; workers only make sense without them
+        if workers > 1 and AppConfig.from_env().simulator:
+            logger.error(f"WORKERS={workers} needs APP_DISABLE=simulator: the PLC simulator, "
+                         "its Modbus servers, historian, alarms and checkpoints run in one process")
+            sys.exit(1)
         
         logger.info(f"Starting PLC SCADA Lab on port {port}")
         
         # Start the server
         uvicorn.run(
-            app,
+            "plc_scada_lab.backend.api:create_app",
+            factory=True,
             host="0.0.0.0",
             port=port,
+            workers=workers,
             log_level="info",
             access_log=True
         )
@@ -0,0 +1,131 @@
+"""Regression tests of the backend paths the scenario suite does not cover
+
+Run from the repository root with `python -m pytest`.
+"""
+import asyncio
+import socket
+
+import numpy as np
+from pymodbus.client import AsyncModbusTcpClient
+from pymodbus.datastore import ModbusServerContext
+
+from plc_scada_lab.backend import modbus_core
+from plc_scada_lab.backend.checkpoint import SLOT, CheckpointFile, FleetCheckpoints, fingerprint
+from plc_scada_lab.backend.journal import Replay
+from plc_scada_lab.backend.modbus_core import PLCSimulator, PLCSlaveContext
+from plc_scada_lab.backend.poller import plan_reads
+
+ILLEGAL_ADDRESS = 2
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def drive(plc: PLCSimulator, scans: int, seed: int = 0):
+    """Scan a PLC that is not running, with random operator writes in between"""
+    rng = np.random.default_rng(seed)
+    for _ in range(scans):
+        if rng.random() < 0.2:
+            plc.toggle("discrete_inputs", int(rng.integers(0, 4)))
+        if rng.random() < 0.1:
+            plc.write("holding_registers", 4, [int(rng.integers(600, 1000))])
+        plc.scan_once()
+
+def test_modbus_round_trip():
+    plc = PLCSimulator()
+    context = ModbusServerContext(slaves=PLCSlaveContext(plc), single=True)
+    port = free_port()
+
+    async def session():
+        server = asyncio.ensure_future(modbus_core.serve_modbus(context, host="127.0.0.1", port=port))
+        client = AsyncModbusTcpClient("127.0.0.1", port=port)
+        for _ in range(100):
+            if await client.connect():
+                break
+            await asyncio.sleep(0.05)
+        try:
+            # FC5/FC6 echo the written value although the scan applying it is still to come
+            response = await client.write_register(20, 1234)
+            assert not response.isError() and response.value == 1234
+            response = await client.write_coil(20, True)
+            assert not response.isError() and response.value is True
+            assert (await client.read_holding_registers(20, 1)).registers == [0]
+            plc.scan_once()
+            assert (await client.read_holding_registers(20, 1)).registers == [1234]
+            assert (await client.read_coils(20, 1)).bits[0] is True
+
+            # FC15/FC16 and the read-only tables
+            assert not (await client.write_registers(30, [1, 2, 3])).isError()
+            assert not (await client.write_coils(30, [True, False, True])).isError()
+            plc.scan_once()
+            assert (await client.read_holding_registers(30, 3)).registers == [1, 2, 3]
+            assert (await client.read_coils(30, 3)).bits[:3] == [True, False, True]
+            assert not (await client.read_discrete_inputs(0, 8)).isError()
+            assert (await client.read_input_registers(0, 1)).registers == [int(plc.input_registers[0])]
+
+            # Ranges outside the image are refused with an exception response
+            for response in (await client.read_holding_registers(60, 10),
+                             await client.read_coils(64, 1),
+                             await client.write_register(64, 1)):
+                assert response.isError() and response.exception_code == ILLEGAL_ADDRESS
+        finally:
+            client.close()
+            await modbus_core.stop_modbus()
+            server.cancel()
+            await asyncio.gather(server, return_exceptions=True)
+
+    asyncio.run(session())
+
+def test_journal_replay(tmp_path):
+    plc = PLCSimulator()
+    plc.start_journal(tmp_path / "plc.journal", checkpoint_interval=50)
+    drive(plc, 500)
+    plc.stop_journal()
+
+    replay = Replay(tmp_path / "plc.journal")
+    assert replay.run() == 500
+    assert replay.mismatches == []
+    assert replay.plc.capture_state() == plc.capture_state()
+
+    # Seeking replays from the checkpoint before the scan
+    replay.seek(275)
+    assert replay.scan == 275
+
+def test_checkpoint_restore(tmp_path):
+    plc = PLCSimulator()
+    checkpoints = FleetCheckpoints(tmp_path)
+    assert not checkpoints.attach(1, plc)
+    drive(plc, 200)
+    checkpoints.close()  # Final checkpoint of the stopped PLC
+
+    restored = PLCSimulator()
+    assert FleetCheckpoints(tmp_path).attach(1, restored)
+    assert restored.scan_count == 200
+    assert restored.capture_state() == plc.capture_state()
+
+def test_checkpoint_torn_slot(tmp_path):
+    plc = PLCSimulator()
+    state = plc.capture_state()
+    lengths = [len(part) for part in state]
+    checkpoint = CheckpointFile(tmp_path / "plc.checkpoint", fingerprint(plc), lengths)
+    checkpoint.write(1, 1.0, state)
+    drive(plc, 10)
+    checkpoint.write(2, 2.0, plc.capture_state())
+    # Corrupt the data of the newest slot: its CRC no longer matches
+    offset = checkpoint._slot(1) + SLOT.size
+    checkpoint._mmap[offset] ^= 0xFF
+    checkpoint.close()
+
+    reopened = CheckpointFile(tmp_path / "plc.checkpoint", fingerprint(plc), lengths)
+    scan, stamp, parts = reopened.read()
+    assert (scan, stamp, parts) == (1, 1.0, state)
+    reopened.close()
+
+def test_plan_reads_limits():
+    assert plan_reads(np.arange(300), "holding_registers") == [(0, 125), (125, 125), (250, 50)]
+    assert plan_reads(np.arange(4100), "coils") == [(0, 2000), (2000, 2000), (4000, 100)]
+    # Holes up to `gap` points are read through, wider ones split the read
+    assert plan_reads([0, 9], "holding_registers", gap=8) == [(0, 10)]
+    assert plan_reads([0, 10], "holding_registers", gap=8) == [(0, 1), (10, 1)]
+    assert plan_reads([], "input_registers") == []